@@ -0,0 +1,154 @@
+"""数据库快照：备份与恢复
+
+备份使用 SQLite 在线备份接口，每步复制 BACKUP_STEP_PAGES 页，在后台线程中执行，期间其他连接照常读写。
+回滚日志模式（'default' 存储配置）下读取会阻塞写入提交，备份每步之间暂停 BACKUP_STEP_SLEEP 秒让写入进行；
+备份期间有写入时会从头重新复制，重新开始超过 BACKUP_MAX_RESTARTS 次（一直在写入）时放弃本次备份。
+快照保存在数据库文件所在目录的 backups 文件夹中，只保留最新的 BACKUP_KEEP 个。
+恢复同样通过备份接口写回当前数据库，在一个事务中完成，不需要关闭程序或替换文件。
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.request import pathname2url
+
+import database
+
+BACKUP_DIR_NAME = 'backups'
+BACKUP_KEEP = 10
+# 每步复制的页数（4KB 页时 16MB），每步之后报告一次进度
+BACKUP_STEP_PAGES = 4096
+# 回滚日志模式下每步之间的暂停（秒），其他连接在暂停时提交写入
+BACKUP_STEP_SLEEP = 0.05
+BACKUP_MAX_RESTARTS = 10
+
+_TIME_FORMAT = '%Y%m%d-%H%M%S-%f'
+_PARTIAL_SUFFIX = '.partial'
+# 同一时间只创建一个快照，清理未完成文件时不会删除正在写入的快照
+_snapshot_lock = threading.Lock()
+
+
+def backup_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_PATH)), BACKUP_DIR_NAME)
+
+
+def _snapshot_prefix():
+    return os.path.splitext(os.path.basename(database.DB_PATH))[0] + '-'
+
+
+def list_snapshots():
+    """返回已有的快照 [{'path', 'created', 'size'}]，最新的在前"""
+    directory, prefix = backup_dir(), _snapshot_prefix()
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith(prefix) and name.endswith('.db')):
+            continue
+        try:
+            created = datetime.strptime(name[len(prefix):-len('.db')], _TIME_FORMAT)
+        except ValueError:
+            continue
+        path = os.path.join(directory, name)
+        snapshots.append({'path': path, 'created': created, 'size': os.path.getsize(path)})
+    snapshots.sort(key=lambda snapshot: snapshot['created'], reverse=True)
+    return snapshots
+
+
+def rotate_snapshots(keep=None):
+    """删除最新的 keep 个（默认 BACKUP_KEEP）之外的快照和中断留下的未完成文件，返回删除的快照数"""
+    keep = BACKUP_KEEP if keep is None else keep
+    directory = backup_dir()
+    for name in os.listdir(directory):
+        if name.endswith(_PARTIAL_SUFFIX):
+            os.remove(os.path.join(directory, name))
+    expired = list_snapshots()[keep:]
+    for snapshot in expired:
+        os.remove(snapshot['path'])
+    return len(expired)
+
+
+def _copy(source, target, progress, pause=0.0):
+    copied = [0]
+    restarts = [0]
+    def on_step(status, remaining, total):
+        if total - remaining <= copied[0]:
+            # 其他连接的写入让备份从头开始
+            restarts[0] += 1
+            if restarts[0] > BACKUP_MAX_RESTARTS:
+                raise RuntimeError(f"备份期间数据库一直有写入，已重新复制 {BACKUP_MAX_RESTARTS} 次，请稍后再试")
+        copied[0] = total - remaining
+        if progress:
+            progress(total - remaining, total)
+        # 两步之间备份不持有源数据库的锁（backup 的 sleep 参数只在遇到锁时才暂停）
+        if pause and remaining:
+            time.sleep(pause)
+    source.backup(target, pages=BACKUP_STEP_PAGES, progress=on_step)
+
+
+def create_snapshot(progress=None):
+    """为当前数据库创建一个快照，返回快照路径；progress(已复制页数, 总页数) 在每一步之后调用
+
+    快照先写入 .partial 文件，复制完成后再改名，中途退出不会留下不完整的快照。
+    """
+    with _snapshot_lock:
+        return _create_snapshot(progress)
+
+
+def _create_snapshot(progress):
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{_snapshot_prefix()}{datetime.now().strftime(_TIME_FORMAT)}.db")
+    partial = path + _PARTIAL_SUFFIX
+    source = database.get_db_connection()
+    target = sqlite3.connect(partial)
+    try:
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            # 在源连接上保持读事务：分步复制期间其他连接的写入不会让备份从头开始，
+            # 快照是开始备份时的一致状态（WAL 模式下读事务不阻塞写入）
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            _copy(source, target, progress)
+            source.rollback()
+        else:
+            # 回滚日志模式下持有读事务会让其他连接一直无法提交；每步之间释放锁，
+            # 期间的写入让备份重新开始，快照是最后一次重新开始时的一致状态
+            _copy(source, target, progress, pause=BACKUP_STEP_SLEEP)
+        # 快照单独保存为一个文件，不使用 WAL
+        target.execute('PRAGMA journal_mode = DELETE')
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(partial, path)
+    removed = rotate_snapshots()
+    print(f"已创建数据库快照: {path}" + (f"，删除了 {removed} 个旧快照" if removed else ""))
+    return path
+
+
+def restore_snapshot(path, progress=None):
+    """用快照替换当前数据库的全部内容；progress 同 create_snapshot
+
+    写入在一个事务中完成：恢复期间其他连接读取的仍是原来的数据，失败时当前数据库不变。
+    快照早于结构升级时，恢复后执行还没有执行的迁移。
+    """
+    source = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro', uri=True)
+    try:
+        if not source.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products'").fetchone():
+            raise ValueError(f"不是商品数据库的快照: {path}")
+        target = database.get_db_connection()
+        try:
+            _copy(source, target, progress)
+            # 恢复写入的 WAL 与数据库一样大，写回数据库文件后截短
+            target.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        finally:
+            target.close()
+    finally:
+        source.close()
+    database.close_read_connections()
+    database.init_db()
+    print(f"已从快照恢复数据库: {path}")
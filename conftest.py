@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+测试共用的临时数据库
+"""
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def empty_db(tmp_path, monkeypatch):
+    """使用还没有建表的临时数据库，避免影响 products.db；结束时关闭连到它的只读连接"""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(database, '_rows_written', 0)
+    yield database
+    database.close_read_connections()
+
+
+@pytest.fixture
+def temp_db(empty_db):
+    """使用已初始化的临时数据库"""
+    database.init_db()
+    return database
@@ -0,0 +1,119 @@
+import database
+from pricing import parse_product_ids
+
+
+class IntervalTree:
+    """静态区间树：区间按开始日期排序后建成平衡二叉树，每个节点记录子树内最晚的结束日期
+
+    日期为 'YYYY-MM-DD' 字符串，可以直接比较大小；区间两端都包含。
+    查询与 [start, end] 重叠的区间为 O(log n + k)。
+    """
+    def __init__(self, intervals):
+        # intervals: [(开始日期, 结束日期, 数据)]
+        self._intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._max_end = [None] * len(self._intervals)
+        self._build(0, len(self._intervals))
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __iter__(self):
+        return (data for _, _, data in self._intervals)
+
+    def _build(self, lo, hi):
+        """以 [lo, hi) 的中点为根，返回子树内最晚的结束日期"""
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self._intervals[mid][1]
+        for child_end in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child_end is not None and child_end > max_end:
+                max_end = child_end
+        self._max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        """返回与 [start, end] 重叠的所有区间的数据"""
+        result = []
+        stack = [(0, len(self._intervals))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            # 子树内所有区间都在查询开始之前结束
+            if self._max_end[mid] < start:
+                continue
+            interval_start, interval_end, data = self._intervals[mid]
+            stack.append((lo, mid))
+            # 右子树的开始日期都不早于当前节点，当前节点已晚于查询结束时右边不可能重叠
+            if interval_start <= end:
+                if interval_end >= start:
+                    result.append(data)
+                stack.append((mid + 1, hi))
+        return result
+
+
+def _coupon_dict(coupon):
+    return dict(coupon) if isinstance(coupon, dict) else dict(zip(database.COUPON_COLUMNS, coupon))
+
+
+def shared_products(coupon_a, coupon_b):
+    """两张优惠券共同适用的货品：全店券与任意券都重叠（返回 None），指定货品券返回交集"""
+    products_a = parse_product_ids(coupon_a.get('product_ids'))
+    products_b = parse_product_ids(coupon_b.get('product_ids'))
+    if products_a is None:
+        return None if products_b is None else set(products_b)
+    if products_b is None:
+        return set(products_a)
+    return set(products_a) & set(products_b)
+
+
+class CouponConflictIndex:
+    """按 (店铺, 类型) 分组建立有效期区间树，用于查找同店铺同类型、适用货品重叠且有效期重叠的优惠券"""
+    def __init__(self, coupons):
+        groups = {}
+        for coupon in coupons:
+            coupon_dict = _coupon_dict(coupon)
+            if not coupon_dict.get('is_active') or not coupon_dict.get('start_date') or not coupon_dict.get('end_date'):
+                continue
+            key = (coupon_dict['shop'], coupon_dict['coupon_type'])
+            groups.setdefault(key, []).append((coupon_dict['start_date'], coupon_dict['end_date'], coupon_dict))
+        self._trees = {key: IntervalTree(intervals) for key, intervals in groups.items()}
+
+    def conflicts_for(self, coupon):
+        """返回与指定优惠券冲突的优惠券 [(优惠券, 共同货品)]，共同货品为 None 表示全店"""
+        coupon_dict = _coupon_dict(coupon)
+        tree = self._trees.get((coupon_dict['shop'], coupon_dict['coupon_type']))
+        if tree is None or not coupon_dict.get('is_active'):
+            return []
+        conflicts = []
+        for other in tree.overlapping(coupon_dict['start_date'], coupon_dict['end_date']):
+            if coupon_dict.get('id') is not None and other['id'] == coupon_dict['id']:
+                continue
+            products = shared_products(coupon_dict, other)
+            if products is None or products:
+                conflicts.append((other, products))
+        return conflicts
+
+    def report(self):
+        """全部冲突 [(优惠券A, 优惠券B, 共同货品)]，每对只出现一次"""
+        pairs = []
+        for tree in self._trees.values():
+            for coupon_dict in tree:
+                for other, products in self.conflicts_for(coupon_dict):
+                    if other['id'] > coupon_dict['id']:
+                        pairs.append((coupon_dict, other, products))
+        pairs.sort(key=lambda pair: (pair[0]['shop'], pair[0]['start_date'], pair[0]['id'], pair[1]['id']))
+        return pairs
+
+
+def find_coupon_conflicts(coupon_data):
+    """保存前检查：只加载同一店铺的优惠券建立索引"""
+    index = CouponConflictIndex(database.get_coupons_by_shop(coupon_data.get('shop')))
+    return index.conflicts_for(coupon_data)
+
+
+def build_conflict_report():
+    """检查所有已启用优惠券之间的冲突"""
+    return CouponConflictIndex(database.get_all_coupons()).report()
@@ -0,0 +1,144 @@
+import json
+import re
+
+import pandas as pd
+
+import database
+
+# 优惠券导入表的列名
+COUPON_SHEET_COLUMNS = {
+    'shop': '店铺',
+    'coupon_type': '类型',
+    'amount': '面额/折扣',
+    'min_price': '最低消费',
+    'start_date': '开始日期',
+    'end_date': '结束日期',
+    'description': '描述',
+    'is_active': '状态',
+    'product_ids': '适用货品'
+}
+REQUIRED_SHEET_COLUMNS = ['shop', 'coupon_type', 'amount', 'start_date', 'end_date']
+
+# 类型列接受中文名称或内部名称
+COUPON_TYPE_ALIASES = {
+    '立减券': 'instant', '满减券': 'threshold', '折扣券': 'discount',
+    'instant': 'instant', 'threshold': 'threshold', 'discount': 'discount'
+}
+INACTIVE_VALUES = {'停用', '禁用', '否', '0', 'false', 'no'}
+
+_PRODUCT_ID_SEPARATORS = re.compile(r'[,，;；\s]+')
+
+
+def read_coupon_sheet(file_path, sheet_name=0):
+    """读取优惠券导入表，所有列按文本读取，日期列保留 Excel 原始类型交给校验统一解析"""
+    return pd.read_excel(file_path, sheet_name=sheet_name, dtype=object)
+
+
+def _text_column(df, column):
+    header = COUPON_SHEET_COLUMNS[column]
+    if header not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[header].fillna('').astype(str).str.strip()
+
+
+def _date_column(df, column):
+    header = COUPON_SHEET_COLUMNS[column]
+    parsed = pd.to_datetime(df[header], errors='coerce', format='mixed')
+    return parsed.dt.strftime('%Y-%m-%d')
+
+
+def validate_coupon_frame(df):
+    """按列校验整张导入表并解析适用货品（df 的行索引为读取时的行号，从 0 开始）
+
+    返回 (优惠券列表, 错误列表)，错误为 (Excel 行号, 说明)；
+    只要有错误就不应导入任何一行。
+    """
+    missing = [COUPON_SHEET_COLUMNS[col] for col in REQUIRED_SHEET_COLUMNS
+               if COUPON_SHEET_COLUMNS[col] not in df.columns]
+    if missing:
+        raise KeyError(f"缺少列: {', '.join(missing)}")
+
+    # Excel 行号按读取时的行索引计算（表头占第 1 行），去掉空行后其余行的行号不变
+    df = df.dropna(how='all')
+    row_numbers = df.index + 2
+    errors = []
+
+    def reject(mask, message):
+        for row_number in row_numbers[mask.to_numpy()]:
+            errors.append((int(row_number), message))
+
+    shop = _text_column(df, 'shop')
+    coupon_type = _text_column(df, 'coupon_type').str.lower().map(COUPON_TYPE_ALIASES)
+    amount = pd.to_numeric(df[COUPON_SHEET_COLUMNS['amount']], errors='coerce')
+    min_price = (pd.to_numeric(df[COUPON_SHEET_COLUMNS['min_price']], errors='coerce')
+                 if COUPON_SHEET_COLUMNS['min_price'] in df.columns
+                 else pd.Series(0.0, index=df.index))
+    min_price_blank = _text_column(df, 'min_price') == ''
+    start_date = _date_column(df, 'start_date')
+    end_date = _date_column(df, 'end_date')
+    is_discount = coupon_type == 'discount'
+
+    reject(shop == '', "店铺不能为空")
+    reject(coupon_type.isna(), "类型必须是立减券、满减券或折扣券")
+    reject(amount.isna(), "面额/折扣不是有效的数字")
+    # 折扣券与编辑窗口一致按百分比填写
+    reject(is_discount & amount.notna() & ((amount <= 0) | (amount >= 100)), "折扣必须在0-100之间")
+    reject(~is_discount & amount.notna() & (amount <= 0), "金额必须大于0")
+    reject(~min_price_blank & (min_price.isna() | (min_price < 0)), "最低消费不是有效的金额")
+    reject(start_date.isna(), "开始日期无效")
+    reject(end_date.isna(), "结束日期无效")
+    reject(start_date.notna() & end_date.notna() & (end_date < start_date), "结束日期早于开始日期")
+
+    # 店铺和适用货品按目录校验：一次查询取出所有涉及店铺的货品ID
+    catalog = pd.DataFrame(database.get_product_ids_by_shops(shop[shop != ''].unique()),
+                           columns=['shop', 'product_id'])
+    reject((shop != '') & ~shop.isin(catalog['shop']), "店铺不存在")
+
+    product_lists = _text_column(df, 'product_ids').map(
+        lambda text: [pid for pid in _PRODUCT_ID_SEPARATORS.split(text) if pid])
+    requested = (pd.DataFrame({'row': row_numbers, 'shop': shop, 'product_id': product_lists})
+                 .explode('product_id').dropna(subset=['product_id']))
+    if not requested.empty:
+        resolved = requested.merge(catalog.assign(known=True), on=['shop', 'product_id'], how='left')
+        unknown = resolved[resolved['known'].isna() & resolved['shop'].isin(catalog['shop'])]
+        for row, product_ids in unknown.groupby('row', sort=True)['product_id']:
+            shown = ', '.join(product_ids.head(5))
+            more = f" 等 {len(product_ids)} 个" if len(product_ids) > 5 else ''
+            errors.append((int(row), f"店铺中找不到货品ID: {shown}{more}"))
+
+    errors.sort()
+    if errors:
+        return [], errors
+
+    amount = amount.where(~is_discount, amount / 100)
+    is_active = ~_text_column(df, 'is_active').str.lower().isin(INACTIVE_VALUES)
+    description = _text_column(df, 'description')
+    coupons = []
+    for i in range(len(df)):
+        # 去重并保持填写顺序
+        product_ids = list(dict.fromkeys(product_lists.iat[i]))
+        coupons.append({
+            'shop': shop.iat[i],
+            'coupon_type': coupon_type.iat[i],
+            'amount': float(amount.iat[i]),
+            'min_price': 0.0 if min_price_blank.iat[i] else float(min_price.iat[i]),
+            'start_date': start_date.iat[i],
+            'end_date': end_date.iat[i],
+            'description': description.iat[i],
+            'is_active': 1 if is_active.iat[i] else 0,
+            'product_ids': json.dumps(product_ids) if product_ids else ''
+        })
+    return coupons, errors
+
+
+def import_coupons(file_path, sheet_name=0):
+    """校验并在一个事务中导入整张优惠券表，有任何错误时不导入"""
+    df = read_coupon_sheet(file_path, sheet_name).dropna(how='all')
+    coupons, errors = validate_coupon_frame(df)
+    imported = database.add_coupon_batch(coupons) if not errors else 0
+    return {
+        'total': len(df),
+        'imported': imported,
+        'errors': errors,
+        'shops': sorted({coupon['shop'] for coupon in coupons})
+    }
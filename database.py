@@ -1,5 +1,15 @@
 import sqlite3
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+# 数据库文件路径
+DB_PATH = 'products.db'
 
 # The order of columns used throughout the database logic
 DB_COLUMNS = [
@@ -8,41 +18,315 @@ DB_COLUMNS = [
     'category', 'warehouse', 'short_name', 'min_price', 'purchase_price'
 ]
 
+# 来自 Sheet3 / Sheet4 的列，保存在 sku_extensions / purchase_prices 表中，通过 product_details 视图读取
+_EXTENSION_COLUMNS = ['category', 'warehouse', 'short_name', 'min_price', 'purchase_price']
+
+# 店铺、分类、仓库以整数键保存在维度表中，products / sku_extensions 只存键，
+# product_details 视图再换回名称，读取时列名与 DB_COLUMNS 一致。
+# 商品行的空值也编码为名称 '' 的一行，所以 products 的维度键不为空
+_DIMENSIONS = {'shop': 'shops', 'category': 'categories', 'warehouse': 'warehouses'}
+
+# products 表实际存储的列（维度列换成对应的 *_id 列）
+_PRODUCT_TABLE_COLUMNS = [f'{col}_id' if col in _DIMENSIONS else col for col in DB_COLUMNS]
+
+# products / sku_extensions 的表结构，旧版数据库迁移重建表时使用同一定义
+_PRODUCTS_TABLE_SQL = '''(
+    spec_id TEXT PRIMARY KEY,
+    sku TEXT,
+    product_id TEXT,
+    name TEXT NOT NULL,
+    spec_name TEXT,
+    price REAL,
+    quantity INTEGER,
+    shop_id INTEGER NOT NULL REFERENCES shops (id),
+    category_id INTEGER NOT NULL REFERENCES categories (id),
+    warehouse_id INTEGER NOT NULL REFERENCES warehouses (id),
+    short_name TEXT,
+    min_price REAL,
+    purchase_price REAL,
+    spec_id_lower TEXT,
+    is_eligible INTEGER NOT NULL DEFAULT 0
+)'''
+_SKU_EXTENSIONS_TABLE_SQL = '''(
+    sku TEXT PRIMARY KEY,
+    category_id INTEGER REFERENCES categories (id),
+    warehouse_id INTEGER REFERENCES warehouses (id),
+    short_name TEXT,
+    min_price REAL
+)'''
+
 # 优惠券表列定义
 COUPON_COLUMNS = [
     'id', 'shop', 'coupon_type', 'amount', 'min_price', 
     'start_date', 'end_date', 'description', 'is_active', 'product_ids'
 ]
 
-def get_db_connection():
-    """Creates a connection to the database."""
-    conn = sqlite3.connect('products.db')
+# 利润计算参数（与价格分析页面的计算公式一致）
+SHIPPING_FEE_THRESHOLD = 150   # 到手价达到该值使用高价快递费
+SHIPPING_FEE_HIGH = 30
+SHIPPING_FEE_LOW = 2
+MISC_FEE_RATE = 0.10           # 杂费率 = 售后2% + 管理7% + 平台1%
+
+# 结束超过该天数的优惠券会被移入归档表
+COUPON_ARCHIVE_AFTER_DAYS = 30
+
+# 净利率档位：(档位, 下限(含), 上限(不含))，None 表示无界
+MARGIN_TIERS = [
+    ('healthy', 20, None),
+    ('normal', 10, 20),
+    ('warning', 0, 10),
+    ('loss', None, 0)
+]
+
+# 存储配置：打开连接时依次执行的 PRAGMA，可用 storage_benchmark.py 在实际数据库上比较
+# cache_size 为负数时单位是 KiB；写入连接每次打开新连接，页缓存只在一次操作内有效，
+# 只读连接池中的连接会保留页缓存；跨连接的复用依靠内存映射（mmap_size）和操作系统的文件缓存
+STORAGE_PROFILES = {
+    # SQLite 默认设置：回滚日志，导入时阻塞读取
+    'default': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'temp_store': 'DEFAULT',
+                'cache_size': -2000, 'mmap_size': 0},
+    # WAL：写入不阻塞读取；WAL 下 synchronous=NORMAL 断电最多丢失最后提交的事务，不会损坏数据库
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY',
+                 'cache_size': -64000, 'mmap_size': 256 * 1024 ** 2},
+    # 大数据库（约 2GB）：整个文件做内存映射，扫描时不再逐页 read
+    'large': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY',
+              'cache_size': -256000, 'mmap_size': 4 * 1024 ** 3},
+}
+STORAGE_PROFILE = 'balanced'
+
+# 数据库被锁定时等待的时间；只读查询等待超时后再按退避重试
+BUSY_TIMEOUT_MS = 5000
+READ_RETRIES = 3
+READ_RETRY_DELAY = 0.05  # 秒，每次重试翻倍
+# 只读连接池保留的空闲连接数
+READ_POOL_SIZE = 4
+# 一条语句中绑定参数的上限：较早版本的 SQLite 默认最多 999 个，IN 列表超过时分批查询
+MAX_SQL_VARIABLES = 999
+
+# 优惠券修改计数，用于让进程内缓存的到手价计算结果失效
+_coupon_revision = 0
+_shop_coupon_revisions = {}  # 店铺 -> 该店铺优惠券的修改计数
+
+# 上次收集统计信息（ANALYZE）以来本进程写入、替换或删除的行数，由 maintenance 决定何时重新收集
+_rows_written = 0
+
+def get_db_connection(profile=None):
+    """Creates a connection to the database and applies the storage profile (STORAGE_PROFILE by default)."""
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    for pragma, value in STORAGE_PROFILES[profile or STORAGE_PROFILE].items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+# 只读连接池：(数据库路径, 存储配置) -> 空闲连接。浏览和搜索使用只读连接，
+# WAL 模式下每条查询读取开始时的一致快照，导入等大批量写入进行中也不会被阻塞
+_read_pool = {}
+_read_pool_lock = threading.Lock()
+
+def _open_read_connection(profile):
+    uri = f'file:{pathname2url(os.path.abspath(DB_PATH))}?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma, value in STORAGE_PROFILES[profile].items():
+        # 日志模式由写入连接设置，只读连接不能修改
+        if pragma != 'journal_mode':
+            conn.execute(f'PRAGMA {pragma} = {value}')
     return conn
 
-def init_db():
-    """Initializes the database and creates the products table and indexes if they don't exist."""
+@contextmanager
+def read_connection():
+    """从只读连接池取一个连接，用完放回；出错的连接直接关闭"""
+    key = (DB_PATH, STORAGE_PROFILE)
+    with _read_pool_lock:
+        idle = _read_pool.get(key)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open_read_connection(STORAGE_PROFILE)
+    try:
+        yield conn
+    except BaseException:
+        conn.close()
+        raise
+    with _read_pool_lock:
+        idle = _read_pool.setdefault(key, [])
+        if len(idle) < READ_POOL_SIZE:
+            idle.append(conn)
+            conn = None
+    if conn is not None:
+        conn.close()
+
+def close_read_connections():
+    """关闭所有空闲的只读连接（替换或删除数据库文件之前调用）"""
+    with _read_pool_lock:
+        connections = [conn for idle in _read_pool.values() for conn in idle]
+        _read_pool.clear()
+    for conn in connections:
+        conn.close()
+
+def _is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def _read(query):
+    """在只读连接上执行 query(conn)；busy_timeout 之后仍被锁定时按退避重试"""
+    for attempt in range(READ_RETRIES + 1):
+        try:
+            with read_connection() as conn:
+                return query(conn)
+        except sqlite3.OperationalError as e:
+            if attempt == READ_RETRIES or not _is_busy_error(e):
+                raise
+            time.sleep(READ_RETRY_DELAY * 2 ** attempt)
+
+def _fetch(sql, params, fetch):
+    def query(conn):
+        # 关闭游标以结束读事务，放回连接池的连接不保留旧快照
+        cursor = conn.execute(sql, params)
+        try:
+            return fetch(cursor)
+        finally:
+            cursor.close()
+    return _read(query)
+
+def _read_all(sql, params=()):
+    return _fetch(sql, params, lambda cursor: cursor.fetchall())
+
+def _read_one(sql, params=()):
+    return _fetch(sql, params, lambda cursor: cursor.fetchone())
+
+class MigrationDeferred(Exception):
+    """迁移步骤暂时无法执行（如磁盘空间不足），数据库保持原样，下次启动时再执行"""
+
+def init_db(progress=None):
+    """按 PRAGMA user_version 依次执行还没有执行过的结构迁移
+
+    数据库已是最新版本时只读取一次版本号。每一步迁移在一个事务中执行并更新版本号（VACUUM 等不能在事务中执行的步骤除外），
+    中途退出时下次启动从未完成的那一步继续。progress(已完成步数, 总步数, 说明) 在每一步开始前
+    和全部完成后调用，用于显示进度。
+    返回 None；某一步抛出 MigrationDeferred 时停在这一步（不更新版本号）并返回说明原因的消息。
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        pending = _MIGRATIONS[version:]
+        for step, (description, migrate) in enumerate(pending):
+            if progress:
+                progress(step, len(pending), description)
+            if migrate in _MIGRATIONS_WITHOUT_TRANSACTION:
+                # VACUUM 不能在事务中执行；这类步骤可以重复执行，中途退出时下次重新执行
+                try:
+                    migrate(conn.cursor())
+                except MigrationDeferred as e:
+                    print(f"数据库升级暂停在「{description}」: {e}")
+                    return str(e)
+                conn.execute(f'PRAGMA user_version = {version + step + 1}')
+                continue
+            conn.execute('BEGIN')
+            try:
+                migrate(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version + step + 1}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if pending and progress:
+            progress(len(pending), len(pending), '数据库升级完成')
+    finally:
+        conn.close()
+
+def get_pending_migrations():
+    """返回还没有执行的迁移说明列表，为空表示数据库结构已是最新版本"""
+    conn = get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return [description for description, _ in _MIGRATIONS[version:]]
+
+# 商品是否有效且启用：规格ID不在无效列表中，且规格编码为空、为通配符 * 或在启用列表中
+_ELIGIBLE_SQL = '''CASE
+    WHEN EXISTS (SELECT 1 FROM invalid_spec_ids WHERE invalid_spec_id = lower({row}.spec_id)) THEN 0
+    WHEN {row}.sku IS NULL OR {row}.sku IN ('', '*')
+         OR EXISTS (SELECT 1 FROM enabled_skus WHERE enabled_sku = {row}.sku) THEN 1
+    ELSE 0 END'''
+
+def _init_eligibility(cursor):
+    """维护 products 表 spec_id_lower（小写规格ID）和 is_eligible（有效且启用）列的触发器
+
+    商品写入时由触发器只计算该行；无效规格ID或启用规格编码变化时，
+    由 _replace_code_list 只重算对应规格ID或规格编码的商品。
+    """
+    row_update = f'''UPDATE products SET spec_id_lower = lower(NEW.spec_id), is_eligible = {_ELIGIBLE_SQL.format(row='NEW')}
+                     WHERE rowid = NEW.rowid;'''
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_products_eligible_insert
+                       AFTER INSERT ON products BEGIN {row_update} END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_products_eligible_update
+                       AFTER UPDATE OF spec_id, sku ON products BEGIN {row_update} END''')
+
+def _table_columns(cursor, table):
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+
+def _encode_dimensions(cursor):
+    """旧版数据库迁移：店铺、分类、仓库的文本写入维度表，重建 products（以及 sku_extensions）为只存整数键"""
+    encode_extensions = 'category' in _table_columns(cursor, 'sku_extensions')
+    for column, table in _DIMENSIONS.items():
+        sources = [f"SELECT COALESCE({column}, '') AS name FROM products"]
+        if encode_extensions and column != 'shop':
+            sources.append(f'SELECT {column} FROM sku_extensions')
+        cursor.execute(f'''INSERT OR IGNORE INTO {table} (name)
+                           SELECT DISTINCT name FROM ({' UNION ALL '.join(sources)})
+                           WHERE name IS NOT NULL ORDER BY name''')
+    
+    # 视图和旧表上的触发器、索引随旧表一起删除，由之后的迁移步骤重新创建
+    cursor.execute('DROP VIEW IF EXISTS product_details')
+    columns = [f"(SELECT id FROM {_DIMENSIONS[col]} WHERE name = COALESCE(p.{col}, ''))" if col in _DIMENSIONS
+               else f'p.{col}' for col in DB_COLUMNS]
+    cursor.execute(f'CREATE TABLE products_encoded {_PRODUCTS_TABLE_SQL}')
+    cursor.execute(f'''INSERT INTO products_encoded ({", ".join(_PRODUCT_TABLE_COLUMNS)}, spec_id_lower, is_eligible)
+                       SELECT {", ".join(columns)}, lower(p.spec_id), {_ELIGIBLE_SQL.format(row='p')}
+                       FROM products p''')
+    cursor.execute('DROP TABLE products')
+    cursor.execute('ALTER TABLE products_encoded RENAME TO products')
+    
+    if encode_extensions:
+        cursor.execute(f'CREATE TABLE sku_extensions_encoded {_SKU_EXTENSIONS_TABLE_SQL}')
+        cursor.execute('''INSERT INTO sku_extensions_encoded (sku, category_id, warehouse_id, short_name, min_price)
+                          SELECT e.sku, (SELECT id FROM categories WHERE name = e.category),
+                                 (SELECT id FROM warehouses WHERE name = e.warehouse), e.short_name, e.min_price
+                          FROM sku_extensions e''')
+        cursor.execute('DROP TABLE sku_extensions')
+        cursor.execute('ALTER TABLE sku_extensions_encoded RENAME TO sku_extensions')
+    print("数据库已更新：店铺、分类、仓库改为维度表整数键")
+
+def _dimension_name(value):
+    """维度值统一为文本，None 不编码（键为 NULL）"""
+    return None if value is None else str(value)
+
+def _dimension_ids(cursor, column, names):
+    """返回维度 column 的 {名称: 整数键}，维度表中还没有的名称先插入"""
+    table = _DIMENSIONS[column]
+    names = {_dimension_name(name) for name in names} - {None}
+    cursor.executemany(f'INSERT OR IGNORE INTO {table} (name) VALUES (?)', [(name,) for name in sorted(names)])
+    return {name: id_ for id_, name in cursor.execute(f'SELECT id, name FROM {table}').fetchall()}
+
+def _encode_product_rows(cursor, rows):
+    """把 DB_COLUMNS 顺序的商品行转换为 _PRODUCT_TABLE_COLUMNS 顺序（店铺、分类、仓库名称换成整数键）"""
+    positions = {column: DB_COLUMNS.index(column) for column in _DIMENSIONS}
+    ids = {column: _dimension_ids(cursor, column, [''] + [row[i] for row in rows]) for column, i in positions.items()}
+    encoded = []
+    for row in rows:
+        row = list(row)
+        for column, i in positions.items():
+            row[i] = ids[column][_dimension_name(row[i]) or '']
+        encoded.append(row)
+    return encoded
+
+def _migrate_tables(cursor):
+    """创建数据表（引入版本号之前的数据库中可能已存在），补齐优惠券表缺少的列"""
+    # 维度表：名称唯一，整数键由 products / sku_extensions 引用
+    for table in _DIMENSIONS.values():
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
     
     # 创建商品表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            spec_id TEXT PRIMARY KEY,
-            sku TEXT,
-            product_id TEXT,
-            name TEXT NOT NULL,
-            spec_name TEXT,
-            price REAL,
-            quantity INTEGER,
-            shop TEXT,
-            category TEXT,
-            warehouse TEXT,
-            short_name TEXT,
-            min_price REAL,
-            purchase_price REAL
-        )
-    ''')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS products {_PRODUCTS_TABLE_SQL}')
     
     # 创建优惠券表
     cursor.execute('''
@@ -61,58 +345,26 @@ def init_db():
     ''')
     
     # 检查并添加 product_ids 列（用于数据库迁移）
-    try:
-        cursor.execute("SELECT product_ids FROM coupons LIMIT 1")
-    except sqlite3.OperationalError:
-        # 如果列不存在，添加它
+    if 'product_ids' not in _table_columns(cursor, 'coupons'):
         cursor.execute("ALTER TABLE coupons ADD COLUMN product_ids TEXT")
         print("数据库已更新：添加 product_ids 列")
     
-    # 检查并添加新的商品字段
-    new_columns = [
-        ('category', 'TEXT'),
-        ('warehouse', 'TEXT'), 
-        ('short_name', 'TEXT'),
-        ('min_price', 'REAL'),
-        ('purchase_price', 'REAL')
-    ]
-    
-    for column_name, column_type in new_columns:
-        try:
-            cursor.execute(f"SELECT {column_name} FROM products LIMIT 1")
-        except sqlite3.OperationalError:
-            # 如果列不存在，添加它
-            cursor.execute(f"ALTER TABLE products ADD COLUMN {column_name} {column_type}")
-            print(f"数据库已更新：添加 {column_name} 列")
-    
-    # 检查并添加新的商品字段
-    new_columns = [
-        ('category', 'TEXT'),
-        ('warehouse', 'TEXT'), 
-        ('short_name', 'TEXT'),
-        ('min_price', 'REAL'),
-        ('purchase_price', 'REAL')
-    ]
-    
-    for column_name, column_type in new_columns:
-        try:
-            cursor.execute(f"SELECT {column_name} FROM products LIMIT 1")
-        except sqlite3.OperationalError:
-            # 如果列不存在，添加它
-            cursor.execute(f"ALTER TABLE products ADD COLUMN {column_name} {column_type}")
-            print(f"数据库已更新：添加 {column_name} 列")
-    
-    # Add indexes to speed up searching
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_name ON products (name)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_spec_name ON products (spec_name)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_id ON products (product_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku ON products (sku)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shop ON products (shop)')
-    
-    # 优惠券表索引
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_shop ON coupons (shop)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_active ON coupons (is_active)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_dates ON coupons (start_date, end_date)')
+    # 优惠券归档表：结构与 coupons 相同，保留原ID并记录归档日期
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS coupons_archive (
+            id INTEGER PRIMARY KEY,
+            shop TEXT NOT NULL,
+            coupon_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            min_price REAL DEFAULT 0,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            description TEXT,
+            is_active INTEGER DEFAULT 1,
+            product_ids TEXT,
+            archived_at TEXT
+        )
+    ''')
     
     # 创建无效规格ID表
     cursor.execute('''
@@ -120,6 +372,7 @@ def init_db():
             invalid_spec_id TEXT PRIMARY KEY
         )
     ''')
+    _normalize_invalid_spec_ids(cursor)
     
     # 创建启用SKU表
     cursor.execute('''
@@ -128,8 +381,153 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Sheet3 的扩展信息按规格编码保存，Sheet4 的采购价按简称保存，读取时再关联
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS sku_extensions {_SKU_EXTENSIONS_TABLE_SQL}')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_prices (
+            short_name TEXT PRIMARY KEY,
+            price REAL
+        )
+    ''')
+
+def _normalize_invalid_spec_ids(cursor):
+    """旧版数据库保存的无效规格ID保留原始大小写（读取时才转小写），统一改为小写并去重，
+    之后才能与 lower(spec_id) 比较。必须在回填 is_eligible 之前执行"""
+    if not cursor.execute('''SELECT 1 FROM invalid_spec_ids
+                             WHERE invalid_spec_id != lower(invalid_spec_id) LIMIT 1''').fetchone():
+        return
+    cursor.execute('''INSERT OR IGNORE INTO invalid_spec_ids (invalid_spec_id)
+                      SELECT lower(invalid_spec_id) FROM invalid_spec_ids''')
+    cursor.execute('DELETE FROM invalid_spec_ids WHERE invalid_spec_id != lower(invalid_spec_id)')
+    if 'is_eligible' in _table_columns(cursor, 'products'):
+        eligible = _ELIGIBLE_SQL.format(row='products')
+        cursor.execute(f'UPDATE products SET is_eligible = {eligible} WHERE is_eligible != {eligible}')
+    print("数据库已更新：无效规格ID统一为小写")
+
+def _migrate_dimensions(cursor):
+    """旧版数据库的店铺、分类、仓库文本换成维度表整数键（重建商品表）"""
+    if 'shop' not in _table_columns(cursor, 'products'):
+        return
+    # 旧版数据库：先补齐缺少的列，再把店铺、分类、仓库文本换成维度表的整数键
+    for column_name, column_type in [('category', 'TEXT'), ('warehouse', 'TEXT'), ('short_name', 'TEXT'),
+                                     ('min_price', 'REAL'), ('purchase_price', 'REAL')]:
+        if column_name not in _table_columns(cursor, 'products'):
+            cursor.execute(f"ALTER TABLE products ADD COLUMN {column_name} {column_type}")
+            print(f"数据库已更新：添加 {column_name} 列")
+    _encode_dimensions(cursor)
+
+def _migrate_indexes(cursor):
+    """按查询形状创建索引"""
+    # 优惠券表索引（按店铺的查询由 idx_coupon_shop_start 和 idx_coupon_active_shop_window 覆盖）
+    cursor.execute('DROP INDEX IF EXISTS idx_coupon_shop')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_active ON coupons (is_active)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_dates ON coupons (start_date, end_date)')
+    # 只索引已启用的优惠券：按结束日期范围扫描即可跳过已过期的券；
+    # 这就是 (shop, is_active, start_date, end_date) 形状的查询所用的索引，is_active = 1 放在索引条件中
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_coupon_active_shop_window
+                      ON coupons (shop, end_date, start_date) WHERE is_active = 1''')
+    
+    # 优惠券列表按 店铺、开始日期倒序 分页，索引顺序与排序一致可避免临时排序
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_shop_start ON coupons (shop, start_date DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_coupon_archive_shop_start ON coupons_archive (shop, start_date DESC)')
+    
+    # Add indexes to speed up searching
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_name ON products (name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_spec_name ON products (spec_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_id ON products (product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku ON products (sku)')
+    # 商品列表按 店铺名称、商品名称、规格ID 排序：依次按名称顺序取店铺，再按该索引取店铺内的商品；
+    # 分页只在索引上跳过 OFFSET 行（rowid 包含在索引中），规格ID保证同名商品的翻页顺序稳定
+    cursor.execute('DROP INDEX IF EXISTS idx_shop_name')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shop_name_spec ON products (shop_id, name, spec_id)')
+    # 总览的平均价格只统计有价格的商品，部分索引即可覆盖该查询（条件须与查询的 price > 0 完全一致）。
+    # 利润分析按 CAST(price AS REAL) > 0 筛选并读取每个商品的全部计价字段，用不到该索引。
+    # 各索引有无时的查询计划和耗时用 index_benchmark.py 对比
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_priced_products ON products (price) WHERE price > 0')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku_extensions_short_name ON sku_extensions (short_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_spec_id_lower ON products (spec_id_lower)')
+    # 货品选择器按店铺取有效货品并按货品ID分组
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_eligible_shop_product
+                      ON products (shop_id, product_id) WHERE is_eligible = 1''')
+
+def _migrate_views(cursor):
+    """商品有效性触发器和商品明细视图"""
+    _init_eligibility(cursor)
+    _create_product_details_view(cursor)
+
+def _create_product_details_view(cursor):
+    """商品明细视图：扩展信息和采购价优先取关联表，没有关联数据时使用商品行自身的值；
+    店铺、分类、仓库换回名称。修改视图时追加一步调用本函数的迁移"""
+    cursor.execute('DROP VIEW IF EXISTS product_details')
+    cursor.execute(f'''
+        CREATE VIEW product_details AS
+        SELECT p.rowid AS rowid, {", ".join(f"p.{col}" for col in DB_COLUMNS if col not in _EXTENSION_COLUMNS and col not in _DIMENSIONS)},
+               s.name AS shop,
+               c.name AS category,
+               w.name AS warehouse,
+               COALESCE(e.short_name, p.short_name) AS short_name,
+               COALESCE(e.min_price, p.min_price) AS min_price,
+               COALESCE(pp.price, p.purchase_price) AS purchase_price,
+               p.is_eligible, p.shop_id,
+               COALESCE(e.category_id, p.category_id) AS category_id,
+               COALESCE(e.warehouse_id, p.warehouse_id) AS warehouse_id
+        FROM products p
+        LEFT JOIN shops s ON s.id = p.shop_id
+        LEFT JOIN sku_extensions e ON e.sku = p.sku
+        LEFT JOIN categories c ON c.id = COALESCE(e.category_id, p.category_id)
+        LEFT JOIN warehouses w ON w.id = COALESCE(e.warehouse_id, p.warehouse_id)
+        LEFT JOIN purchase_prices pp ON pp.short_name = COALESCE(e.short_name, p.short_name)
+    ''')
+
+def _vacuum_space_needed():
+    """VACUUM 需要的剩余空间 {目录: 字节数}：临时目录中的临时数据库和数据库目录中的日志都与数据库文件一样大，
+    两个目录在同一个磁盘上时需要两倍"""
+    size = os.path.getsize(DB_PATH)
+    needed = {}
+    for directory in (tempfile.gettempdir(), os.path.dirname(os.path.abspath(DB_PATH))):
+        device = os.stat(directory).st_dev
+        shared, total = needed.get(device, (directory, 0))
+        needed[device] = (shared, total + size)
+    return dict(needed.values())
+
+def _migrate_auto_vacuum(cursor):
+    """auto_vacuum 改为 INCREMENTAL，之后删除数据留下的空闲页可以由 reclaim_free_pages 分步回收。
+    已有数据的数据库需要 VACUUM 重建一次文件才会生效。
+
+    磁盘空间不足或 VACUUM 失败时抛出 MigrationDeferred，数据库不变，下次启动时再执行。
+    这一步不改变表结构，推迟期间程序照常使用；它之后追加的迁移也会一起推迟。
+    """
+    if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return
+    for directory, needed in _vacuum_space_needed().items():
+        free = shutil.disk_usage(directory).free
+        if free < needed:
+            raise MigrationDeferred(f"磁盘空间不足：重建数据库文件需要 {directory} 有 {needed / 1024 ** 2:.0f} MB "
+                                    f"剩余空间，当前只有 {free / 1024 ** 2:.0f} MB。释放空间后下次启动时会再次执行")
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # VACUUM 的临时数据库与原数据库一样大，不能放在内存中
+    cursor.execute('PRAGMA temp_store = FILE')
+    try:
+        cursor.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        raise MigrationDeferred(f"重建数据库文件失败（{e}），数据未受影响，下次启动时会再次执行") from e
+    finally:
+        cursor.execute(f"PRAGMA temp_store = {STORAGE_PROFILES[STORAGE_PROFILE]['temp_store']}")
+    print("数据库已更新：启用增量空间回收")
+
+# 数据库结构迁移，按顺序执行，PRAGMA user_version 记录已完成的步数。
+# 版本 0 是引入版本号之前的数据库，结构不确定，所以这几步都可以在任何旧结构上重复执行。
+# 修改结构时在末尾追加新的迁移，不要修改已有的步骤
+_MIGRATIONS = [
+    ('创建数据表', _migrate_tables),
+    ('店铺、分类、仓库改为维度表整数键', _migrate_dimensions),
+    ('创建索引', _migrate_indexes),
+    ('创建商品有效性触发器和明细视图', _migrate_views),
+    ('启用增量空间回收（重建数据库文件，数据库较大时需要几分钟）', _migrate_auto_vacuum),
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+# 不在事务中执行的迁移步骤
+_MIGRATIONS_WITHOUT_TRANSACTION = {_migrate_auto_vacuum}
 
 def add_product_batch(products):
     """Adds or replaces a batch of products, returning stats on the operation."""
@@ -142,11 +540,12 @@ def add_product_batch(products):
     cursor.execute('SELECT COUNT(*) FROM products')
     initial_row_count = cursor.fetchone()[0]
 
-    placeholders = ', '.join(['?'] * len(DB_COLUMNS))
-    sql = f'''INSERT OR REPLACE INTO products ({", ".join(DB_COLUMNS)}) 
+    placeholders = ', '.join(['?'] * len(_PRODUCT_TABLE_COLUMNS))
+    sql = f'''INSERT OR REPLACE INTO products ({", ".join(_PRODUCT_TABLE_COLUMNS)}) 
              VALUES ({placeholders})'''
-    cursor.executemany(sql, products)
+    cursor.executemany(sql, _encode_product_rows(cursor, products))
     conn.commit()
+    _note_rows_written(len(products))
 
     cursor.execute('SELECT COUNT(*) FROM products')
     final_row_count = cursor.fetchone()[0]
@@ -159,52 +558,42 @@ def add_product_batch(products):
 
     return {'added': net_rows_added, 'updated': rows_updated}
 
+# 按 店铺名称、商品名称、规格ID 顺序读取商品明细：先按名称索引取店铺，再用 idx_shop_name_spec 取店铺内商品，不需要整表排序
+_BY_SHOP_NAME_SQL = 'shops s CROSS JOIN product_details d ON d.shop_id = s.id'
+_DETAIL_COLUMNS_SQL = ", ".join(f"d.{col}" for col in DB_COLUMNS)
+
 def get_all_products(limit=50, offset=0):
     """Retrieves a paginated list of all products from the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT {", ".join(DB_COLUMNS)} FROM products ORDER BY shop, name LIMIT ? OFFSET ?', (limit, offset))
-    products = cursor.fetchall()
-    conn.close()
-    return products
+    # 先只用覆盖索引确定这一页的 rowid，再为这一页的商品关联扩展信息和采购价
+    return _read_all(f'''SELECT {_DETAIL_COLUMNS_SQL}
+                        FROM (SELECT p.rowid AS page_rowid, s.name AS shop_name, p.name, p.spec_id
+                              FROM shops s CROSS JOIN products p ON p.shop_id = s.id
+                              ORDER BY s.name, p.name, p.spec_id LIMIT ? OFFSET ?) page
+                        CROSS JOIN product_details d ON d.rowid = page.page_rowid
+                        ORDER BY page.shop_name, page.name, page.spec_id''', (limit, offset))
 
 def get_all_products_count():
     """Gets the total count of products."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM products')
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return _read_one('SELECT COUNT(*) FROM products')[0]
 
 def search_products(query, limit=50, offset=0):
     """Searches for products by SKU or name with pagination."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     search_term = f'%{query}%'
-    sql = f'''SELECT {", ".join(DB_COLUMNS)} FROM products 
-             WHERE sku LIKE ? OR name LIKE ? OR spec_name LIKE ? OR product_id LIKE ? 
-             OR category LIKE ? OR warehouse LIKE ? OR short_name LIKE ?
-             ORDER BY shop, name LIMIT ? OFFSET ?'''
-    cursor.execute(sql, (search_term, search_term, search_term, search_term, 
-                        search_term, search_term, search_term, limit, offset))
-    products = cursor.fetchall()
-    conn.close()
-    return products
+    sql = f'''SELECT {_DETAIL_COLUMNS_SQL} FROM {_BY_SHOP_NAME_SQL}
+             WHERE d.sku LIKE ? OR d.name LIKE ? OR d.spec_name LIKE ? OR d.product_id LIKE ? 
+             OR d.category LIKE ? OR d.warehouse LIKE ? OR d.short_name LIKE ?
+             ORDER BY s.name, d.name, d.spec_id LIMIT ? OFFSET ?'''
+    return _read_all(sql, (search_term, search_term, search_term, search_term,
+                           search_term, search_term, search_term, limit, offset))
 
 def search_products_count(query):
     """Gets the total count of products for a search query."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     search_term = f'%{query}%'
-    sql = f'''SELECT COUNT(*) FROM products 
+    sql = f'''SELECT COUNT(*) FROM product_details 
              WHERE sku LIKE ? OR name LIKE ? OR spec_name LIKE ? OR product_id LIKE ?
              OR category LIKE ? OR warehouse LIKE ? OR short_name LIKE ?'''
-    cursor.execute(sql, (search_term, search_term, search_term, search_term,
-                        search_term, search_term, search_term))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return _read_one(sql, (search_term, search_term, search_term, search_term,
+                           search_term, search_term, search_term))[0]
 
 def delete_product_by_spec_id(spec_id):
     """Deletes a product from the database by spec_id."""
@@ -212,28 +601,36 @@ def delete_product_by_spec_id(spec_id):
     cursor = conn.cursor()
     cursor.execute('DELETE FROM products WHERE spec_id = ?', (spec_id,))
     conn.commit()
+    _note_rows_written(cursor.rowcount)
     conn.close()
 
 def get_product_by_spec_id(spec_id):
     """Retrieves a single product by its spec_id."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT {", ".join(DB_COLUMNS)} FROM products WHERE spec_id = ?', (spec_id,))
-    product = cursor.fetchone()
-    conn.close()
-    return product
+    return _read_one(f'SELECT {", ".join(DB_COLUMNS)} FROM product_details WHERE spec_id = ?', (spec_id,))
+
+def get_products_by_spec_ids(spec_ids):
+    """按规格ID批量读取商品，每条查询最多绑定 MAX_SQL_VARIABLES 个规格ID"""
+    spec_ids = list(spec_ids)
+    products = []
+    for start in range(0, len(spec_ids), MAX_SQL_VARIABLES):
+        chunk = spec_ids[start:start + MAX_SQL_VARIABLES]
+        placeholders = ', '.join(['?'] * len(chunk))
+        products.extend(_read_all(f'SELECT {", ".join(DB_COLUMNS)} FROM product_details '
+                                  f'WHERE spec_id IN ({placeholders})', chunk))
+    return products
 
 def add_product(product_data):
     """Adds a new product to the database."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        placeholders = ', '.join(['?'] * len(DB_COLUMNS))
-        sql = f'''INSERT INTO products ({", ".join(DB_COLUMNS)}) 
+        placeholders = ', '.join(['?'] * len(_PRODUCT_TABLE_COLUMNS))
+        sql = f'''INSERT INTO products ({", ".join(_PRODUCT_TABLE_COLUMNS)}) 
                  VALUES ({placeholders})'''
         # Ensure data is in the correct order
-        ordered_data = [product_data.get(col) for col in DB_COLUMNS]
+        ordered_data = _encode_product_rows(cursor, [[product_data.get(col) for col in DB_COLUMNS]])[0]
         cursor.execute(sql, ordered_data)
+        _update_extension_rows(cursor, product_data)
         conn.commit()
     finally:
         conn.close()
@@ -243,17 +640,79 @@ def update_product(product_data):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    update_cols = [col for col in DB_COLUMNS if col != 'spec_id']
+    encoded = dict(zip(_PRODUCT_TABLE_COLUMNS,
+                       _encode_product_rows(cursor, [[product_data.get(col) for col in DB_COLUMNS]])[0]))
+    update_cols = [col for col in _PRODUCT_TABLE_COLUMNS if col != 'spec_id']
     set_clause = ", ".join([f"{col} = ?" for col in update_cols])
     sql = f'UPDATE products SET {set_clause} WHERE spec_id = ?'
     
     # Ensure data is in the correct order for SET clause, with spec_id at the end for WHERE
-    ordered_values = [product_data.get(col) for col in update_cols] + [product_data.get('spec_id')]
+    ordered_values = [encoded[col] for col in update_cols] + [product_data.get('spec_id')]
     
     cursor.execute(sql, ordered_values)
+    _update_extension_rows(cursor, product_data)
     conn.commit()
     conn.close()
 
+def _update_extension_rows(cursor, product_data):
+    """手动编辑的扩展信息和采购价写入已有的关联行（它们优先于商品行自身的值）"""
+    if product_data.get('sku'):
+        category_ids = _dimension_ids(cursor, 'category', [product_data.get('category')])
+        warehouse_ids = _dimension_ids(cursor, 'warehouse', [product_data.get('warehouse')])
+        cursor.execute('''UPDATE sku_extensions SET category_id = ?, warehouse_id = ?, short_name = ?, min_price = ?
+                          WHERE sku = ?''',
+                       (category_ids.get(_dimension_name(product_data.get('category'))),
+                        warehouse_ids.get(_dimension_name(product_data.get('warehouse'))),
+                        product_data.get('short_name'), product_data.get('min_price'), product_data.get('sku')))
+    if product_data.get('short_name'):
+        cursor.execute('UPDATE purchase_prices SET price = ? WHERE short_name = ?',
+                       (product_data.get('purchase_price'), product_data.get('short_name')))
+
+def replace_sku_extensions(extensions):
+    """用导入的 Sheet3 数据替换规格编码扩展信息 {规格编码: {category, warehouse, short_name, min_price}}"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            category_ids = _dimension_ids(cursor, 'category', (data.get('category') for data in extensions.values()))
+            warehouse_ids = _dimension_ids(cursor, 'warehouse', (data.get('warehouse') for data in extensions.values()))
+            cursor.execute('DELETE FROM sku_extensions')
+            _note_rows_written(cursor.rowcount + len(extensions))
+            cursor.executemany('''INSERT INTO sku_extensions (sku, category_id, warehouse_id, short_name, min_price)
+                                  VALUES (?, ?, ?, ?, ?)''',
+                               [(sku, category_ids.get(_dimension_name(data.get('category'))),
+                                 warehouse_ids.get(_dimension_name(data.get('warehouse'))),
+                                 data.get('short_name'), data.get('min_price')) for sku, data in extensions.items()])
+    finally:
+        conn.close()
+
+def replace_purchase_prices(prices):
+    """用导入的 Sheet4 数据替换采购价 {简称: 采购价}"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            _note_rows_written(conn.execute('DELETE FROM purchase_prices').rowcount + len(prices))
+            conn.executemany('INSERT INTO purchase_prices (short_name, price) VALUES (?, ?)', list(prices.items()))
+    finally:
+        conn.close()
+
+def update_purchase_price(short_name, price):
+    """修改一个简称的采购价：只写一行，所有该简称的商品读取时自动使用新采购价"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute('''INSERT INTO purchase_prices (short_name, price) VALUES (?, ?)
+                            ON CONFLICT(short_name) DO UPDATE SET price = excluded.price''', (short_name, price))
+    finally:
+        conn.close()
+
+def get_purchase_price(short_name):
+    """获取简称的采购价，没有记录时返回 None"""
+    conn = get_db_connection()
+    row = conn.execute('SELECT price FROM purchase_prices WHERE short_name = ?', (short_name,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
 # ==================== 优惠券相关函数 ====================
 
 def add_coupon(coupon_data):
@@ -270,10 +729,46 @@ def add_coupon(coupon_data):
     conn.commit()
     coupon_id = cursor.lastrowid
     conn.close()
+    _bump_coupon_revision(coupon_data.get('shop'))
     return coupon_id
 
+def add_coupon_batch(coupons):
+    """在同一个事务中批量添加优惠券，任何一行失败则全部回滚，返回新增数量"""
+    if not coupons:
+        return 0
+    columns = [col for col in COUPON_COLUMNS if col != 'id']
+    placeholders = ', '.join(['?'] * len(columns))
+    sql = f'''INSERT INTO coupons ({", ".join(columns)}) VALUES ({placeholders})'''
+
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.executemany(sql, [[coupon.get(col) for col in columns] for coupon in coupons])
+    finally:
+        conn.close()
+    # 每个涉及的店铺只让缓存失效一次
+    _bump_coupon_revision(*{coupon.get('shop') for coupon in coupons})
+    return len(coupons)
+
+def _bump_coupon_revision(*shops):
+    global _coupon_revision
+    _coupon_revision += 1
+    for shop in shops:
+        _shop_coupon_revisions[shop] = _shop_coupon_revisions.get(shop, 0) + 1
+
+def get_coupon_revision(shop=None):
+    """获取优惠券修改计数（指定店铺时只统计该店铺），计数变化说明缓存的优惠券数据已过期"""
+    if shop is None:
+        return _coupon_revision
+    return _shop_coupon_revisions.get(shop, 0)
+
+def _get_coupon_shop(cursor, coupon_id):
+    cursor.execute('SELECT shop FROM coupons WHERE id = ?', (coupon_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 def get_all_coupons():
-    """获取所有优惠券"""
+    """获取所有优惠券（不含已归档的）"""
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f'SELECT {", ".join(COUPON_COLUMNS)} FROM coupons ORDER BY shop, start_date DESC')
@@ -281,25 +776,187 @@ def get_all_coupons():
     conn.close()
     return coupons
 
-def get_active_coupons_by_shop(shop):
-    """获取指定店铺的有效优惠券"""
+def _coupon_filter_sql(filters):
+    """把优惠券列表的筛选条件转换为 (表名, WHERE子句, 参数)
+
+    filters: scope ('current' 未过期 / 'expired' 已过期 / 'archived' 已归档 / None 全部),
+             shop, coupon_type, date_from/date_to（有效期与该区间有交集）, keyword（店铺或描述）
+    """
+    from datetime import datetime
+    filters = filters or {}
+    table = 'coupons_archive' if filters.get('scope') == 'archived' else 'coupons'
+    clauses = []
+    params = []
+    today = datetime.now().strftime('%Y-%m-%d')
+    if filters.get('scope') == 'current':
+        clauses.append('end_date >= ?')
+        params.append(today)
+    elif filters.get('scope') == 'expired':
+        clauses.append('end_date < ?')
+        params.append(today)
+    if filters.get('shop'):
+        clauses.append('shop = ?')
+        params.append(filters['shop'])
+    if filters.get('coupon_type'):
+        clauses.append('coupon_type = ?')
+        params.append(filters['coupon_type'])
+    if filters.get('date_from'):
+        clauses.append('end_date >= ?')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        clauses.append('start_date <= ?')
+        params.append(filters['date_to'])
+    if filters.get('keyword'):
+        clauses.append('(shop LIKE ? OR description LIKE ?)')
+        params.extend([f"%{filters['keyword']}%"] * 2)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return table, where, params
+
+def search_coupons(filters=None, limit=50, offset=0):
+    """按筛选条件分页获取优惠券，按店铺、开始日期倒序排列"""
+    table, where, params = _coupon_filter_sql(filters)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT {", ".join(COUPON_COLUMNS)} FROM {table} {where}
+                       ORDER BY shop, start_date DESC, id LIMIT ? OFFSET ?''', params + [limit, offset])
+    coupons = cursor.fetchall()
+    conn.close()
+    return coupons
+
+def count_coupons(filters=None):
+    """按筛选条件统计优惠券数量"""
+    table, where, params = _coupon_filter_sql(filters)
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute(f'SELECT COUNT(*) FROM {table} {where}', params)
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+def get_coupon_list_position(coupon_id, filters=None):
+    """优惠券在按 filters 筛选、按 search_coupons 顺序排列的列表中的 (位置, 优惠券)
+
+    不存在或不符合筛选条件时返回 None。用于编辑后判断该行在已加载的列表中应该放在哪里。
+    """
+    table, where, params = _coupon_filter_sql(filters)
+    where = f"{where} AND" if where else "WHERE"
+    conn = get_db_connection()
+    try:
+        coupon = conn.execute(f'SELECT {", ".join(COUPON_COLUMNS)} FROM {table} {where} id = ?',
+                              params + [coupon_id]).fetchone()
+        if coupon is None:
+            return None
+        # 排序为 店铺、开始日期倒序、ID，统计排在它前面的优惠券数
+        shop, start_date = coupon['shop'], coupon['start_date']
+        position = conn.execute(f'''SELECT COUNT(*) FROM {table} {where}
+                                    (shop < ? OR (shop = ? AND (start_date > ? OR (start_date = ? AND id < ?))))''',
+                                params + [shop, shop, start_date, start_date, coupon_id]).fetchone()[0]
+    finally:
+        conn.close()
+    return position, coupon
+
+def archive_expired_coupons(after_days=COUPON_ARCHIVE_AFTER_DAYS, today=None):
+    """把结束超过 after_days 天的优惠券移入归档表，返回归档数量"""
+    from datetime import datetime, timedelta
+    today_date = datetime.strptime(today, '%Y-%m-%d') if today else datetime.now()
+    cutoff = (today_date - timedelta(days=after_days)).strftime('%Y-%m-%d')
+    columns = ", ".join(COUPON_COLUMNS)
     
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'''INSERT OR REPLACE INTO coupons_archive ({columns}, archived_at)
+                           SELECT {columns}, ? FROM coupons WHERE end_date < ?''',
+                       (today_date.strftime('%Y-%m-%d'), cutoff))
+        cursor.execute('DELETE FROM coupons WHERE end_date < ?', (cutoff,))
+        archived = cursor.rowcount
+        conn.commit()
+        _note_rows_written(archived * 2)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return archived
+
+def get_coupons_by_shop(shop):
+    """获取指定店铺的所有优惠券（包括未生效和已过期的）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {", ".join(COUPON_COLUMNS)} FROM coupons WHERE shop = ? ORDER BY start_date', (shop,))
+    coupons = cursor.fetchall()
+    conn.close()
+    return coupons
+
+def get_active_coupons_by_shop(shop, as_of=None):
+    """获取指定店铺在指定日期（默认今天）的有效优惠券"""
     # 获取当前日期
     from datetime import datetime
-    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_date = as_of or datetime.now().strftime('%Y-%m-%d')
     
     sql = f'''SELECT {", ".join(COUPON_COLUMNS)} FROM coupons 
              WHERE shop = ? AND is_active = 1 
              AND start_date <= ? AND end_date >= ?
              ORDER BY amount DESC'''
     
-    cursor.execute(sql, (shop, current_date, current_date))
+    return _read_all(sql, (shop, current_date, current_date))
+
+def get_active_coupons(as_of=None):
+    """获取所有店铺在指定日期（默认今天）有效的优惠券"""
+    from datetime import datetime
+    current_date = as_of or datetime.now().strftime('%Y-%m-%d')
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    sql = f'''SELECT {", ".join(COUPON_COLUMNS)} FROM coupons 
+             WHERE is_active = 1 AND start_date <= ? AND end_date >= ?
+             ORDER BY shop, amount DESC'''
+    cursor.execute(sql, (current_date, current_date))
+    coupons = cursor.fetchall()
+    conn.close()
+    return coupons
+
+def get_coupons_in_window(start_date, end_date, shop=None):
+    """获取有效期与 [start_date, end_date] 有交集的已启用优惠券（可按店铺筛选）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    sql = f'''SELECT {", ".join(COUPON_COLUMNS)} FROM coupons 
+             WHERE is_active = 1 AND start_date <= ? AND end_date >= ?'''
+    params = [end_date, start_date]
+    if shop is not None:
+        sql += ' AND shop = ?'
+        params.append(shop)
+    cursor.execute(sql + ' ORDER BY shop, start_date', params)
     coupons = cursor.fetchall()
     conn.close()
     return coupons
 
+def get_next_coupon_boundary(after_date):
+    """获取 after_date 之后最近的优惠券生效或失效日期（失效日期为结束日期的次日）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT MIN(boundary) FROM (
+                          SELECT start_date AS boundary FROM coupons
+                          WHERE is_active = 1 AND start_date > ?
+                          UNION ALL
+                          SELECT date(end_date, '+1 day') FROM coupons
+                          WHERE is_active = 1 AND end_date >= ?
+                      )''', (after_date, after_date))
+    boundary = cursor.fetchone()[0]
+    conn.close()
+    return boundary
+
+def get_shops_with_coupon_boundaries(after_date, until_date):
+    """获取在 (after_date, until_date] 期间有优惠券生效或失效的店铺"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT DISTINCT shop FROM coupons WHERE is_active = 1 AND (
+                          (start_date > ? AND start_date <= ?) OR (end_date >= ? AND end_date < ?)
+                      )''', (after_date, until_date, after_date, until_date))
+    shops = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return shops
+
 def update_coupon(coupon_data):
     """更新优惠券"""
     conn = get_db_connection()
@@ -309,18 +966,23 @@ def update_coupon(coupon_data):
     set_clause = ", ".join([f"{col} = ?" for col in update_cols])
     sql = f'UPDATE coupons SET {set_clause} WHERE id = ?'
     
+    # 优惠券可能被改到其他店铺，新旧两个店铺的缓存都要失效
+    old_shop = _get_coupon_shop(cursor, coupon_data.get('id'))
     ordered_values = [coupon_data.get(col) for col in update_cols] + [coupon_data.get('id')]
     cursor.execute(sql, ordered_values)
     conn.commit()
     conn.close()
+    _bump_coupon_revision(old_shop, coupon_data.get('shop'))
 
 def delete_coupon(coupon_id):
     """删除优惠券"""
     conn = get_db_connection()
     cursor = conn.cursor()
+    shop = _get_coupon_shop(cursor, coupon_id)
     cursor.execute('DELETE FROM coupons WHERE id = ?', (coupon_id,))
     conn.commit()
     conn.close()
+    _bump_coupon_revision(shop)
 
 def get_coupon_by_id(coupon_id):
     """根据ID获取优惠券"""
@@ -331,12 +993,12 @@ def get_coupon_by_id(coupon_id):
     conn.close()
     return coupon
 
-def calculate_final_price(price, shop, product_id=None):
-    """计算商品的到手价（应用最优优惠券）"""
+def calculate_final_price(price, shop, product_id=None, as_of=None):
+    """计算商品在指定日期（默认今天）的到手价（应用最优优惠券）"""
     if not price or price <= 0:
         return price
         
-    coupons = get_active_coupons_by_shop(shop)
+    coupons = get_active_coupons_by_shop(shop, as_of)
     if not coupons:
         return price
     
@@ -395,90 +1057,98 @@ def apply_coupon_discount(price, coupon_dict):
     return None
 
 def get_all_shops():
-    """获取所有店铺列表"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT DISTINCT shop FROM products WHERE shop IS NOT NULL AND shop != "" ORDER BY shop')
-    shops = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return shops
+    """获取所有店铺列表（店铺维度表中仍有商品的店铺）"""
+    rows = _read_all('''SELECT name FROM shops
+                        WHERE name != '' AND EXISTS (SELECT 1 FROM products WHERE shop_id = shops.id)
+                        ORDER BY name''')
+    return [row[0] for row in rows]
 
 def get_products_by_shop(shop):
-    """获取指定店铺的所有有效且启用的商品（按货品ID去重）"""
+    """获取指定店铺的所有有效且启用的商品（按货品ID去重），按名称排序"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    # 获取无效的规格ID列表
-    cursor.execute('SELECT DISTINCT invalid_spec_id FROM invalid_spec_ids')
-    invalid_ids = set(row[0].lower() for row in cursor.fetchall() if row[0])
-    
-    # 获取启用的规格编码列表
-    cursor.execute('SELECT DISTINCT enabled_sku FROM enabled_skus')
-    enabled_codes = set(row[0] for row in cursor.fetchall() if row[0])
-    
-    # 获取该店铺的所有商品
     cursor.execute('''
-        SELECT DISTINCT product_id, name, spec_id, sku
-        FROM products 
-        WHERE shop = ? AND product_id IS NOT NULL AND product_id != ""
+        SELECT product_id, MIN(name) AS name
+        FROM products
+        WHERE shop_id = (SELECT id FROM shops WHERE name = ?) AND is_eligible = 1 AND product_id IS NOT NULL AND product_id != ""
+        GROUP BY product_id
+        ORDER BY name, product_id
     ''', (shop,))
-    all_products = cursor.fetchall()
-    
-    # 筛选有效且启用的商品
-    valid_products = []
-    seen_product_ids = set()
-    
-    for product_id, name, spec_id, sku in all_products:
-        # 检查规格ID是否有效
-        if spec_id and spec_id.lower() in invalid_ids:
-            continue
-            
-        # 检查SKU是否启用（*表示通配符，始终启用）
-        if sku and sku != '*' and sku not in enabled_codes:
-            continue
-            
-        # 按货品ID去重
-        if product_id not in seen_product_ids:
-            valid_products.append((product_id, name))
-            seen_product_ids.add(product_id)
-    
-    # 按名称排序
-    valid_products.sort(key=lambda x: x[1])
-    
+    products = [(row[0], row[1]) for row in cursor.fetchall()]
     conn.close()
-    return valid_products
+    return products
 
-def update_invalid_spec_ids(invalid_ids):
-    """更新无效规格ID列表"""
+def get_product_ids_by_shops(shops):
+    """获取多个店铺的货品ID，返回 [(店铺, 货品ID)]，用于批量导入时一次性校验"""
+    shops = list(shops)
+    if not shops:
+        return []
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    # 清空现有数据
-    cursor.execute('DELETE FROM invalid_spec_ids')
-    
-    # 插入新数据
-    if invalid_ids:
-        cursor.executemany('INSERT INTO invalid_spec_ids (invalid_spec_id) VALUES (?)', 
-                          [(id_,) for id_ in invalid_ids])
-    
-    conn.commit()
+    placeholders = ', '.join(['?'] * len(shops))
+    cursor.execute(f'''SELECT DISTINCT s.name, p.product_id FROM shops s JOIN products p ON p.shop_id = s.id
+                       WHERE s.name IN ({placeholders}) AND p.product_id IS NOT NULL AND p.product_id != ""''', shops)
+    rows = [(row[0], row[1]) for row in cursor.fetchall()]
     conn.close()
+    return rows
+
+def _replace_code_list(cursor, table, column, product_column, codes):
+    """把列表表替换为 codes：只删除已移除的、只插入新增的，
+    然后只重算 product_column 等于这些变化值的商品的 is_eligible
+
+    返回 {'added': 新增值, 'removed': 移除值, 'eligibility_changed': 有效状态变化的商品数}
+    """
+    current = {code for code, in cursor.execute(f'SELECT {column} FROM {table}').fetchall()}
+    codes = set(codes)
+    delta = {'added': codes - current, 'removed': current - codes, 'eligibility_changed': 0}
+    if not delta['added'] and not delta['removed']:
+        return delta
+    
+    cursor.executemany(f'DELETE FROM {table} WHERE {column} = ?', [(code,) for code in delta['removed']])
+    cursor.executemany(f'INSERT INTO {table} ({column}) VALUES (?)', [(code,) for code in delta['added']])
+    cursor.execute('CREATE TEMP TABLE changed_codes (code TEXT PRIMARY KEY)')
+    cursor.executemany('INSERT INTO changed_codes (code) VALUES (?)',
+                       [(code,) for code in delta['added'] | delta['removed']])
+    eligible = _ELIGIBLE_SQL.format(row='products')
+    cursor.execute(f'''UPDATE products SET is_eligible = {eligible}
+                       WHERE {product_column} IN (SELECT code FROM changed_codes) AND is_eligible != {eligible}''')
+    delta['eligibility_changed'] = cursor.rowcount
+    _note_rows_written(len(delta['added']) + len(delta['removed']) + delta['eligibility_changed'])
+    cursor.execute('DROP TABLE changed_codes')
+    return delta
+
+def _update_code_list(table, column, product_column, codes):
+    conn = get_db_connection()
+    try:
+        with conn:
+            return _replace_code_list(conn.cursor(), table, column, product_column, codes)
+    finally:
+        conn.close()
+
+def update_invalid_spec_ids(invalid_ids):
+    """更新无效规格ID列表（统一小写，与商品的 spec_id_lower 比较），返回变化"""
+    return _update_code_list('invalid_spec_ids', 'invalid_spec_id', 'spec_id_lower', {id_.lower() for id_ in invalid_ids})
 
 def update_enabled_skus(enabled_skus):
-    """更新启用SKU列表"""
+    """更新启用SKU列表，返回变化"""
+    return _update_code_list('enabled_skus', 'enabled_sku', 'sku', enabled_skus)
+
+def update_product_filters(invalid_ids, enabled_skus):
+    """在同一个事务中更新无效规格ID和启用SKU列表
+
+    返回 {'invalid_spec_ids': 变化, 'enabled_skus': 变化}，变化的格式见 _replace_code_list
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 清空现有数据
-    cursor.execute('DELETE FROM enabled_skus')
-    
-    # 插入新数据
-    if enabled_skus:
-        cursor.executemany('INSERT INTO enabled_skus (enabled_sku) VALUES (?)', 
-                          [(sku,) for sku in enabled_skus])
-    
-    conn.commit()
-    conn.close()
+    try:
+        with conn:
+            cursor = conn.cursor()
+            return {
+                'invalid_spec_ids': _replace_code_list(cursor, 'invalid_spec_ids', 'invalid_spec_id', 'spec_id_lower',
+                                                       {id_.lower() for id_ in invalid_ids}),
+                'enabled_skus': _replace_code_list(cursor, 'enabled_skus', 'enabled_sku', 'sku', enabled_skus)
+            }
+    finally:
+        conn.close()
 
 def get_coupon_stats():
     """获取优惠券统计数据"""
@@ -493,11 +1163,15 @@ def get_coupon_stats():
     cursor.execute('SELECT COUNT(*) FROM coupons WHERE is_active = 1')
     active_coupons = cursor.fetchone()[0]
     
-    # 已过期的优惠券数（简单判断：结束日期小于今天）
+    # 已过期的优惠券数（简单判断：结束日期小于今天），归档的优惠券都已过期
     from datetime import datetime
     today = datetime.now().strftime('%Y-%m-%d')
     cursor.execute('SELECT COUNT(*) FROM coupons WHERE end_date < ?', (today,))
     expired_coupons = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM coupons_archive')
+    archived_coupons = cursor.fetchone()[0]
+    total_coupons += archived_coupons
+    expired_coupons += archived_coupons
     
     conn.close()
     
@@ -505,4 +1179,229 @@ def get_coupon_stats():
         'total': total_coupons,
         'active': active_coupons,
         'expired': expired_coupons
-    }
\ No newline at end of file
+    }
+
+# ==================== 利润分析相关函数 ====================
+
+def calculate_profit(final_price, purchase_price):
+    """根据到手价和采购价计算快递费、杂费、毛利率、净利润和净利率"""
+    purchase_price = max(float(purchase_price or 0), 0)
+    shipping_fee = SHIPPING_FEE_HIGH if final_price >= SHIPPING_FEE_THRESHOLD else SHIPPING_FEE_LOW
+    misc_fee = final_price * MISC_FEE_RATE
+    gross_margin = final_price - purchase_price - shipping_fee
+    net_profit = gross_margin - misc_fee
+    return {
+        'purchase_price': purchase_price,
+        'shipping_fee': shipping_fee,
+        'misc_fee': misc_fee,
+        'gross_margin_rate': gross_margin / final_price * 100,
+        'net_profit': net_profit,
+        'net_margin_rate': net_profit / final_price * 100
+    }
+
+def get_margin_tier(net_margin_rate):
+    """返回净利率所属档位"""
+    for tier, lower, upper in MARGIN_TIERS:
+        if (lower is None or net_margin_rate >= lower) and (upper is None or net_margin_rate < upper):
+            return tier
+    return None
+
+def _tier_condition_sql(tier, rate_column='net_margin_rate'):
+    """生成档位筛选的SQL条件"""
+    for key, lower, upper in MARGIN_TIERS:
+        if key == tier:
+            conditions = []
+            if lower is not None:
+                conditions.append(f'{rate_column} >= {lower}')
+            if upper is not None:
+                conditions.append(f'{rate_column} < {upper}')
+            return ' AND '.join(conditions)
+    raise ValueError(f'未知的净利率档位: {tier}')
+
+# 到手价的SQL表达式：缺省按原价计算，传入 price_function 时使用注册的 final_price() 函数
+_LIST_PRICE_SQL = 'CAST(price AS REAL)'
+_FINAL_PRICE_SQL = 'final_price(CAST(price AS REAL), shop, product_id)'
+
+def _profit_subquery(extra_condition='', price_sql=_LIST_PRICE_SQL):
+    """计算利润指标的子查询（原价或到手价为空或非正数的商品不参与分析）
+
+    使用 final_price() 时到手价先在 MATERIALIZED 的 CTE 中算好：普通子查询会被 SQLite 展开，
+    final_price() 会在运费、杂费、利润、净利率和档位条件中各调用一次。按原价计算时展开更快。
+    """
+    condition = f'AND {extra_condition}' if extra_condition else ''
+    materialized = 'NOT MATERIALIZED' if price_sql == _LIST_PRICE_SQL else 'MATERIALIZED'
+    return f'''
+        WITH priced AS {materialized} (
+            SELECT shop, product_id, name,
+                   {price_sql} AS final_price,
+                   MAX(CAST(COALESCE(purchase_price, 0) AS REAL), 0) AS purchase_price
+            FROM product_details
+            WHERE CAST(price AS REAL) > 0 {condition}
+        )
+        SELECT shop, product_id, name, final_price, purchase_price, shipping_fee, misc_fee,
+               final_price - purchase_price - shipping_fee - misc_fee AS net_profit,
+               (final_price - purchase_price - shipping_fee - misc_fee) / final_price * 100 AS net_margin_rate
+        FROM (
+            SELECT shop, product_id, name, final_price, purchase_price,
+                   CASE WHEN final_price >= {SHIPPING_FEE_THRESHOLD}
+                        THEN {SHIPPING_FEE_HIGH} ELSE {SHIPPING_FEE_LOW} END AS shipping_fee,
+                   final_price * {MISC_FEE_RATE} AS misc_fee
+            FROM priced
+            WHERE final_price > 0
+        )
+    '''
+
+def _profit_connection(price_function):
+    """打开用于利润查询的连接，按需注册 final_price(price, shop, product_id) 函数"""
+    conn = get_db_connection()
+    if price_function is None:
+        return conn, _LIST_PRICE_SQL
+    conn.create_function('final_price', 3, price_function, deterministic=True)
+    return conn, _FINAL_PRICE_SQL
+
+def _tier_case_sql(rate_column='net_margin_rate'):
+    """生成把净利率映射为档位名称的SQL CASE表达式"""
+    branches = ' '.join(f"WHEN {_tier_condition_sql(tier, rate_column)} THEN '{tier}'"
+                        for tier, _, _ in MARGIN_TIERS)
+    return f'CASE {branches} END'
+
+def get_margin_tier_counts(rowid_range=None, price_function=None):
+    """用一次聚合查询统计各净利率档位的商品数，可限定 rowid 区间 [start, end) 分块统计"""
+    conn, price_sql = _profit_connection(price_function)
+    cursor = conn.cursor()
+    condition, params = '', ()
+    if rowid_range:
+        condition, params = 'rowid >= ? AND rowid < ?', tuple(rowid_range)
+    cursor.execute(f'''SELECT {_tier_case_sql()} AS tier, COUNT(*)
+                      FROM ({_profit_subquery(condition, price_sql)}) GROUP BY tier''', params)
+    counts = {tier: 0 for tier, _, _ in MARGIN_TIERS}
+    for tier, count in cursor.fetchall():
+        if tier in counts:
+            counts[tier] = count
+    conn.close()
+    return counts
+
+def get_products_rowid_range():
+    """获取商品表的 rowid 范围 [start, end)，用于分块扫描"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT MIN(rowid), MAX(rowid) FROM products')
+    start, end = cursor.fetchone()
+    conn.close()
+    if start is None:
+        return (0, 0)
+    return (start, end + 1)
+
+def get_pricing_rows(rowid_range):
+    """读取 rowid 区间 [start, end) 内计算到手价和利润所需的字段，以及分档明细排序用的 rowid 和名称"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT shop, product_id, price, purchase_price, rowid, name FROM product_details
+                      WHERE rowid >= ? AND rowid < ?''', tuple(rowid_range))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_shop_pricing_rows(shop):
+    """读取指定店铺所有SKU计算到手价、利润和最低价检查所需的字段"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT spec_id, product_id, name, price, purchase_price, min_price FROM product_details
+                      WHERE shop_id = (SELECT id FROM shops WHERE name = ?)''', (shop,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_products_by_margin_tier(tier, limit=50, offset=0, price_function=None, rowids=None):
+    """分页获取指定净利率档位的商品利润明细，按 店铺、名称 排序
+
+    rowids 为价格分析进程按同样顺序排好的该档位商品时，只读取其中 [offset, offset + limit) 这一页的商品，
+    不再为每一页计算全部商品的到手价；分析之后价格有变化、已不在该档位的商品不返回。
+    """
+    price_sql = _LIST_PRICE_SQL if price_function is None else _FINAL_PRICE_SQL
+    condition, params = '', [limit, offset]
+    if rowids is not None:
+        page = list(rowids[offset:offset + limit])
+        if not page:
+            return []
+        condition, params = f"rowid IN ({', '.join(['?'] * len(page))})", page + [limit, 0]
+    sql = f'''SELECT shop, product_id, name, final_price, purchase_price, shipping_fee,
+                    misc_fee, net_profit, net_margin_rate
+             FROM ({_profit_subquery(condition, price_sql)})
+             WHERE {_tier_condition_sql(tier)}
+             ORDER BY shop, name LIMIT ? OFFSET ?'''
+    
+    def query(conn):
+        if price_function is not None:
+            conn.create_function('final_price', 3, price_function, deterministic=True)
+        return conn.execute(sql, params).fetchall()
+    return _read(query)
+
+# ==================== 数据库维护 ====================
+
+def _note_rows_written(count):
+    global _rows_written
+    _rows_written += max(count, 0)
+
+def get_maintenance_status():
+    """返回维护所需的数据库状态
+
+    rows_written: 本进程上次 ANALYZE 以来写入的行数；analyzed_rows: 上次 ANALYZE 时商品表的行数
+    （从未收集过统计信息时为 None）；product_rows: 当前商品数；以及 page_size、page_count、
+    freelist_pages（空闲页数）和 auto_vacuum（2 表示可以增量回收）。
+    """
+    conn = get_db_connection()
+    try:
+        status = {name: conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+                  for name, pragma in [('page_size', 'page_size'), ('page_count', 'page_count'),
+                                       ('freelist_pages', 'freelist_count'), ('auto_vacuum', 'auto_vacuum')]}
+        status['product_rows'] = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        status['analyzed_rows'] = None
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            # 每个索引的统计信息以索引行数开头，非部分索引的行数就是表的行数
+            status['analyzed_rows'] = conn.execute("""SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1
+                                                      WHERE tbl = 'products'""").fetchone()[0]
+    finally:
+        conn.close()
+    status['rows_written'] = _rows_written
+    return status
+
+def analyze_database():
+    """重新收集查询优化器使用的统计信息（全部表和索引），返回耗时（秒）"""
+    global _rows_written
+    written = _rows_written
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    # 收集期间其他线程写入的行数留到下一次
+    _rows_written -= written
+    return time.perf_counter() - started
+
+def reclaim_free_pages(step_pages, time_budget=None):
+    """按每步 step_pages 页执行 PRAGMA incremental_vacuum 回收空闲页，返回回收的页数
+
+    每一步是一个单独的短事务，步与步之间其他连接可以写入；超过 time_budget 秒后不再开始新的一步。
+    需要 auto_vacuum = INCREMENTAL，否则不回收。
+    """
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    conn = get_db_connection()
+    try:
+        before = conn.execute('PRAGMA page_count').fetchone()[0]
+        while deadline is None or time.perf_counter() < deadline:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            # incremental_vacuum 每执行一步只回收一页，需要取完结果才会全部执行
+            conn.execute(f'PRAGMA incremental_vacuum({min(free, step_pages)})').fetchall()
+            if conn.execute('PRAGMA freelist_count').fetchone()[0] == free:
+                break
+        reclaimed = before - conn.execute('PRAGMA page_count').fetchone()[0]
+        # WAL 模式下检查点之后数据库文件才会截短
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+    finally:
+        conn.close()
+    return reclaimed
@@ -0,0 +1,144 @@
+"""对比按查询形状建立的索引：每条查询在有索引和去掉索引时的查询计划和耗时
+
+用法: python index_benchmark.py [数据库路径]
+
+不指定数据库时按固定的随机种子生成 PRODUCTS 个商品、COUPONS 张优惠券的测试数据库，结果可以复现。
+指定数据库时在它的副本上测试（通过 SQLite 备份接口复制），原数据库不会被修改。
+"""
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+
+PRODUCTS = 200000
+SHOPS = 20
+COUPONS = 5000
+SEED = 45
+REPEAT = 5
+
+_TODAY = datetime.now().strftime('%Y-%m-%d')
+
+# 与 database.get_all_products 中确定一页 rowid 的子查询相同
+_LIST_PAGE_SQL = '''SELECT p.rowid FROM shops s CROSS JOIN products p ON p.shop_id = s.id
+                    ORDER BY s.name, p.name, p.spec_id LIMIT 50 OFFSET ?'''
+
+
+def _middle_offset(conn):
+    return (conn.execute('SELECT COUNT(*) FROM products').fetchone()[0] // 2,)
+
+
+def _busiest_shop(conn):
+    row = conn.execute('SELECT shop FROM coupons GROUP BY shop ORDER BY COUNT(*) DESC LIMIT 1').fetchone()
+    return (row[0] if row else '', _TODAY, _TODAY)
+
+
+# (名称, 针对的索引, SQL, 参数(conn))
+QUERIES = [
+    ('商品列表中间页', ('idx_shop_name_spec',), _LIST_PAGE_SQL, _middle_offset),
+    ('总览平均价格', ('idx_priced_products',),
+     'SELECT AVG(price) FROM products WHERE price > 0', lambda conn: ()),
+    # 利润分析按 CAST(price AS REAL) > 0 筛选，并且需要每个商品的全部计价字段
+    ('利润分析筛选', ('idx_priced_products',),
+     'SELECT COUNT(*), SUM(purchase_price) FROM product_details WHERE CAST(price AS REAL) > 0', lambda conn: ()),
+    ('店铺当天有效优惠券', ('idx_coupon_active_shop_window',),
+     f'''SELECT {", ".join(database.COUPON_COLUMNS)} FROM coupons
+         WHERE shop = ? AND is_active = 1 AND start_date <= ? AND end_date >= ?
+         ORDER BY amount DESC''', _busiest_shop),
+]
+
+
+def _build_database(path):
+    """按 SEED 生成测试数据：商品平均分布在 SHOPS 个店铺，约 5% 没有价格；优惠券在一年内随机分布"""
+    rng = random.Random(SEED)
+    saved = database.DB_PATH
+    database.DB_PATH = path
+    try:
+        database.init_db()
+        database.add_product_batch([
+            (f'SKU{i}', f'P{i // 3}', f'S{i}', f'商品{rng.randrange(PRODUCTS // 10)}', '',
+             0 if rng.random() < 0.05 else rng.randint(10, 500), 1, f'店铺{i % SHOPS:02d}',
+             '', '', '', 0, rng.randint(5, 300))
+            for i in range(PRODUCTS)
+        ])
+        start = datetime.now() - timedelta(days=365)
+        coupons = []
+        for _ in range(COUPONS):
+            begin = start + timedelta(days=rng.randrange(400))
+            coupons.append({'shop': f'店铺{rng.randrange(SHOPS):02d}', 'coupon_type': 'instant',
+                            'amount': rng.randint(1, 50), 'min_price': 0,
+                            'start_date': begin.strftime('%Y-%m-%d'),
+                            'end_date': (begin + timedelta(days=rng.randint(1, 30))).strftime('%Y-%m-%d'),
+                            'description': '', 'is_active': int(rng.random() < 0.8), 'product_ids': ''})
+        database.add_coupon_batch(coupons)
+    finally:
+        database.close_read_connections()
+        database.DB_PATH = saved
+
+
+def _copy_database(source, target):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _measure(conn, sql, params, repeat):
+    plan = '; '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - started)
+    return {'plan': plan, 'seconds': statistics.median(timings)}
+
+
+def run_benchmark(db_path=None, repeat=REPEAT):
+    """返回 {查询名: {'有索引': {'plan', 'seconds'}, '无索引': {...}}}"""
+    tmp_dir = tempfile.mkdtemp(prefix='index_benchmark_')
+    try:
+        path = os.path.join(tmp_dir, 'bench.db')
+        if db_path:
+            _copy_database(db_path, path)
+        else:
+            _build_database(path)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('ANALYZE')
+            results = {name: {} for name, _, _, _ in QUERIES}
+            for name, _, sql, params in QUERIES:
+                results[name]['有索引'] = _measure(conn, sql, params(conn), repeat)
+            for index in {index for _, indexes, _, _ in QUERIES for index in indexes}:
+                conn.execute(f'DROP INDEX IF EXISTS {index}')
+            conn.execute('ANALYZE')
+            for name, _, sql, params in QUERIES:
+                results[name]['无索引'] = _measure(conn, sql, params(conn), repeat)
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def main(argv):
+    db_path = argv[1] if len(argv) > 1 else None
+    source = db_path or f'随机生成 {PRODUCTS} 个商品、{COUPONS} 张优惠券（种子 {SEED}）'
+    print(f"数据库: {source}，每项取 {REPEAT} 次的中位数")
+    results = run_benchmark(db_path)
+    for name, indexes, _, _ in QUERIES:
+        print(f"\n{name}（{', '.join(indexes)}）")
+        for state, result in results[name].items():
+            print(f"  {state}: {result['seconds'] * 1000:8.1f}ms  {result['plan']}")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
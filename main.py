@@ -7,6 +7,14 @@ import database
 from database import DB_COLUMNS
 import threading
 import json
+import os
+from price_analysis import AnalysisRunner
+from pricing import CouponPricer, CouponImpactSimulator, CouponBoundaryScheduler
+from coupon_conflicts import find_coupon_conflicts, build_conflict_report
+from coupon_import import import_coupons
+from product_search import ProductSearchIndex
+from maintenance import MaintenanceScheduler, run_maintenance
+import backup
 
 # --- Constants ---
 HEADER_MAP = {
@@ -54,8 +62,449 @@ COUPON_TYPE_MAP = {
     'threshold': '满减券', 
     'discount': '折扣券'
 }
+# 优惠券列表的显示范围：当前（未过期）、已过期（未归档）、已归档
+COUPON_SCOPES = {
+    '当前优惠券': 'current',
+    '已过期': 'expired',
+    '已归档': 'archived'
+}
+ALL_SHOPS_LABEL = '全部店铺'
+ALL_TYPES_LABEL = '全部类型'
+COUPON_PAGE_SIZE = 50 # Coupons loaded per page in the coupon lists
+# 净利率档位显示名称（顺序与 database.MARGIN_TIERS 一致）
+MARGIN_TIER_LABELS = {
+    'healthy': '💚 健康(≥20%)',
+    'normal': '💛 一般(10-20%)',
+    'warning': '🟠 注意(0-10%)',
+    'loss': '🔴 亏损(<0%)'
+}
 PAGE_SIZE = 100  # Number of items to load per page - 增加页面大小减少加载次数
 SKELETON_ROWS = 15 # Number of placeholder rows to show
+PREFETCH_PAGES = 2 # Number of pages to prefetch in the background
+VIRTUAL_MARGIN_ROWS = 2 # Extra pooled rows beyond the visible window
+ANALYSIS_POLL_MS = 100 # Interval for polling the analysis worker process
+IMPACT_PREVIEW_DELAY_MS = 150 # Delay before refreshing the coupon impact preview while typing
+IMPACT_PREVIEW_ROWS = 5 # SKUs below min price listed in the impact preview
+COUPON_BOUNDARY_MAX_WAIT_MS = 3600 * 1000 # Longest single wait before re-checking the next coupon boundary
+COUPON_IMPORT_ERROR_ROWS = 15 # Validation errors listed in the coupon import result
+MAINTENANCE_CHECK_MS = 60 * 1000 # Interval for checking whether idle-time database maintenance is due
+BACKUP_BEFORE_IMPORT = True # Take a database snapshot before each product import writes anything
+
+# --- Virtual Table ---
+class VirtualTreeview(ttk.Frame):
+    """虚拟表格：只为可见窗口创建Tk行项目，滚动时复用这些项目显示后备数据"""
+    def __init__(self, parent, columns, style="Treeview", margin=VIRTUAL_MARGIN_ROWS,
+                 yscrollcommand=None, selection_key=None, **kwargs):
+        super().__init__(parent)
+        self.columns = columns
+        self.margin = margin
+        self.rows = []            # 后备数据源，每行为显示值元组
+        self.top = 0              # 可见窗口第一行在后备数据中的索引
+        self.selected = set()     # 选中行在后备数据中的索引（与可见行无关）
+        # 指定 selection_key(行) 时 selected 保存行的键而不是索引，替换数据后选择保持不变
+        self.selection_key = selection_key
+        self._slots = []          # 复用的Tk行项目ID
+        self._attached = set()
+        self._capacity = 1
+        
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", style=style, **kwargs)
+        self.v_scrollbar = ttk.Scrollbar(self, orient=VERTICAL, command=self.yview)
+        self.h_scrollbar = ttk.Scrollbar(self, orient=HORIZONTAL, command=self.tree.xview)
+        self.yscrollcommand = yscrollcommand or self.v_scrollbar.set
+        self.tree.configure(xscrollcommand=self.h_scrollbar.set)
+        
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.v_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.h_scrollbar.grid(row=1, column=0, sticky="ew")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        
+        self.tree.bind("<Configure>", self._on_configure, add="+")
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select, add="+")
+        # Treeview 默认的翻页键只在复用的行项目之间滚动，Home/End 是水平滚动，改为滚动虚拟窗口
+        for sequence in ("<Prior>", "<Next>", "<Home>", "<End>"):
+            self.tree.bind(sequence, self.handle_navigation_key)
+
+    # --- 数据源 ---
+    def set_rows(self, rows):
+        """替换全部后备数据并回到顶部"""
+        self.rows = list(rows)
+        self.top = 0
+        if self.selection_key is None:
+            self.selected.clear()
+        self._render()
+
+    def append_rows(self, rows):
+        """追加后备数据，只在可见窗口受影响时刷新"""
+        self.rows.extend(rows)
+        self._render()
+
+    def update_rows(self, updates):
+        """按索引替换部分后备数据 {索引: 新行}，滚动位置和选择保持不变"""
+        for index, row in updates.items():
+            self.rows[index] = row
+        if any(self.top <= index < self.top + self._capacity + self.margin for index in updates):
+            self._render()
+
+    def get_row(self, index):
+        return self.rows[index]
+
+    def row_count(self):
+        return len(self.rows)
+
+    # --- 选择 ---
+    def index_of(self, item_id):
+        """Tk行项目ID -> 后备数据索引"""
+        try:
+            return self.top + self._slots.index(item_id)
+        except ValueError:
+            return None
+
+    def _selection_key(self, index):
+        return index if self.selection_key is None else self.selection_key(self.rows[index])
+
+    def selected_indices(self):
+        if self.selection_key is not None:
+            return [i for i, row in enumerate(self.rows) if self.selection_key(row) in self.selected]
+        return sorted(i for i in self.selected if i < len(self.rows))
+
+    def selected_rows(self):
+        return [self.rows[i] for i in self.selected_indices()]
+
+    def clear_selection(self):
+        self.selected.clear()
+        self._sync_selection()
+
+    def _on_tree_select(self, event=None):
+        """把可见行的选择状态写回选择模型，窗口外的选择保持不变"""
+        tree_selection = set(self.tree.selection())
+        for slot, item_id in enumerate(self._slots):
+            index = self.top + slot
+            if item_id not in self._attached:
+                continue
+            if item_id in tree_selection:
+                self.selected.add(self._selection_key(index))
+            else:
+                self.selected.discard(self._selection_key(index))
+
+    def _sync_selection(self):
+        """按选择模型设置可见行的选中状态，只检查可见窗口内的行"""
+        visible_selected = [item_id for slot, item_id in enumerate(self._slots)
+                            if item_id in self._attached and self._selection_key(self.top + slot) in self.selected]
+        self.tree.selection_set(visible_selected)
+
+    # --- 滚动 ---
+    def yview(self, *args):
+        """兼容滚动条命令：moveto / scroll"""
+        if not args:
+            return self._fractions()
+        if args[0] == "moveto":
+            self.yview_moveto(float(args[1]))
+        elif args[0] == "scroll":
+            self.yview_scroll(int(args[1]), args[2])
+
+    def yview_moveto(self, fraction):
+        self._scroll_to(int(round(float(fraction) * len(self.rows))))
+
+    def yview_scroll(self, number, what="units"):
+        step = self._capacity if what == "pages" else 1
+        self._scroll_to(self.top + number * step)
+
+    def handle_navigation_key(self, event):
+        """Page Up/Down 按可见行数翻页（与点击滚动条空白处相同），Home/End 滚动到首行、末行"""
+        if event.keysym == "Prior":
+            self.yview_scroll(-1, "pages")
+        elif event.keysym == "Next":
+            self.yview_scroll(1, "pages")
+        elif event.keysym == "Home":
+            self.yview_moveto(0)
+        elif event.keysym == "End":
+            self.yview_moveto(1)
+        return "break"
+
+    def _scroll_to(self, top):
+        max_top = max(0, len(self.rows) - self._capacity)
+        top = max(0, min(top, max_top))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _fractions(self):
+        total = len(self.rows)
+        if total == 0:
+            return (0.0, 1.0)
+        first = self.top / total
+        last = min(total, self.top + self._capacity) / total
+        return (first, last)
+
+    # --- 渲染 ---
+    def _on_configure(self, event=None):
+        capacity = self._visible_capacity()
+        if capacity != self._capacity:
+            self._capacity = capacity
+            self._scroll_to(self.top)
+            self._render()
+
+    def _visible_capacity(self):
+        """根据控件高度计算可完整显示的行数"""
+        row_height = int(ttk.Style().lookup(self.tree.cget("style"), "rowheight") or 20)
+        header_height = 0
+        if self._attached:
+            bbox = self.tree.bbox(self._slots[0])
+            if bbox:
+                header_height, row_height = bbox[1], bbox[3] or row_height
+        return max(1, (self.tree.winfo_height() - header_height) // row_height)
+
+    def _ensure_slots(self, count):
+        while len(self._slots) < count:
+            item_id = self.tree.insert("", tk.END, values=())
+            self.tree.detach(item_id)
+            self._slots.append(item_id)
+
+    def _render(self):
+        """把后备数据的可见窗口写入复用的行项目"""
+        pool_size = self._capacity + self.margin
+        self._ensure_slots(pool_size)
+        for slot, item_id in enumerate(self._slots):
+            index = self.top + slot
+            if slot < pool_size and index < len(self.rows):
+                self.tree.item(item_id, values=self.rows[index])
+                if item_id not in self._attached:
+                    self.tree.move(item_id, "", slot)
+                    self._attached.add(item_id)
+            elif item_id in self._attached:
+                self.tree.detach(item_id)
+                self._attached.discard(item_id)
+        # 行项目数量固定，Treeview自身始终停在顶部
+        self.tree.yview_moveto(0)
+        self._sync_selection()
+        self.yscrollcommand(*self._fractions())
+
+def format_coupon_values(coupon_dict, columns):
+    """把优惠券记录格式化为表格显示值"""
+    display_data = []
+    for col in columns:
+        value = coupon_dict[col]
+        
+        if col == 'coupon_type':
+            value = COUPON_TYPE_MAP.get(value, value)
+        elif col == 'amount':
+            coupon_type = coupon_dict['coupon_type']
+            if coupon_type == 'discount':
+                value = f"{int(value * 100)}%"  # 折扣显示为百分比
+            else:
+                value = f"¥{value}"  # 立减券和满减券显示金额
+        elif col == 'product_ids':
+            if value:
+                try:
+                    product_ids = json.loads(value)
+                    value = f"指定货品({len(product_ids)}个)"
+                except:
+                    value = "指定货品"
+            else:
+                value = "全店通用"
+        elif col == 'is_active':
+            value = '启用' if value else '禁用'
+        elif value is None:
+            value = ''
+        
+        display_data.append(str(value))
+    return display_data
+
+
+class CouponFilterBar(ttk.Frame):
+    """优惠券列表筛选栏：范围、店铺、类型、有效期区间和关键字"""
+    def __init__(self, parent, on_change):
+        super().__init__(parent)
+        self.on_change = on_change
+        font = ("Microsoft YaHei UI", 10)
+        
+        self.scope_var = tk.StringVar(value=next(iter(COUPON_SCOPES)))
+        self.shop_var = tk.StringVar(value=ALL_SHOPS_LABEL)
+        self.type_var = tk.StringVar(value=ALL_TYPES_LABEL)
+        self.date_from_var = tk.StringVar()
+        self.date_to_var = tk.StringVar()
+        self.keyword_var = tk.StringVar()
+        
+        comboboxes = [
+            (self.scope_var, list(COUPON_SCOPES), 10),
+            (self.shop_var, [ALL_SHOPS_LABEL] + database.get_all_shops(), 14),
+            (self.type_var, [ALL_TYPES_LABEL] + list(COUPON_TYPE_MAP.values()), 8),
+        ]
+        for variable, values, width in comboboxes:
+            combobox = ttk.Combobox(self, textvariable=variable, values=values,
+                                    state="readonly", width=width, font=font)
+            combobox.pack(side=LEFT, padx=(0, 8))
+            combobox.bind("<<ComboboxSelected>>", lambda e: self.on_change())
+        
+        ttk.Label(self, text="有效期", font=font).pack(side=LEFT, padx=(0, 4))
+        for variable, separator in ((self.date_from_var, "~"), (self.date_to_var, None)):
+            entry = ttk.Entry(self, textvariable=variable, font=font, width=11)
+            entry.pack(side=LEFT)
+            entry.bind("<Return>", lambda e: self.on_change())
+            if separator:
+                ttk.Label(self, text=separator, font=font).pack(side=LEFT, padx=4)
+        
+        ttk.Label(self, text="🔍", font=font).pack(side=LEFT, padx=(12, 4))
+        keyword_entry = ttk.Entry(self, textvariable=self.keyword_var, font=font, width=14)
+        keyword_entry.pack(side=LEFT, padx=(0, 8))
+        keyword_entry.bind("<Return>", lambda e: self.on_change())
+        
+        ttk.Button(self, text="查询", command=self.on_change,
+                  bootstyle="outline-primary", width=6).pack(side=LEFT)
+    
+    def is_archived(self):
+        return COUPON_SCOPES.get(self.scope_var.get()) == 'archived'
+    
+    def filters(self):
+        """当前筛选条件，格式见 database.search_coupons"""
+        type_codes = {label: code for code, label in COUPON_TYPE_MAP.items()}
+        shop = self.shop_var.get()
+        return {
+            'scope': COUPON_SCOPES.get(self.scope_var.get()),
+            'shop': shop if shop != ALL_SHOPS_LABEL else None,
+            'coupon_type': type_codes.get(self.type_var.get()),
+            'date_from': self.date_from_var.get().strip() or None,
+            'date_to': self.date_to_var.get().strip() or None,
+            'keyword': self.keyword_var.get().strip() or None
+        }
+
+
+class CouponListPager:
+    """优惠券列表分页加载：滚动到底部时在后台加载下一页，编辑后只更新对应行"""
+    def __init__(self, owner, tree, scrollbar, columns, on_loaded=None):
+        self.owner = owner          # 用于 after 调度的窗口
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.columns = columns
+        self.on_loaded = on_loaded  # 回调 (已加载数量, 总数)
+        self.filters = {}
+        self.offset = 0
+        self.total = 0
+        self.generation = 0
+        self.loading = False
+        self.page_token = 0         # 每次请求一页加一，只接受最新请求的结果
+        self._page_counts = False   # 正在加载的页是否同时统计总数
+        tree.configure(yscrollcommand=self._on_yscroll)
+    
+    def reload(self, filters=None):
+        """按新的筛选条件从第一页重新加载"""
+        if filters is not None:
+            self.filters = filters
+        self.generation += 1
+        self.offset = 0
+        self.total = 0
+        self.loading = False
+        self.tree.delete(*self.tree.get_children())
+        self._load_page(count=True)
+    
+    def load_more(self):
+        if not self.loading and self.offset < self.total:
+            self._load_page()
+    
+    def _load_page(self, count=False):
+        self.loading = True
+        self.page_token += 1
+        self._page_counts = count
+        generation, token, filters, offset = self.generation, self.page_token, dict(self.filters), self.offset
+        
+        def db_task():
+            try:
+                total = database.count_coupons(filters) if count else None
+                coupons = database.search_coupons(filters, limit=COUPON_PAGE_SIZE, offset=offset)
+                self.owner.after(0, self._on_page_loaded, generation, token, coupons, total)
+            except Exception as e:
+                print(f"加载优惠券列表时出错: {e}")
+                self.owner.after(0, self._on_page_failed, generation, token)
+        
+        threading.Thread(target=db_task, daemon=True).start()
+    
+    def _on_page_loaded(self, generation, token, coupons, total):
+        # 筛选条件已变化，或 offset 变化后已重新请求这一页，丢弃过期的结果
+        if generation != self.generation or token != self.page_token:
+            return
+        if total is not None:
+            self.total = total
+        for coupon in coupons:
+            coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
+            iid = str(coupon_dict['id'])
+            if not self.tree.exists(iid):
+                self.tree.insert("", tk.END, iid=iid, values=format_coupon_values(coupon_dict, self.columns))
+        self.offset += len(coupons)
+        self.loading = False
+        if self.on_loaded:
+            self.on_loaded(self.offset, self.total)
+        # 第一页不足以填满表格时继续加载
+        if self.tree.yview()[1] >= 1.0:
+            self.load_more()
+    
+    def _on_page_failed(self, generation, token):
+        if generation == self.generation and token == self.page_token:
+            self.loading = False
+    
+    def _on_offset_changed(self):
+        """已加载的行数因编辑或删除而变化：正在加载的页是按旧 offset 查询的，丢弃后从新的 offset 重新请求"""
+        if self.loading:
+            self._load_page(count=self._page_counts)
+    
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9:
+            self.load_more()
+    
+    def update_coupon(self, coupon_id):
+        """新增或编辑后只刷新这一行：在后台按当前筛选条件查询它在列表中的位置，
+        不再符合筛选条件时移除，位置在已加载的范围内时放到对应位置，否则留给之后的分页加载"""
+        generation, filters = self.generation, dict(self.filters)
+        
+        def db_task():
+            try:
+                found = database.get_coupon_list_position(coupon_id, filters)
+                self.owner.after(0, self._on_coupon_updated, generation, coupon_id, found)
+            except Exception as e:
+                print(f"刷新优惠券时出错: {e}")
+        
+        threading.Thread(target=db_task, daemon=True).start()
+    
+    def _on_coupon_updated(self, generation, coupon_id, found):
+        # 期间筛选条件已变化，列表会整体重新加载
+        if generation != self.generation:
+            return
+        iid = str(coupon_id)
+        offset = self.offset
+        if self.tree.exists(iid):
+            self.tree.delete(iid)
+            self.offset -= 1
+            self.total -= 1
+        if found is not None:
+            position, coupon = found
+            self.total += 1
+            # 已加载的行是列表的前 offset 行；位置更靠后的行由分页加载，不改变 offset
+            if position <= self.offset:
+                values = format_coupon_values(dict(zip(database.COUPON_COLUMNS, coupon)), self.columns)
+                self.tree.insert("", position, iid=iid, values=values)
+                self.offset += 1
+                self.tree.selection_set(iid)
+                self.tree.see(iid)
+        if self.offset != offset:
+            self._on_offset_changed()
+        if self.on_loaded:
+            self.on_loaded(self.offset, self.total)
+    
+    def remove_coupons(self, coupon_ids):
+        """删除后只移除对应的行"""
+        offset = self.offset
+        for coupon_id in coupon_ids:
+            iid = str(coupon_id)
+            if self.tree.exists(iid):
+                self.tree.delete(iid)
+                self.offset -= 1
+                self.total -= 1
+        if self.offset != offset:
+            self._on_offset_changed()
+        if self.on_loaded:
+            self.on_loaded(self.offset, self.total)
+
 
 # --- Editor Window (largely unchanged) ---
 class ProductEditorWindow(ttk.Toplevel):
@@ -149,6 +598,118 @@ class ProductEditorWindow(ttk.Toplevel):
         except Exception as e:
             messagebox.showerror("保存失败", f"发生错误: {e}", parent=self)
 
+class PurchasePriceWindow(ttk.Toplevel):
+    """按简称修改采购价：同一简称的所有商品共用一条采购价记录"""
+    def __init__(self, parent, short_name='', purchase_price=''):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("修改采购价")
+        self.geometry("380x260")
+        self.transient(parent)
+        self.grab_set()
+        
+        main_frame = ttk.Frame(self, padding=(30, 25, 30, 25))
+        main_frame.pack(fill=BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="修改采购价", font=("Microsoft YaHei UI", 16, "bold")).grid(
+            row=0, column=0, columnspan=2, pady=(0, 20), sticky=tk.W)
+        
+        self.entries = {}
+        for row, (key, label, value) in enumerate((('short_name', '简称', short_name),
+                                                   ('purchase_price', '采购价', purchase_price)), start=1):
+            ttk.Label(main_frame, text=label, font=("Microsoft YaHei UI", 11)).grid(
+                row=row, column=0, padx=(0, 20), pady=(0, 18), sticky=tk.W)
+            entry = ttk.Entry(main_frame, font=("Microsoft YaHei UI", 11), width=22)
+            entry.grid(row=row, column=1, pady=(0, 18), sticky=tk.EW)
+            entry.insert(0, '' if value is None else str(value))
+            self.entries[key] = entry
+        main_frame.grid_columnconfigure(1, weight=1)
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=3, column=0, columnspan=2, pady=(10, 0), sticky=tk.EW)
+        ttk.Button(button_frame, text="取消", command=self.destroy,
+                  bootstyle="secondary", width=10).pack(side=RIGHT, padx=(10, 0))
+        ttk.Button(button_frame, text="保存", command=self.save,
+                  bootstyle="success", width=10).pack(side=RIGHT)
+        
+        self.update_idletasks()
+        x = (self.winfo_screenwidth() // 2) - (self.winfo_width() // 2)
+        y = (self.winfo_screenheight() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+    
+    def save(self):
+        short_name = self.entries['short_name'].get().strip()
+        if not short_name:
+            messagebox.showerror("错误", "简称不能为空。", parent=self)
+            return
+        try:
+            price = float(self.entries['purchase_price'].get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "采购价必须是有效的数字。", parent=self)
+            return
+        
+        try:
+            database.update_purchase_price(short_name, price)
+        except Exception as e:
+            messagebox.showerror("保存失败", f"发生错误: {e}", parent=self)
+            return
+        self.parent._on_purchase_price_changed(short_name)
+        self.destroy()
+
+class MigrationProgressWindow(ttk.Window):
+    """数据库结构需要升级时在启动前显示的进度窗口：升级在后台线程执行，完成后窗口关闭"""
+    def __init__(self):
+        super().__init__(themename="darkly")
+        self.title("Matrix · 升级数据库")
+        self.geometry("460x160")
+        self.resizable(False, False)
+        # 升级过程中不允许关闭窗口
+        self.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.error = None
+        self.deferred = None  # 推迟到下次启动的步骤的说明
+        
+        main_frame = ttk.Frame(self, padding=(30, 25, 30, 25))
+        main_frame.pack(fill=BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="正在升级数据库，请稍候...",
+                  font=("Microsoft YaHei UI", 13, "bold")).pack(anchor=W)
+        self.step_label = ttk.Label(main_frame, text="", font=("Microsoft YaHei UI", 10),
+                                    foreground="#B0B0B0")
+        self.step_label.pack(anchor=W, pady=(10, 8))
+        self.progress_bar = ttk.Progressbar(main_frame, mode="determinate", bootstyle="success-striped")
+        self.progress_bar.pack(fill=X)
+        
+        self.update_idletasks()
+        x = (self.winfo_screenwidth() // 2) - (self.winfo_width() // 2)
+        y = (self.winfo_screenheight() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+        
+        threading.Thread(target=self._threaded_migrate, daemon=True).start()
+    
+    def _threaded_migrate(self):
+        try:
+            self.deferred = database.init_db(progress=lambda done, total, description:
+                                             self.after(0, self._on_progress, done, total, description))
+        except Exception as e:
+            self.error = e
+            self.after(0, self._on_error)
+            return
+        self.after(0, self._on_deferred if self.deferred else self.destroy)
+    
+    def _on_progress(self, done, total, description):
+        self.step_label.config(text=f"({min(done + 1, total)}/{total}) {description}")
+        self.progress_bar.config(maximum=total, value=done)
+    
+    def _on_error(self):
+        print(f"升级数据库时出错: {self.error}")
+        messagebox.showerror("升级数据库失败", f"发生错误: {self.error}", parent=self)
+        self.destroy()
+    
+    def _on_deferred(self):
+        # 推迟的步骤不影响使用，关闭窗口后照常启动
+        messagebox.showwarning("数据库升级未完成", f"{self.deferred}\n\n程序可以照常使用。", parent=self)
+        self.destroy()
+
 # --- Main Application ---
 class App(ttk.Window):
     def __init__(self):
@@ -193,8 +754,34 @@ class App(ttk.Window):
         
         # 净利率筛选状态
         self.current_profit_filter = None
+        
+        # 后台预取状态：offset -> (原始行数, 已格式化的显示行)
+        self._load_generation = 0
+        self._prefetch_cache = {}
+        self._prefetch_pending = set()
+        self._waiting_offset = None
+        
+        # 到手价计算（按店铺缓存已编译的优惠券）
+        self.pricer = CouponPricer()
+        # 优惠券在零点生效或失效时，只让受影响店铺的到手价失效
+        self.coupon_boundaries = CouponBoundaryScheduler(self.pricer)
+        self._coupon_boundary_timer = None
+        
+        # 价格分析后台进程
+        self.analysis_runner = AnalysisRunner()
+        self._analysis_poll_timer = None
+        
+        # 用户空闲时在后台维护数据库（重新收集统计信息、回收空闲页）
+        self.maintenance = MaintenanceScheduler()
+        self.bind_all("<Any-KeyPress>", self._note_user_activity, add="+")
+        self.bind_all("<Any-ButtonPress>", self._note_user_activity, add="+")
+        
+        # 数据库快照在后台线程中创建，不占用 is_busy，浏览和搜索照常进行
+        self._backup_running = False
 
         self._build_ui()
+        self._schedule_coupon_boundary_check(refresh=False)
+        self.after(MAINTENANCE_CHECK_MS, self._on_maintenance_timer)
 
     def _build_ui(self):
         # --- 主容器 ---
@@ -462,7 +1049,9 @@ class App(ttk.Window):
         quick_buttons = [
             {"text": "📥  导入数据", "cmd": self.import_data, "style": "info-outline"},
             {"text": "📤  导出数据", "cmd": self.export_data, "style": "secondary-outline"},
-            {"text": "🔄  刷新数据", "cmd": self.refresh_data, "style": "primary-outline"}
+            {"text": "🔄  刷新数据", "cmd": self.refresh_data, "style": "primary-outline"},
+            {"text": "💾  备份数据库", "cmd": self.backup_database, "style": "success-outline"},
+            {"text": "♻️  恢复备份", "cmd": self.open_restore_window, "style": "warning-outline"}
         ]
         
         for btn_config in quick_buttons:
@@ -533,7 +1122,7 @@ class App(ttk.Window):
                 self._refresh_coupons()
 
     def copy_to_clipboard(self, event=None):
-        selected_items = self.tree.selection()
+        selected_items = self.sku_grid.selected_indices()
         if not selected_items:
             return
 
@@ -544,7 +1133,7 @@ class App(ttk.Window):
             
             try:
                 # Single cell copy logic
-                cell_value = self.tree.item(self.last_clicked_row, 'values')[self.last_clicked_column_index]
+                cell_value = self.sku_grid.get_row(self.last_clicked_row)[self.last_clicked_column_index]
                 self.clipboard_clear()
                 self.clipboard_append(str(cell_value))
 
@@ -563,8 +1152,7 @@ class App(ttk.Window):
             headers = [self.tree.heading(col)['text'] for col in DISPLAY_COLUMNS]
             clipboard_data = "\t".join(headers) + "\n"
             
-            for item in selected_items:
-                values = self.tree.item(item, 'values')
+            for values in self.sku_grid.selected_rows():
                 str_values = [str(v) for v in values]
                 clipboard_data += "\t".join(str_values) + "\n"
             
@@ -604,7 +1192,7 @@ class App(ttk.Window):
     def on_cell_click(self, event):
         region = self.tree.identify_region(event.x, event.y)
         if region == "cell":
-            self.last_clicked_row = self.tree.identify_row(event.y)
+            self.last_clicked_row = self.sku_grid.index_of(self.tree.identify_row(event.y))
             column_id = self.tree.identify_column(event.x)
             if column_id:
                 self.last_clicked_column_index = int(column_id.replace('#', '')) - 1
@@ -674,6 +1262,64 @@ class App(ttk.Window):
         """刷新数据"""
         self.start_new_load(force=True)
     
+    def backup_database(self):
+        """在后台创建数据库快照（在线备份，不阻塞读取和写入）"""
+        if self._backup_running:
+            return
+        self._backup_running = True
+        self.update_status("正在备份数据库...", "⏳", show_progress=True)
+        def backup_task():
+            try:
+                path = backup.create_snapshot(progress=lambda done, total:
+                                              self.after(0, self._on_snapshot_progress, "正在备份数据库", done, total))
+                self.after(0, self._on_backup_complete, path, None)
+            except Exception as e:
+                self.after(0, self._on_backup_complete, None, e)
+        threading.Thread(target=backup_task, daemon=True).start()
+    
+    def _on_snapshot_progress(self, message, done, total):
+        self.status_label.config(text=f"{message}... {done * 100 // max(total, 1)}%")
+    
+    def _on_backup_complete(self, path, error):
+        self._backup_running = False
+        if error is not None:
+            print(f"备份数据库时出错: {error}")
+            self.update_status("备份数据库失败", "❌")
+            messagebox.showerror("备份失败", f"发生错误: {error}")
+            return
+        self.update_status(f"数据库已备份: {os.path.basename(path)}")
+    
+    def open_restore_window(self):
+        if self.is_busy or self._backup_running: return
+        SnapshotRestoreWindow(self)
+    
+    def restore_snapshot(self, path):
+        """用快照替换当前数据库，完成后重新加载所有数据"""
+        self.set_busy(True)
+        self.update_status("正在恢复数据库快照...", "⏳", show_progress=True)
+        def restore_task():
+            try:
+                backup.restore_snapshot(path, progress=lambda done, total:
+                                        self.after(0, self._on_snapshot_progress, "正在恢复数据库快照", done, total))
+                self.after(0, self._on_restore_complete, path, None)
+            except Exception as e:
+                self.after(0, self._on_restore_complete, path, e)
+        threading.Thread(target=restore_task, daemon=True).start()
+    
+    def _on_restore_complete(self, path, error):
+        if error is not None:
+            print(f"恢复数据库快照时出错: {error}")
+            self.update_status("恢复数据库快照失败", "❌")
+            messagebox.showerror("恢复失败", f"发生错误: {error}")
+            self.set_busy(False)
+            return
+        # 优惠券和商品全部换成快照中的数据，缓存的到手价全部失效
+        self.pricer.invalidate()
+        self._schedule_coupon_boundary_check()
+        self.update_status(f"已从快照恢复数据库: {os.path.basename(path)}")
+        self._refresh_overview()
+        self.start_new_load(force=True)
+    
     def _create_product_table(self, parent):
         """创建商品表格"""
         # 表格框架
@@ -714,8 +1360,10 @@ class App(ttk.Window):
         style.configure("Vertical.TScrollbar", width=16)
         style.configure("Horizontal.TScrollbar", height=16)
 
-        self.tree = ttk.Treeview(tree_frame, columns=DISPLAY_COLUMNS, show="headings", 
-                               style="Enhanced.Treeview", height=18)
+        # 虚拟表格：只保留可见窗口的Tk行项目，滚动时复用
+        self.sku_grid = VirtualTreeview(tree_frame, DISPLAY_COLUMNS, style="Enhanced.Treeview",
+                                        yscrollcommand=self._on_y_scroll, height=18)
+        self.tree = self.sku_grid.tree
         
         # 配置列
         column_configs = {
@@ -771,34 +1419,24 @@ class App(ttk.Window):
             
             self.tree.heading(col, command=lambda c=col: self.sort_column(c))
 
-        # 滚动条
-        v_scrollbar = ttk.Scrollbar(tree_frame, orient=VERTICAL, command=self.tree.yview)
-        h_scrollbar = ttk.Scrollbar(tree_frame, orient=HORIZONTAL, command=self.tree.xview)
-        
-        self.v_scrollbar = v_scrollbar
-        self.h_scrollbar = h_scrollbar
-        
-        self.tree.configure(yscrollcommand=self._on_y_scroll, xscrollcommand=h_scrollbar.set)
+        # 滚动条（由虚拟表格管理）
+        self.v_scrollbar = self.sku_grid.v_scrollbar
+        self.h_scrollbar = self.sku_grid.h_scrollbar
         
         # 布局
-        self.tree.grid(row=0, column=0, sticky="nsew")
-        v_scrollbar.grid(row=0, column=1, sticky="ns")
-        h_scrollbar.grid(row=1, column=0, sticky="ew")
-        
-        tree_frame.grid_rowconfigure(0, weight=1)
-        tree_frame.grid_columnconfigure(0, weight=1)
+        self.sku_grid.pack(fill=BOTH, expand=True)
 
         # 事件绑定
         self.tree.bind("<Control-c>", self.copy_to_clipboard)
-        self.tree.bind("<Button-1>", self.on_cell_click)
+        self.tree.bind("<Button-1>", self.on_cell_click, add="+")
         self.tree.bind("<Double-Button-1>", self.on_row_double_click)
         self.tree.bind("<Motion>", self.on_tree_motion)
         self.tree.bind("<MouseWheel>", self._on_mouse_wheel)
         self.tree.bind("<Shift-MouseWheel>", self._on_horizontal_scroll)
         self.tree.bind("<Up>", self._on_key_scroll)
         self.tree.bind("<Down>", self._on_key_scroll)
-        self.tree.bind("<Page_Up>", self._on_key_scroll)
-        self.tree.bind("<Page_Down>", self._on_key_scroll)
+        self.tree.bind("<Prior>", self._on_key_scroll)
+        self.tree.bind("<Next>", self._on_key_scroll)
         self.tree.bind("<Home>", self._on_key_scroll)
         self.tree.bind("<End>", self._on_key_scroll)
     
@@ -838,7 +1476,10 @@ class App(ttk.Window):
         v_scrollbar2 = ttk.Scrollbar(tree_frame, orient=VERTICAL, command=self.coupon_tree.yview)
         h_scrollbar2 = ttk.Scrollbar(tree_frame, orient=HORIZONTAL, command=self.coupon_tree.xview)
         
-        self.coupon_tree.configure(yscrollcommand=v_scrollbar2.set, xscrollcommand=h_scrollbar2.set)
+        self.coupon_tree.configure(xscrollcommand=h_scrollbar2.set)
+        # 纵向滚动由分页器接管，滚动到底部时加载下一页
+        self.coupon_pager = CouponListPager(self, self.coupon_tree, v_scrollbar2, columns,
+                                            on_loaded=self._on_coupon_page_loaded)
         
         # 布局
         self.coupon_tree.grid(row=0, column=0, sticky="nsew")
@@ -858,12 +1499,11 @@ class App(ttk.Window):
             total_products = database.get_all_products_count()
             
             # 获取店铺数量
-            conn = database.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(DISTINCT shop) FROM products WHERE shop IS NOT NULL AND shop != ""')
-            total_shops = cursor.fetchone()[0]
+            total_shops = len(database.get_all_shops())
             
             # 获取优惠券数量
+            conn = database.get_db_connection()
+            cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM coupons WHERE is_active = 1')
             total_coupons = cursor.fetchone()[0]
             
@@ -883,49 +1523,89 @@ class App(ttk.Window):
         except Exception as e:
             print(f"刷新总览数据时出错: {e}")
     
+    def _schedule_coupon_boundary_check(self, refresh=True):
+        """在下一个优惠券生效/失效日期的零点检查到手价（优惠券被修改后需要重新查询）"""
+        if self._coupon_boundary_timer:
+            self.after_cancel(self._coupon_boundary_timer)
+            self._coupon_boundary_timer = None
+        if refresh:
+            self.coupon_boundaries.refresh()
+        seconds = self.coupon_boundaries.seconds_until_next()
+        if seconds is None:
+            return
+        # 分段等待，避免系统休眠或修改时钟后错过边界
+        delay = min(int(seconds * 1000) + 1000, COUPON_BOUNDARY_MAX_WAIT_MS)
+        self._coupon_boundary_timer = self.after(delay, self._on_coupon_boundary_timer)
+    
+    def _on_coupon_boundary_timer(self):
+        self._coupon_boundary_timer = None
+        try:
+            shops = self.coupon_boundaries.advance()
+            if shops:
+                self._on_coupon_prices_expired(shops)
+        except Exception as e:
+            print(f"检查优惠券有效期时出错: {e}")
+        self._schedule_coupon_boundary_check(refresh=False)
+    
+    def _note_user_activity(self, event=None):
+        self.maintenance.note_activity()
+    
+    def _on_maintenance_timer(self):
+        """用户空闲且没有导入、删除等任务进行时，在后台线程中执行到期的数据库维护"""
+        self.after(MAINTENANCE_CHECK_MS, self._on_maintenance_timer)
+        if self.is_busy or not self.maintenance.should_run():
+            return
+        self.maintenance.start()
+        def maintenance_task():
+            try:
+                run_maintenance()
+            except Exception as e:
+                print(f"数据库维护时出错: {e}")
+            self.after(0, self.maintenance.finish)
+        threading.Thread(target=maintenance_task, daemon=True).start()
+    
+    def _on_coupon_prices_expired(self, shops):
+        """优惠券生效或失效后，只重算已加载数据中受影响店铺的到手价"""
+        # 预取的页面按旧价格格式化，直接丢弃
+        self._prefetch_cache.clear()
+        
+        if hasattr(self, 'sku_grid'):
+            if self.current_profit_filter:
+                # 按净利率筛选时，价格变化会改变行是否入选，需要重新加载
+                if self.current_page == "sku_list":
+                    self.start_new_load(force=True)
+            else:
+                shop_index = DISPLAY_COLUMNS.index('shop')
+                column_indices = [DISPLAY_COLUMNS.index(col) for col in database.DB_COLUMNS]
+                updates = {}
+                for index, row in enumerate(self.sku_grid.rows):
+                    if row[shop_index] in shops:
+                        product = tuple(row[i] for i in column_indices)
+                        updates[index] = self._format_product_rows([product])[0]
+                if updates:
+                    self.sku_grid.update_rows(updates)
+        
+        if self.current_page == "price_analysis":
+            self._refresh_price_analysis()
+        self.update_status(f"优惠券有效期变化，已更新 {len(shops)} 个店铺的到手价", "🎫")
+    
     def _refresh_coupons(self):
-        """刷新优惠券页面数据"""
-        # 清空现有数据
-        for item in self.coupon_tree.get_children():
-            self.coupon_tree.delete(item)
-        
-        # 更新统计数据
+        """刷新优惠券页面数据：统计卡片和按当前筛选条件分页加载的列表"""
+        self._schedule_coupon_boundary_check()
         self._update_coupon_stats()
-        
-        # 加载数据
-        coupons = database.get_all_coupons()
-        for coupon in coupons:
-            coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
-            
-            # 格式化显示数据
-            display_data = []
-            for col in ['id', 'shop', 'coupon_type', 'amount', 'min_price', 
-                       'start_date', 'end_date', 'description', 'product_ids', 'is_active']:
-                value = coupon_dict[col]
-                
-                if col == 'coupon_type':
-                    value = COUPON_TYPE_MAP.get(value, value)
-                elif col == 'amount':
-                    coupon_type = coupon_dict['coupon_type']
-                    if coupon_type == 'discount':
-                        value = f"{int(value * 100)}%"  # 折扣显示为百分比
-                    else:
-                        value = f"¥{value}"  # 立减券和满减券显示金额
-                elif col == 'product_ids':
-                    if value:
-                        try:
-                            product_ids = json.loads(value)
-                            value = f"指定货品({len(product_ids)}个)"
-                        except:
-                            value = "指定货品"
-                    else:
-                        value = "全店通用"
-                elif col == 'is_active':
-                    value = '启用' if value else '禁用'
-                
-                display_data.append(str(value))
-            
-            self.coupon_tree.insert("", tk.END, values=display_data)
+        self.coupon_pager.reload(self.coupon_filter_bar.filters())
+    
+    def _on_coupon_page_loaded(self, loaded, total):
+        self.coupon_list_info_label.config(text=f"已显示 {loaded} / {total}")
+    
+    def _on_coupon_saved(self, coupon_id):
+        """优惠券保存后只更新列表中的对应行"""
+        self.coupon_pager.update_coupon(coupon_id)
+        self._update_coupon_stats()
+        self._schedule_coupon_boundary_check()
+        # 刷新SKU列表的到手价
+        if hasattr(self, 'tree'):
+            self.start_new_load(force=True)
     
     def _update_coupon_stats(self):
         """更新优惠券统计数据"""
@@ -944,6 +1624,45 @@ class App(ttk.Window):
         """添加优惠券"""
         CouponEditorWindow(self)
     
+    def _import_coupons(self):
+        """从Excel批量导入优惠券"""
+        file_path = filedialog.askopenfilename(title="选择优惠券Excel文件", filetypes=(("Excel 文件", "*.xlsx"), ("所有文件", "*.*")), parent=self)
+        if not file_path: return
+        self.set_busy(True)
+        self.update_status("正在导入优惠券...", "⏳", show_progress=True)
+        threading.Thread(target=self._threaded_import_coupons, args=(file_path,), daemon=True).start()
+    
+    def _threaded_import_coupons(self, file_path):
+        try:
+            result = dict(import_coupons(file_path), success=True)
+        except Exception as e:
+            result = {'success': False, 'error': e}
+        self.after(0, self._on_coupon_import_complete, result)
+    
+    def _on_coupon_import_complete(self, result):
+        self.set_busy(False)
+        if not result['success']:
+            self.update_status("优惠券导入失败", "❌")
+            err_msg = {KeyError: "Excel文件中缺少必要的列", FileNotFoundError: "找不到文件"}.get(type(result['error']), "处理Excel文件时发生未知错误")
+            messagebox.showerror("错误", f"{err_msg}: {result['error']}", parent=self)
+            return
+        
+        errors = result['errors']
+        if errors:
+            self.update_status("优惠券导入未完成", "⚠️")
+            lines = [f"第 {row} 行: {message}" for row, message in errors[:COUPON_IMPORT_ERROR_ROWS]]
+            if len(errors) > COUPON_IMPORT_ERROR_ROWS:
+                lines.append(f"... 共 {len(errors)} 处错误")
+            messagebox.showerror("导入失败", f"共 {result['total']} 行，发现以下错误，未导入任何优惠券：\n\n" + "\n".join(lines), parent=self)
+            return
+        
+        self.update_status(f"已导入 {result['imported']} 张优惠券", "✅")
+        messagebox.showinfo("导入结果", f"成功导入 {result['imported']} 张优惠券\n涉及店铺: {', '.join(result['shops'])}", parent=self)
+        # 整批导入后只刷新一次列表和到手价
+        self._refresh_coupons()
+        if hasattr(self, 'tree'):
+            self.start_new_load(force=True)
+    
     def _edit_coupon(self):
         """编辑优惠券"""
         selected = self.coupon_tree.selection()
@@ -959,6 +1678,8 @@ class App(ttk.Window):
         if coupon:
             coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
             CouponEditorWindow(self, coupon_dict)
+        elif self.coupon_filter_bar.is_archived():
+            messagebox.showinfo("提示", "已归档的优惠券只能查看，不能编辑", parent=self)
     
     def _delete_coupon(self):
         """删除优惠券"""
@@ -966,14 +1687,22 @@ class App(ttk.Window):
         if not selected:
             messagebox.showwarning("警告", "请选择要删除的优惠券", parent=self)
             return
+        if self.coupon_filter_bar.is_archived():
+            messagebox.showinfo("提示", "已归档的优惠券只能查看，不能删除", parent=self)
+            return
         
         if messagebox.askyesno("确认删除", "确定要删除选中的优惠券吗？", parent=self):
+            coupon_ids = []
             for item in selected:
                 values = self.coupon_tree.item(item, 'values')
                 coupon_id = values[0]
                 database.delete_coupon(coupon_id)
+                coupon_ids.append(coupon_id)
             
-            self._refresh_coupons()
+            # 只移除被删除的行
+            self.coupon_pager.remove_coupons(coupon_ids)
+            self._update_coupon_stats()
+            self._schedule_coupon_boundary_check()
             # 刷新SKU列表的到手价
             if hasattr(self, 'tree'):
                 self.start_new_load(force=True)
@@ -1221,6 +1950,7 @@ class App(ttk.Window):
         action_buttons = [
             {"text": "➕ 新增", "cmd": self.open_add_window, "style": "success", "width": 10},
             {"text": "✏️ 编辑", "cmd": self.open_edit_window, "style": "warning", "width": 10},
+            {"text": "💰 采购价", "cmd": self.open_purchase_price_window, "style": "info", "width": 10},
             {"text": "🗑️ 删除", "cmd": self.delete_products, "style": "danger", "width": 10}
         ]
         
@@ -1345,6 +2075,7 @@ class App(ttk.Window):
         
         action_buttons = [
             {"text": "➕ 新增优惠券", "cmd": self._add_coupon, "style": "success", "width": 15},
+            {"text": "📥 批量导入", "cmd": self._import_coupons, "style": "info", "width": 12},
             {"text": "✏️ 编辑", "cmd": self._edit_coupon, "style": "warning", "width": 10},
             {"text": "🗑️ 删除", "cmd": self._delete_coupon, "style": "danger", "width": 10}
         ]
@@ -1402,12 +2133,28 @@ class App(ttk.Window):
         list_tools = ttk.Frame(list_header)
         list_tools.pack(side=RIGHT)
         
+        # 已加载数量
+        self.coupon_list_info_label = ttk.Label(list_tools, text="", 
+                                               font=("Microsoft YaHei UI", 10),
+                                               foreground="#888")
+        self.coupon_list_info_label.pack(side=LEFT, padx=(0, 12))
+        
+        # 冲突检查按钮
+        conflict_btn = ttk.Button(list_tools, text="⚠️ 冲突检查", 
+                                command=lambda: CouponConflictReportWindow(self),
+                                bootstyle="outline-warning", width=12)
+        conflict_btn.pack(side=LEFT, padx=(0, 8))
+        
         # 刷新按钮
         refresh_btn = ttk.Button(list_tools, text="🔄 刷新", 
                                command=self._refresh_coupons,
                                bootstyle="outline-primary", width=10)
         refresh_btn.pack(side=LEFT)
         
+        # 筛选栏：默认只显示未过期的优惠券，已过期和已归档的按需查询
+        self.coupon_filter_bar = CouponFilterBar(list_area, on_change=self._refresh_coupons)
+        self.coupon_filter_bar.pack(fill=X, pady=(0, 12))
+        
         # 表格容器
         table_container = ttk.Frame(list_area)
         table_container.pack(fill=BOTH, expand=True)
@@ -1494,6 +2241,7 @@ class App(ttk.Window):
         formula_title.pack(anchor=tk.W, pady=(0, 10))
         
         formulas = [
+            "到手价 = 原价应用最优惠的有效优惠券",
             "净利润 = 到手价 - 采购价 - 快递费 - 杂费",
             "快递费 = 到手价 ≥ 150元 ? 30元 : 2元",
             "杂费 = 售后费用 + 管理费用 + 平台费用",
@@ -1617,7 +2365,7 @@ class App(ttk.Window):
         return card_container
     
     def _create_price_analysis_table(self, parent):
-        """创建价格分析表格"""
+        """创建价格分析表格（按净利率档位分组，展开档位时才加载明细）"""
         # 表格框架
         tree_frame = ttk.Frame(parent)
         tree_frame.pack(fill=BOTH, expand=True)
@@ -1628,9 +2376,11 @@ class App(ttk.Window):
             'shipping_fee', 'misc_fee', 'net_profit', 'profit_rate'
         ]
         
-        # 创建表格
-        self.analysis_tree = ttk.Treeview(tree_frame, columns=analysis_columns, show="headings", 
+        # 创建表格，树形列用于显示档位
+        self.analysis_tree = ttk.Treeview(tree_frame, columns=analysis_columns, show="tree headings", 
                                         style="Enhanced.Treeview", height=15)
+        self.analysis_tree.heading("#0", text="📊 档位", anchor=CENTER)
+        self.analysis_tree.column("#0", width=200, minwidth=120, anchor=tk.W)
         
         # 列配置
         analysis_column_configs = {
@@ -1679,117 +2429,151 @@ class App(ttk.Window):
         
         tree_frame.grid_rowconfigure(0, weight=1)
         tree_frame.grid_columnconfigure(0, weight=1)
+        
+        # 档位节点：展开时按需分页加载明细
+        self.analysis_tier_counts = {}
+        self.analysis_tier_rowids = {}   # 档位 -> 分析进程回传的该档位商品 rowid（已按店铺、名称排序）
+        self.analysis_tier_loaded = {}   # 档位 -> 已加载到 analysis_tier_rowids 中的位置
+        self.analysis_filter = "all"
+        for tier, label in MARGIN_TIER_LABELS.items():
+            self.analysis_tree.insert("", tk.END, iid=tier, text=label, open=False)
+        
+        self.analysis_tree.bind("<<TreeviewOpen>>", self._on_analysis_tier_open)
+        self.analysis_tree.bind("<<TreeviewSelect>>", self._on_analysis_select)
     
     def _refresh_price_analysis(self):
-        """刷新价格分析数据"""
-        try:
-            # 显示加载状态
-            self.update_status("正在分析价格数据...", "⏳", True)
-            
-            # 清空现有数据
-            for item in self.analysis_tree.get_children():
-                self.analysis_tree.delete(item)
-            
-            # 获取所有商品数据
-            all_products = database.get_all_products(limit=999999)  # 获取所有数据
-            
-            # 按净利率档位统计
-            healthy_count = 0    # ≥20%
-            normal_count = 0     # 10-20%
-            warning_count = 0    # 0-10%
-            loss_count = 0       # <0%
-            
-            total_products = len(all_products)
-            processed_count = 0
-            
-            # 分批处理数据，避免界面卡死
-            batch_size = 100
-            for i in range(0, len(all_products), batch_size):
-                batch = all_products[i:i+batch_size]
-                
-                for product in batch:
-                    product_dict = dict(zip(database.DB_COLUMNS, product))
-                    
-                    # 简化计算，直接使用价格而不是复杂的优惠券计算
-                    price = float(product_dict.get('price', 0) or 0)
-                    purchase_price = float(product_dict.get('purchase_price', 0) or 0)
-                    
-                    # 跳过没有价格数据的商品，但采购价为空时设置为0
-                    if price <= 0:
-                        continue
-                    
-                    # 没有采购价的商品，采购价统一设置为0
-                    if purchase_price <= 0:
-                        purchase_price = 0
-                    
-                    # 使用简化的到手价计算（直接使用原价，避免复杂的优惠券计算）
-                    final_price = price
-                    
-                    # 计算各项费用
-                    shipping_fee = 30 if final_price >= 150 else 2
-                    after_sales_fee = final_price * 0.02  # 2%
-                    management_fee = final_price * 0.07   # 7%
-                    platform_fee = final_price * 0.01    # 1%
-                    misc_fee = after_sales_fee + management_fee + platform_fee
-                    
-                    # 计算净利润和净利率
-                    net_profit = final_price - purchase_price - shipping_fee - misc_fee
-                    net_margin_rate = (net_profit / final_price) * 100 if final_price > 0 else 0
-                    
-                    # 按净利率档位统计
-                    if net_margin_rate >= 20:
-                        healthy_count += 1
-                    elif net_margin_rate >= 10:
-                        normal_count += 1
-                    elif net_margin_rate >= 0:
-                        warning_count += 1
-                    else:
-                        loss_count += 1
-                    
-                    # 格式化显示数据
-                    display_data = [
-                        product_dict.get('shop', ''),
-                        product_dict.get('product_id', ''),
-                        product_dict.get('name', ''),
-                        f"¥{final_price:.2f}",
-                        f"¥{purchase_price:.2f}",
-                        f"¥{shipping_fee:.2f}",
-                        f"¥{misc_fee:.2f}",
-                        f"¥{net_profit:.2f}",
-                        f"{net_margin_rate:.1f}%"
-                    ]
-                    
-                    # 插入数据到表格
-                    self.analysis_tree.insert("", tk.END, values=display_data)
-                    
-                    processed_count += 1
-                
-                # 每处理一批数据后更新界面，避免卡死
-                progress = (processed_count / total_products) * 100 if total_products > 0 else 100
+        """刷新价格分析数据：在后台进程统计档位数量，明细在展开档位时再加载"""
+        self.update_status("正在分析价格数据...", "⏳", True)
+        
+        # 提交新任务会让仍在运行的旧任务自动停止
+        self.analysis_runner.submit()
+        if self._analysis_poll_timer is None:
+            self._analysis_poll_timer = self.after(ANALYSIS_POLL_MS, self._poll_price_analysis)
+    
+    def _poll_price_analysis(self):
+        """读取后台分析进程回传的进度和结果"""
+        self._analysis_poll_timer = None
+        finished = False
+        for kind, payload in self.analysis_runner.poll():
+            if kind == 'progress':
+                progress = payload['processed'] / payload['total'] * 100 if payload['total'] else 100
                 self.update_status(f"正在分析价格数据... {progress:.0f}%", "⏳", True)
-                self.update_idletasks()  # 强制更新界面
-            
-            # 更新统计卡片
-            if hasattr(self, 'analysis_stats_cards'):
-                self.analysis_stats_cards['healthy'].value_label.config(text=str(healthy_count))
-                self.analysis_stats_cards['normal'].value_label.config(text=str(normal_count))
-                self.analysis_stats_cards['warning'].value_label.config(text=str(warning_count))
-                self.analysis_stats_cards['loss'].value_label.config(text=str(loss_count))
-            
-            # 更新完成状态
-            total_analyzed = healthy_count + normal_count + warning_count + loss_count
-            self.update_status(f"价格分析完成，共分析 {total_analyzed} 个商品", "✅", False)
-                
-        except Exception as e:
-            print(f"刷新价格分析数据时出错: {e}")
-            self.update_status("价格分析失败", "❌", False)
-            messagebox.showerror("错误", f"刷新价格分析数据失败: {str(e)}")
+                # 边统计边更新卡片
+                for tier, count in payload['counts'].items():
+                    self.analysis_stats_cards[tier].value_label.config(text=str(count))
+            elif kind == 'rowids':
+                self.analysis_tier_rowids = payload
+            elif kind == 'done':
+                self._on_analysis_counts_loaded(payload)
+                finished = True
+            elif kind == 'error':
+                print(f"刷新价格分析数据时出错: {payload}")
+                self.update_status("价格分析失败", "❌", False)
+                messagebox.showerror("错误", f"刷新价格分析数据失败: {payload}")
+                finished = True
+        
+        if not finished:
+            self._analysis_poll_timer = self.after(ANALYSIS_POLL_MS, self._poll_price_analysis)
+    
+    def _on_analysis_counts_loaded(self, counts):
+        """更新统计卡片并重置档位明细"""
+        self.analysis_tier_counts = counts
+        
+        # 更新统计卡片
+        if hasattr(self, 'analysis_stats_cards'):
+            for tier, count in counts.items():
+                self.analysis_stats_cards[tier].value_label.config(text=str(count))
+        
+        # 清空已加载的明细，折叠状态的档位只保留占位子节点
+        for tier in MARGIN_TIER_LABELS:
+            self.analysis_tree.delete(*self.analysis_tree.get_children(tier))
+            self.analysis_tier_loaded[tier] = 0
+            self.analysis_tree.item(tier, text=f"{MARGIN_TIER_LABELS[tier]}  ({counts.get(tier, 0)})")
+            if counts.get(tier, 0) > 0:
+                self.analysis_tree.insert(tier, tk.END, iid=f"{tier}:placeholder", text="加载中...")
+            # 已展开的档位重新加载第一页
+            if self.analysis_tree.item(tier, 'open'):
+                self._load_analysis_tier_page(tier)
+        
+        self._filter_analysis(self.analysis_filter)
+        
+        # 更新完成状态
+        total_analyzed = sum(counts.values())
+        self.update_status(f"价格分析完成，共分析 {total_analyzed} 个商品", "✅", False)
+    
+    def _on_analysis_tier_open(self, event=None):
+        """展开档位时加载第一页明细"""
+        tier = self.analysis_tree.focus()
+        if tier in MARGIN_TIER_LABELS and self.analysis_tier_loaded.get(tier, 0) == 0:
+            self._load_analysis_tier_page(tier)
+    
+    def _on_analysis_select(self, event=None):
+        """点击"加载更多"行时加载下一页明细"""
+        for item in self.analysis_tree.selection():
+            if item.endswith(":more"):
+                self._load_analysis_tier_page(item.split(":")[0])
+    
+    def _load_analysis_tier_page(self, tier):
+        """后台加载指定档位的下一页明细：只读取分析结果中这一页的商品"""
+        offset = self.analysis_tier_loaded.get(tier, 0)
+        rowids = self.analysis_tier_rowids.get(tier, [])
+        
+        def db_task():
+            try:
+                rows = database.get_products_by_margin_tier(tier, limit=PAGE_SIZE, offset=offset,
+                                                            price_function=self.pricer.final_price,
+                                                            rowids=rowids)
+                self.after(0, self._on_analysis_tier_page_loaded, tier, rowids, offset, rows)
+            except Exception as e:
+                print(f"加载档位明细时出错: {e}")
+        
+        threading.Thread(target=db_task, daemon=True).start()
+    
+    def _on_analysis_tier_page_loaded(self, tier, rowids, offset, rows):
+        # 档位已被刷新，丢弃过期的明细
+        if self.analysis_tier_rowids.get(tier) is not rowids or self.analysis_tier_loaded.get(tier, 0) != offset:
+            return
+        
+        for item in (f"{tier}:placeholder", f"{tier}:more"):
+            if self.analysis_tree.exists(item):
+                self.analysis_tree.delete(item)
+        
+        for shop, product_id, name, final_price, purchase_price, shipping_fee, misc_fee, net_profit, net_margin_rate in rows:
+            # 格式化显示数据
+            display_data = [
+                shop or '',
+                product_id or '',
+                name or '',
+                f"¥{final_price:.2f}",
+                f"¥{purchase_price:.2f}",
+                f"¥{shipping_fee:.2f}",
+                f"¥{misc_fee:.2f}",
+                f"¥{net_profit:.2f}",
+                f"{net_margin_rate:.1f}%"
+            ]
+            self.analysis_tree.insert(tier, tk.END, values=display_data)
+        
+        # 分析之后价格有变化的商品不在本页返回，按读取的 rowid 数前进
+        total = len(self.analysis_tier_rowids.get(tier, []))
+        loaded = min(offset + PAGE_SIZE, total)
+        self.analysis_tier_loaded[tier] = loaded
+        if loaded < total:
+            self.analysis_tree.insert(tier, tk.END, iid=f"{tier}:more",
+                                      text=f"⬇ 加载更多 ({loaded}/{total})")
     
     def _filter_analysis(self, filter_type):
-        """筛选价格分析数据"""
-        # 这里可以实现筛选逻辑
-        # 暂时重新加载所有数据
-        self._refresh_price_analysis()
+        """筛选价格分析数据：按盈亏显示对应档位"""
+        self.analysis_filter = filter_type
+        visible_tiers = {
+            "all": list(MARGIN_TIER_LABELS),
+            "profit": ["healthy", "normal", "warning"],
+            "loss": ["loss"]
+        }.get(filter_type, list(MARGIN_TIER_LABELS))
+        
+        for tier in MARGIN_TIER_LABELS:
+            self.analysis_tree.detach(tier)
+        for index, tier in enumerate(visible_tiers):
+            self.analysis_tree.move(tier, "", index)
     
     def _bind_card_click_recursive(self, widget, filter_type):
         """递归绑定卡片内所有子组件的点击事件"""
@@ -1856,11 +2640,9 @@ class App(ttk.Window):
         # 只在SKU列表页面且tree存在时显示骨架加载
         if hasattr(self, 'tree') and self.tree:
             try:
-                self.tree.delete(*self.tree.get_children())
                 self.tree.configure(style="Skeleton.Treeview")
                 skeleton_item = ('▓▓▓', '▓▓▓▓▓▓▓▓', '▓▓▓▓▓▓', '▓▓▓▓▓▓▓▓▓▓▓', '▓▓.▓▓', '▓▓▓', '▓▓▓▓▓▓▓▓▓▓', '▓▓▓▓▓▓▓▓▓▓▓▓▓▓▓▓')
-                for i in range(SKELETON_ROWS):
-                    self.tree.insert("", tk.END, values=skeleton_item, tags=('skeleton',))
+                self.sku_grid.set_rows([skeleton_item] * SKELETON_ROWS)
             except:
                 pass
         
@@ -1878,6 +2660,11 @@ class App(ttk.Window):
         self.current_offset = 0
         self.total_items = 0
         self.all_data_loaded = False
+        # 新查询使之前的预取结果全部失效
+        self._load_generation += 1
+        self._prefetch_cache.clear()
+        self._prefetch_pending.clear()
+        self._waiting_offset = None
         self.set_busy(True)
         self.show_skeleton_loader()
         self.load_next_page(is_new_query=True)
@@ -1886,6 +2673,13 @@ class App(ttk.Window):
         if self.is_busy and not is_new_query: return
         if self.all_data_loaded: return
         
+        # 下一页已预取完成，直接显示，无需等待数据库
+        if not is_new_query and self.current_offset in self._prefetch_cache:
+            raw_count, rows = self._prefetch_cache.pop(self.current_offset)
+            self.set_busy(True, is_loading_more=True)
+            self._on_page_load_complete(rows, raw_count, False, self._load_generation)
+            return
+        
         self.set_busy(True, is_loading_more=not is_new_query)
         if not is_new_query:
             self.update_status("正在加载更多数据...", "⏳", True)
@@ -1898,135 +2692,148 @@ class App(ttk.Window):
             self.info_label.config(text="")
             self.data_stats_label.config(text="")
 
-        threading.Thread(target=self._threaded_fetch_page, args=(is_new_query,), daemon=True).start()
+        # 下一页正在预取中，等待预取结果即可，避免重复查询
+        if not is_new_query and self.current_offset in self._prefetch_pending:
+            self._waiting_offset = self.current_offset
+            return
 
-    def _threaded_fetch_page(self, is_new_query):
+        threading.Thread(target=self._threaded_fetch_page,
+                         args=(is_new_query, self._load_generation), daemon=True).start()
+
+    def _fetch_page(self, query, offset):
+        """从数据库读取一页原始数据"""
+        if query:
+            return database.search_products(query, limit=PAGE_SIZE, offset=offset)
+        return database.get_all_products(limit=PAGE_SIZE, offset=offset)
+
+    def _threaded_fetch_page(self, is_new_query, generation):
         try:
-            if self.current_query:
-                if is_new_query: self.total_items = database.search_products_count(self.current_query)
-                products = database.search_products(self.current_query, limit=PAGE_SIZE, offset=self.current_offset)
-            else:
-                if is_new_query: self.total_items = database.get_all_products_count()
-                products = database.get_all_products(limit=PAGE_SIZE, offset=self.current_offset)
-            self.after(0, self._on_page_load_complete, products, is_new_query)
+            if is_new_query:
+                if self.current_query:
+                    self.total_items = database.search_products_count(self.current_query)
+                else:
+                    self.total_items = database.get_all_products_count()
+            products = self._fetch_page(self.current_query, self.current_offset)
+            rows = self._format_product_rows(products, self.current_profit_filter)
+            self.after(0, self._on_page_load_complete, rows, len(products), is_new_query, generation)
         except Exception as e:
             self.after(0, lambda: messagebox.showerror("数据库错误", f"加载数据时出错: {e}"))
             self.after(0, self.set_busy, False)
 
-    def _on_page_load_complete(self, products, is_new_query):
+    # --- Background Prefetch ---
+    def _schedule_prefetch(self):
+        """当前页显示后，在后台预取并格式化后续页面"""
+        generation = self._load_generation
+        for page in range(PREFETCH_PAGES):
+            offset = self.current_offset + page * PAGE_SIZE
+            if offset >= self.total_items:
+                break
+            if offset in self._prefetch_cache or offset in self._prefetch_pending:
+                continue
+            self._prefetch_pending.add(offset)
+            threading.Thread(target=self._threaded_prefetch,
+                             args=(offset, self.current_query, self.current_profit_filter, generation),
+                             daemon=True).start()
+
+    def _threaded_prefetch(self, offset, query, profit_filter, generation):
+        try:
+            products = self._fetch_page(query, offset)
+            rows = self._format_product_rows(products, profit_filter)
+            self.after(0, self._on_prefetch_complete, offset, len(products), rows, generation)
+        except Exception as e:
+            print(f"预取数据时出错: {e}")
+            self.after(0, self._on_prefetch_failed, offset, generation)
+
+    def _on_prefetch_complete(self, offset, raw_count, rows, generation):
+        # 查询已变化，丢弃过期的预取结果
+        if generation != self._load_generation:
+            return
+        self._prefetch_pending.discard(offset)
+        
+        # 用户已经滚动到这一页并在等待，直接显示
+        if self._waiting_offset == offset:
+            self._waiting_offset = None
+            self._on_page_load_complete(rows, raw_count, False, generation)
+            return
+        
+        if offset >= self.current_offset:
+            self._prefetch_cache[offset] = (raw_count, rows)
+
+    def _on_prefetch_failed(self, offset, generation):
+        if generation != self._load_generation:
+            return
+        self._prefetch_pending.discard(offset)
+        
+        # 预取失败时回退为普通加载
+        if self._waiting_offset == offset:
+            self._waiting_offset = None
+            threading.Thread(target=self._threaded_fetch_page,
+                             args=(False, generation), daemon=True).start()
+
+    def _format_product_rows(self, products, profit_filter=None):
+        """计算到手价、利润指标并生成表格显示行（可在后台线程执行）"""
+        items_to_insert = []
+        for product_row in products:
+            # 计算到手价
+            product_dict = dict(zip(database.DB_COLUMNS, product_row))
+            final_price = self.pricer.final_price(
+                product_dict.get('price', 0), 
+                product_dict.get('shop', ''),
+                product_dict.get('product_id', '')
+            )
+            
+            shipping_fee_display = ""
+            gross_margin_rate = ""
+            net_margin_rate = ""
+            
+            if final_price and final_price > 0:
+                # 使用与价格分析页面相同的计算方法
+                profit = database.calculate_profit(final_price, product_dict.get('purchase_price'))
+                shipping_fee_display = f"¥{profit['shipping_fee']:.2f}"
+                gross_margin_rate = f"{profit['gross_margin_rate']:.1f}%"
+                net_margin_rate = f"{profit['net_margin_rate']:.1f}%"
+                
+                # 如果有净利率筛选条件，只保留对应档位的商品
+                if profit_filter and database.get_margin_tier(profit['net_margin_rate']) != profit_filter:
+                    continue
+            
+            # 构建显示数据，包含到手价、采购价、快递费、毛利率和净利率
+            display_data = {}
+            for col in database.DB_COLUMNS:
+                display_data[col] = product_dict[col]
+            display_data['final_price'] = final_price
+            display_data['shipping_fee'] = shipping_fee_display
+            display_data['gross_margin_rate'] = gross_margin_rate
+            display_data['net_margin_rate'] = net_margin_rate
+            
+            reordered_values = [display_data.get(col, '') for col in DISPLAY_COLUMNS]
+            items_to_insert.append(tuple(reordered_values))
+        return items_to_insert
+
+    def _on_page_load_complete(self, items_to_insert, raw_count, is_new_query, generation=None):
         # 只在SKU列表页面且tree存在时处理
         if not (hasattr(self, 'tree') and self.tree):
             return
+        # 查询已变化，丢弃过期的结果
+        if generation is not None and generation != self._load_generation:
+            return
             
         try:
             # 暂时禁用重绘以提高性能
             self.tree.configure(cursor="wait")
             
             if is_new_query:
-                # 批量删除以提高性能
-                children = self.tree.get_children()
-                if children:
-                    self.tree.delete(*children)
+                # 替换后备数据，Tk行项目由虚拟表格复用
+                self.sku_grid.set_rows(items_to_insert)
                 self.tree.configure(style="Custom.Treeview") # Restore normal style
                 # Clear selection when loading new data
                 self.last_clicked_row = None
                 self.last_clicked_column_index = -1
-
-            # 批量插入数据以提高性能
-            if products:
-                items_to_insert = []
-                for product_row in products:
-                    # 计算到手价
-                    product_dict = dict(zip(database.DB_COLUMNS, product_row))
-                    final_price = database.calculate_final_price(
-                        product_dict.get('price', 0), 
-                        product_dict.get('shop', ''),
-                        product_dict.get('product_id', '')
-                    )
-                    
-                    # 计算毛利率、净利率和快递费
-                    purchase_price = float(product_dict.get('purchase_price', 0) or 0)
-                    shipping_fee_display = ""
-                    
-                    # 没有采购价的商品，采购价统一设置为0
-                    if purchase_price <= 0:
-                        purchase_price = 0
-                    
-                    # 如果有净利率筛选条件，先计算净利率判断是否符合条件
-                    if hasattr(self, 'current_profit_filter') and self.current_profit_filter:
-                        if final_price > 0:
-                            # 使用与价格分析页面相同的计算方法
-                            shipping_fee = 30 if final_price >= 150 else 2
-                            after_sales_fee = final_price * 0.02  # 2%
-                            management_fee = final_price * 0.07   # 7%
-                            platform_fee = final_price * 0.01    # 1%
-                            misc_fee = after_sales_fee + management_fee + platform_fee
-                            
-                            # 计算净利润和净利率
-                            net_profit = final_price - purchase_price - shipping_fee - misc_fee
-                            net_margin_rate_percent = (net_profit / final_price) * 100 if final_price > 0 else 0
-                            
-                            # 根据筛选条件判断是否显示
-                            should_show = False
-                            if self.current_profit_filter == "healthy" and net_margin_rate_percent >= 20:
-                                should_show = True
-                            elif self.current_profit_filter == "normal" and 10 <= net_margin_rate_percent < 20:
-                                should_show = True
-                            elif self.current_profit_filter == "warning" and 0 <= net_margin_rate_percent < 10:
-                                should_show = True
-                            elif self.current_profit_filter == "loss" and net_margin_rate_percent < 0:
-                                should_show = True
-                            
-                            if not should_show:
-                                continue
-                    gross_margin_rate = ""
-                    net_margin_rate = ""
-                    
-                    if final_price > 0:
-                        # 计算快递费
-                        shipping_fee = 30 if final_price >= 150 else 2
-                        shipping_fee_display = f"¥{shipping_fee:.2f}"
-                        
-                        # 计算毛利率 = (到手价 - 采购价 - 快递费) / 到手价
-                        # 采购价为0时，毛利率会很高
-                        gross_margin = final_price - purchase_price - shipping_fee
-                        gross_margin_rate = f"{(gross_margin / final_price * 100):.1f}%"
-                        
-                        # 使用与价格分析页面相同的净利率计算方法
-                        after_sales_fee = final_price * 0.02  # 2%
-                        management_fee = final_price * 0.07   # 7%
-                        platform_fee = final_price * 0.01    # 1%
-                        misc_fee = after_sales_fee + management_fee + platform_fee
-                        
-                        # 计算净利润和净利率
-                        net_profit = final_price - purchase_price - shipping_fee - misc_fee
-                        net_margin_rate_percent = (net_profit / final_price) * 100 if final_price > 0 else 0
-                        net_margin_rate = f"{net_margin_rate_percent:.1f}%"
-                    
-                    # 构建显示数据，包含到手价、采购价、快递费、毛利率和净利率
-                    display_data = {}
-                    for col in database.DB_COLUMNS:
-                        display_data[col] = product_dict[col]
-                    display_data['final_price'] = final_price
-                    display_data['shipping_fee'] = shipping_fee_display
-                    display_data['gross_margin_rate'] = gross_margin_rate
-                    display_data['net_margin_rate'] = net_margin_rate
-                    
-                    reordered_values = [display_data.get(col, '') for col in DISPLAY_COLUMNS]
-                    items_to_insert.append(tuple(reordered_values))
-                
-                # 分批插入，避免界面卡顿
-                batch_size = 20
-                for i in range(0, len(items_to_insert), batch_size):
-                    batch = items_to_insert[i:i+batch_size]
-                    for values in batch:
-                        self.tree.insert("", tk.END, values=values)
-                    
-                    # 每批次后更新界面，保持响应性
-                    if i + batch_size < len(items_to_insert):
-                        self.update_idletasks()
+            elif items_to_insert:
+                # 追加到后备数据，只刷新可见窗口
+                self.sku_grid.append_rows(items_to_insert)
             
-            self.current_offset += len(products)
+            self.current_offset += raw_count
             if self.current_offset >= self.total_items:
                 self.all_data_loaded = True
 
@@ -2052,6 +2859,10 @@ class App(ttk.Window):
             print(f"页面加载完成时出错: {e}")
         
         self.set_busy(False)
+        
+        # 当前页已显示，后台预取后续页面
+        if not self.all_data_loaded:
+            self._schedule_prefetch()
 
     # --- Event Handlers ---
     def _on_y_scroll(self, *args):
@@ -2082,7 +2893,7 @@ class App(ttk.Window):
         scroll_amount = delta * 2  # 适中的滚动量
         
         # 执行滚动
-        self.tree.yview_scroll(scroll_amount, "units")
+        self.sku_grid.yview_scroll(scroll_amount, "units")
         
         # 延迟检查懒加载，避免滚动时卡顿
         if self._scroll_timer:
@@ -2102,7 +2913,7 @@ class App(ttk.Window):
     def _check_lazy_load(self):
         """检查是否需要懒加载 - 延迟执行避免滚动卡顿"""
         try:
-            visible_range = self.tree.yview()
+            visible_range = self.sku_grid.yview()
             if len(visible_range) >= 2 and visible_range[1] > 0.85:
                 if not self.is_busy and not self.all_data_loaded:
                     self.load_next_page()
@@ -2115,7 +2926,7 @@ class App(ttk.Window):
             return
             
         try:
-            current_pos = self.tree.yview()[0]
+            current_pos = self.sku_grid.yview()[0]
             step_size = (target_position - current_pos) / steps
             
             def scroll_step(step):
@@ -2124,7 +2935,7 @@ class App(ttk.Window):
                     return
                     
                 new_pos = current_pos + step_size * (steps - step + 1)
-                self.tree.yview_moveto(new_pos)
+                self.sku_grid.yview_moveto(new_pos)
                 self.after(16, lambda: scroll_step(step - 1))  # 约60fps
             
             self._smooth_scroll_active = True
@@ -2137,23 +2948,18 @@ class App(ttk.Window):
         key = event.keysym
         
         if key == "Up":
-            self.tree.yview_scroll(-1, "units")
+            self.sku_grid.yview_scroll(-1, "units")
         elif key == "Down":
-            self.tree.yview_scroll(1, "units")
-        elif key == "Page_Up":
-            self.tree.yview_scroll(-15, "units")  # 增加页面滚动量
-        elif key == "Page_Down":
-            self.tree.yview_scroll(15, "units")   # 增加页面滚动量
-        elif key == "Home":
-            self.tree.yview_moveto(0)
-        elif key == "End":
-            self.tree.yview_moveto(1)
+            self.sku_grid.yview_scroll(1, "units")
+        else:
+            # Page Up/Down（keysym 为 Prior/Next）、Home、End 由虚拟表格滚动
+            self.sku_grid.handle_navigation_key(event)
             # End键时立即检查懒加载
-            if not self.is_busy and not self.all_data_loaded:
+            if key == "End" and not self.is_busy and not self.all_data_loaded:
                 self.after_idle(self.load_next_page)
             
         # 延迟检查懒加载
-        if key in ["Down", "Page_Down"]:
+        if key in ["Down", "Next"]:
             if self._scroll_timer:
                 self.after_cancel(self._scroll_timer)
             self._scroll_timer = self.after(50, self._check_lazy_load)
@@ -2227,38 +3033,34 @@ class App(ttk.Window):
             invalid_ids = set(df_sheet2['无效的规格ID'].dropna().astype(str).str.strip().str.lower())
             enabled_codes = set(df_sheet3['启用的规格编码'].dropna().astype(str).str.strip())
             
-            # 更新数据库中的筛选条件
-            database.update_invalid_spec_ids(invalid_ids)
-            database.update_enabled_skus(enabled_codes)
-            
-            # 添加新字段到主数据
-            report_df['分类'] = ''
-            report_df['仓库'] = ''
-            report_df['简称'] = ''
-            report_df['最低价'] = ''
-            report_df['采购价'] = ''
-            
-            # 根据规格编码合并Sheet3的数据
-            for index, row in report_df.iterrows():
-                sku_code = str(row.get('规格编码', '')).strip()
-                if sku_code in sheet3_extra_data:
-                    extra_data = sheet3_extra_data[sku_code]
-                    report_df.at[index, '分类'] = extra_data['category']
-                    report_df.at[index, '仓库'] = extra_data['warehouse']
-                    report_df.at[index, '简称'] = extra_data['short_name']
-                    report_df.at[index, '最低价'] = extra_data['min_price']
-                    
-                    # 根据简称从Sheet4获取采购价
-                    short_name = extra_data['short_name']
-                    if short_name in sheet4_purchase_data:
-                        report_df.at[index, '采购价'] = sheet4_purchase_data[short_name]
+            # 写入之前先为数据库创建快照，导入结果有问题时可以恢复
+            if BACKUP_BEFORE_IMPORT:
+                backup.create_snapshot(progress=lambda done, total:
+                                       self.after(0, self._on_snapshot_progress, "导入前备份数据库", done, total))
+                self.after(0, lambda: self.status_label.config(text="正在导入数据..."))
+            
+            # 更新数据库中的筛选条件（只写入变化的部分）
+            filter_delta = database.update_product_filters(invalid_ids, enabled_codes)
+            
+            # Sheet3 的扩展信息按规格编码、Sheet4 的采购价按简称单独保存，读取商品时再关联，
+            # 商品行本身的这几列留空
+            database.replace_sku_extensions(sheet3_extra_data)
+            database.replace_purchase_prices(sheet4_purchase_data)
+            for header in ('分类', '仓库', '简称', '最低价', '采购价'):
+                report_df[header] = ''
             
             report_df['_clean_spec_id'] = report_df['规格ID'].astype(str).str.strip().str.lower()
             report_df['_clean_sku'] = report_df['规格编码'].astype(str).str.strip()
             reasons = [('无效的规格ID' if row['_clean_spec_id'] in invalid_ids else ('规格编码未启用' if row['_clean_sku'] != '*' and row['_clean_sku'] not in enabled_codes else '')) for _, row in report_df.iterrows()]
             report_df['_filter_reason'] = reasons; report_df['_is_imported'] = ['是' if not r else '否' for r in reasons]
             if self.generate_report_var.get():
-                with pd.ExcelWriter('debug_report.xlsx') as writer: report_df.to_excel(writer, sheet_name='Filter_Debug_Report', index=False)
+                # 调试报告中显示关联后的扩展信息和采购价
+                debug_df = report_df.copy()
+                extras = debug_df['_clean_sku'].map(sheet3_extra_data)
+                for header, key in (('分类', 'category'), ('仓库', 'warehouse'), ('简称', 'short_name'), ('最低价', 'min_price')):
+                    debug_df[header] = extras.map(lambda data: data[key] if isinstance(data, dict) else '')
+                debug_df['采购价'] = debug_df['简称'].map(sheet4_purchase_data).fillna('')
+                with pd.ExcelWriter('debug_report.xlsx') as writer: debug_df.to_excel(writer, sheet_name='Filter_Debug_Report', index=False)
             df_filtered = report_df[report_df['_is_imported'] == '是']
             user_header_to_db_col = {v: k for k, v in HEADER_MAP.items()}
             df_renamed = df_filtered.rename(columns=user_header_to_db_col).fillna('')
@@ -2273,7 +3075,8 @@ class App(ttk.Window):
                 'total': total_rows, 
                 'processed': len(products_to_process),
                 'filtered': total_rows - len(products_to_process),
-                'db_stats': db_stats
+                'db_stats': db_stats,
+                'filter_delta': filter_delta
             }
             self.after(0, self._on_import_complete, result)
         except Exception as e:
@@ -2282,6 +3085,9 @@ class App(ttk.Window):
     def _on_import_complete(self, result):
         if result['success']:
             db_stats = result['db_stats']
+            invalid_delta = result['filter_delta']['invalid_spec_ids']
+            enabled_delta = result['filter_delta']['enabled_skus']
+            eligibility_changed = invalid_delta['eligibility_changed'] + enabled_delta['eligibility_changed']
             summary_message = f"""
 导入完成！
 
@@ -2294,6 +3100,11 @@ class App(ttk.Window):
 新增记录: {db_stats['added']}
 更新现有记录: {db_stats['updated']}
 
+--- 筛选条件变化 ---
+无效的规格ID: 新增 {len(invalid_delta['added'])}，移除 {len(invalid_delta['removed'])}
+启用的规格编码: 新增 {len(enabled_delta['added'])}，移除 {len(enabled_delta['removed'])}
+有效状态变化的已有商品: {eligibility_changed}
+
 (提示: 导入操作会基于“规格编码”更新已有记录)"""
             messagebox.showinfo("导入结果", summary_message)
         else:
@@ -2304,7 +3115,7 @@ class App(ttk.Window):
 
     def delete_products(self):
         if self.is_busy: return
-        selected_items = self.tree.selection()
+        selected_items = self.sku_grid.selected_rows()
         if not selected_items: return messagebox.showwarning("警告", "请先选择要删除的商品。")
         if messagebox.askyesno("确认删除", f"你确定要删除选中的 {len(selected_items)} 件商品吗？"):
             self.set_busy(True)
@@ -2312,7 +3123,7 @@ class App(ttk.Window):
             self.info_label.config(text="请稍候...")
             def db_task():
                 spec_id_index = DISPLAY_COLUMNS.index('spec_id')
-                for item in selected_items: database.delete_product_by_spec_id(self.tree.item(item, 'values')[spec_id_index])
+                for values in selected_items: database.delete_product_by_spec_id(values[spec_id_index])
                 def on_delete_done():
                     messagebox.showinfo("成功", f"成功删除了 {len(selected_items)} 件商品。")
                     self.start_new_load(force=True)
@@ -2325,19 +3136,47 @@ class App(ttk.Window):
 
     def open_edit_window(self):
         if self.is_busy and not self.is_loading_more: return
-        selected_items = self.tree.selection()
+        selected_items = self.sku_grid.selected_rows()
         if not selected_items: return messagebox.showwarning("警告", "请选择一个要编辑的商品。")
         if len(selected_items) > 1: return messagebox.showwarning("警告", "一次只能编辑一个商品。")
-        product_data = dict(zip(DISPLAY_COLUMNS, self.tree.item(selected_items[0], 'values')))
+        product_data = dict(zip(DISPLAY_COLUMNS, selected_items[0]))
         ProductEditorWindow(self, product=product_data)
 
+    def open_purchase_price_window(self):
+        if self.is_busy and not self.is_loading_more: return
+        selected_items = self.sku_grid.selected_rows()
+        product_data = dict(zip(DISPLAY_COLUMNS, selected_items[0])) if selected_items else {}
+        PurchasePriceWindow(self, product_data.get('short_name', ''), product_data.get('purchase_price', ''))
+
+    def _on_purchase_price_changed(self, short_name):
+        """某个简称的采购价修改后，只重算已加载数据中该简称商品的利润指标"""
+        self._prefetch_cache.clear()
+        if self.current_profit_filter:
+            # 按净利率筛选时，利润变化会改变行是否入选，需要重新加载
+            self.start_new_load(force=True)
+        else:
+            # 采购价和扩展信息在读取时关联，重新读取这些行即可得到新值
+            short_name_index = DISPLAY_COLUMNS.index('short_name')
+            spec_index = DISPLAY_COLUMNS.index('spec_id')
+            indices = {row[spec_index]: index for index, row in enumerate(self.sku_grid.rows)
+                       if row[short_name_index] == short_name}
+            updates = {}
+            for product in database.get_products_by_spec_ids(list(indices)):
+                updates[indices[product['spec_id']]] = self._format_product_rows([tuple(product)])[0]
+            if updates:
+                self.sku_grid.update_rows(updates)
+        
+        if self.current_page == "price_analysis":
+            self._refresh_price_analysis()
+        self.update_status(f"已更新简称「{short_name}」的采购价", "💰")
+
 # --- 优惠券管理窗口 ---
 class CouponManagerWindow(ttk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
         self.title("优惠券管理")
-        self.geometry("900x600")
+        self.geometry("1000x600")
         self.minsize(800, 500)
         self.transient(parent)
         self.grab_set()
@@ -2375,6 +3214,13 @@ class CouponManagerWindow(ttk.Toplevel):
                   bootstyle="danger", width=10).pack(side=LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="🔄 刷新", command=self.load_coupons,
                   bootstyle="secondary", width=10).pack(side=RIGHT)
+        self.list_info_label = ttk.Label(button_frame, text="", font=("Microsoft YaHei UI", 10),
+                                         foreground="#888")
+        self.list_info_label.pack(side=RIGHT, padx=(0, 12))
+        
+        # 筛选栏
+        self.filter_bar = CouponFilterBar(main_frame, on_change=self.load_coupons)
+        self.filter_bar.pack(fill=X, pady=(0, 12))
         
         # 优惠券列表
         list_frame = ttk.Frame(main_frame)
@@ -2409,7 +3255,9 @@ class CouponManagerWindow(ttk.Toplevel):
         v_scrollbar = ttk.Scrollbar(list_frame, orient=VERTICAL, command=self.coupon_tree.yview)
         h_scrollbar = ttk.Scrollbar(list_frame, orient=HORIZONTAL, command=self.coupon_tree.xview)
         
-        self.coupon_tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.coupon_tree.configure(xscrollcommand=h_scrollbar.set)
+        self.coupon_pager = CouponListPager(self, self.coupon_tree, v_scrollbar, columns,
+                                            on_loaded=self._on_page_loaded)
         
         # 布局
         self.coupon_tree.grid(row=0, column=0, sticky="nsew")
@@ -2423,36 +3271,17 @@ class CouponManagerWindow(ttk.Toplevel):
         self.coupon_tree.bind("<Double-Button-1>", lambda e: self.edit_coupon())
     
     def load_coupons(self):
-        """加载优惠券数据"""
-        # 清空现有数据
-        for item in self.coupon_tree.get_children():
-            self.coupon_tree.delete(item)
-        
-        # 加载数据
-        coupons = database.get_all_coupons()
-        for coupon in coupons:
-            coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
-            
-            # 格式化显示数据
-            display_data = []
-            for col in ['id', 'shop', 'coupon_type', 'amount', 'min_price', 
-                       'start_date', 'end_date', 'description', 'is_active']:
-                value = coupon_dict[col]
-                
-                if col == 'coupon_type':
-                    value = '固定金额' if value == 'fixed' else '百分比'
-                elif col == 'amount':
-                    coupon_type = coupon_dict['coupon_type']
-                    if coupon_type == 'fixed':
-                        value = f"¥{value}"
-                    else:
-                        value = f"{value}%"
-                elif col == 'is_active':
-                    value = '启用' if value else '禁用'
-                
-                display_data.append(str(value))
-            
-            self.coupon_tree.insert("", tk.END, values=display_data)
+        """按筛选条件分页加载优惠券"""
+        self.coupon_pager.reload(self.filter_bar.filters())
+    
+    def _on_page_loaded(self, loaded, total):
+        self.list_info_label.config(text=f"已显示 {loaded} / {total}")
+    
+    def _on_coupon_saved(self, coupon_id):
+        """优惠券保存后只更新列表中的对应行"""
+        self.coupon_pager.update_coupon(coupon_id)
+        self.parent._schedule_coupon_boundary_check()
+        self.parent.start_new_load(force=True)
     
     def add_coupon(self):
         """添加优惠券"""
@@ -2473,6 +3302,8 @@ class CouponManagerWindow(ttk.Toplevel):
         if coupon:
             coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
             CouponEditorWindow(self, coupon_dict)
+        elif self.filter_bar.is_archived():
+            messagebox.showinfo("提示", "已归档的优惠券只能查看，不能编辑", parent=self)
     
     def delete_coupon(self):
         """删除优惠券"""
@@ -2480,16 +3311,194 @@ class CouponManagerWindow(ttk.Toplevel):
         if not selected:
             messagebox.showwarning("警告", "请选择要删除的优惠券", parent=self)
             return
+        if self.filter_bar.is_archived():
+            messagebox.showinfo("提示", "已归档的优惠券只能查看，不能删除", parent=self)
+            return
         
         if messagebox.askyesno("确认删除", "确定要删除选中的优惠券吗？", parent=self):
+            coupon_ids = []
             for item in selected:
                 values = self.coupon_tree.item(item, 'values')
                 coupon_id = values[0]
                 database.delete_coupon(coupon_id)
+                coupon_ids.append(coupon_id)
             
-            self.load_coupons()
+            # 只移除被删除的行
+            self.coupon_pager.remove_coupons(coupon_ids)
+            self.parent._schedule_coupon_boundary_check()
             messagebox.showinfo("成功", "优惠券删除成功", parent=self)
 
+# --- 优惠券冲突报告窗口 ---
+class CouponConflictReportWindow(ttk.Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("优惠券冲突检查")
+        self.geometry("900x500")
+        self.minsize(700, 400)
+        self.transient(parent)
+        
+        self.conflicts = []
+        self.center_window()
+        self._build_ui()
+        self.load_report()
+    
+    def center_window(self):
+        """窗口居中显示"""
+        self.update_idletasks()
+        x = (self.winfo_screenwidth() // 2) - (self.winfo_width() // 2)
+        y = (self.winfo_screenheight() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+    
+    def _build_ui(self):
+        main_frame = ttk.Frame(self, padding=(20, 20, 20, 20))
+        main_frame.pack(fill=BOTH, expand=True)
+        
+        header = ttk.Frame(main_frame)
+        header.pack(fill=X, pady=(0, 15))
+        ttk.Label(header, text="⚠️ 优惠券冲突检查", 
+                 font=("Microsoft YaHei UI", 16, "bold")).pack(side=LEFT)
+        ttk.Button(header, text="🔄 重新检查", command=self.load_report,
+                  bootstyle="secondary", width=12).pack(side=RIGHT)
+        
+        self.summary_label = ttk.Label(main_frame, text="", font=("Microsoft YaHei UI", 10),
+                                       foreground="#888")
+        self.summary_label.pack(anchor=tk.W, pady=(0, 10))
+        
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(fill=BOTH, expand=True)
+        
+        columns = ['shop', 'coupon_type', 'coupon_a', 'period_a', 'coupon_b', 'period_b', 'products']
+        headers = {
+            'shop': '店铺', 'coupon_type': '类型', 'coupon_a': '优惠券A', 'period_a': '有效期A',
+            'coupon_b': '优惠券B', 'period_b': '有效期B', 'products': '重叠范围'
+        }
+        self.conflict_tree = ttk.Treeview(list_frame, columns=columns, show="headings", height=15)
+        for col in columns:
+            self.conflict_tree.heading(col, text=headers[col], anchor=CENTER)
+            width = 200 if col == 'products' else (170 if col.startswith('period') else 90)
+            self.conflict_tree.column(col, width=width, minwidth=50,
+                                      anchor=tk.W if col == 'products' else CENTER)
+        
+        v_scrollbar = ttk.Scrollbar(list_frame, orient=VERTICAL, command=self.conflict_tree.yview)
+        self.conflict_tree.configure(yscrollcommand=v_scrollbar.set)
+        self.conflict_tree.grid(row=0, column=0, sticky="nsew")
+        v_scrollbar.grid(row=0, column=1, sticky="ns")
+        list_frame.grid_rowconfigure(0, weight=1)
+        list_frame.grid_columnconfigure(0, weight=1)
+        
+        # 双击编辑较晚创建的那张优惠券
+        self.conflict_tree.bind("<Double-Button-1>", self.on_double_click)
+    
+    def load_report(self):
+        """后台检查所有优惠券的冲突"""
+        self.summary_label.config(text="⏳ 正在检查...")
+        
+        def db_task():
+            try:
+                conflicts = build_conflict_report()
+                self.after(0, self._on_report_loaded, conflicts)
+            except Exception as e:
+                print(f"检查优惠券冲突时出错: {e}")
+        
+        threading.Thread(target=db_task, daemon=True).start()
+    
+    def _on_report_loaded(self, conflicts):
+        if not self.winfo_exists():
+            return
+        self.conflicts = conflicts
+        self.conflict_tree.delete(*self.conflict_tree.get_children())
+        for index, (coupon_a, coupon_b, products) in enumerate(conflicts):
+            scope = "全店" if products is None else ", ".join(sorted(products))
+            self.conflict_tree.insert("", tk.END, iid=str(index), values=(
+                coupon_a['shop'],
+                COUPON_TYPE_MAP.get(coupon_a['coupon_type'], coupon_a['coupon_type']),
+                f"#{coupon_a['id']}",
+                f"{coupon_a['start_date']} ~ {coupon_a['end_date']}",
+                f"#{coupon_b['id']}",
+                f"{coupon_b['start_date']} ~ {coupon_b['end_date']}",
+                scope
+            ))
+        if conflicts:
+            self.summary_label.config(text=f"发现 {len(conflicts)} 组冲突，双击可编辑优惠券B")
+        else:
+            self.summary_label.config(text="✅ 没有发现冲突")
+    
+    def on_double_click(self, event):
+        selected = self.conflict_tree.selection()
+        if not selected:
+            return
+        coupon = self.conflicts[int(selected[0])][1]
+        CouponEditorWindow(self.parent, dict(coupon))
+
+# --- 数据库快照恢复窗口 ---
+class SnapshotRestoreWindow(ttk.Toplevel):
+    """列出已有的数据库快照，选择一个恢复"""
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("恢复数据库快照")
+        self.geometry("560x420")
+        self.transient(parent)
+        self.grab_set()
+        
+        self.snapshots = backup.list_snapshots()
+        self._build_ui()
+        
+        self.update_idletasks()
+        x = (self.winfo_screenwidth() // 2) - (self.winfo_width() // 2)
+        y = (self.winfo_screenheight() // 2) - (self.winfo_height() // 2)
+        self.geometry(f"+{x}+{y}")
+    
+    def _build_ui(self):
+        main_frame = ttk.Frame(self, padding=(20, 20, 20, 20))
+        main_frame.pack(fill=BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="♻️ 恢复数据库快照",
+                 font=("Microsoft YaHei UI", 16, "bold")).pack(anchor=tk.W)
+        ttk.Label(main_frame, text=f"快照保存在 {backup.backup_dir()}，保留最新的 {backup.BACKUP_KEEP} 个",
+                 font=("Microsoft YaHei UI", 9), foreground="#888").pack(anchor=tk.W, pady=(5, 10))
+        
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(fill=BOTH, expand=True)
+        columns = ['created', 'size']
+        self.snapshot_tree = ttk.Treeview(list_frame, columns=columns, show="headings", height=10,
+                                          selectmode="browse")
+        self.snapshot_tree.heading('created', text='创建时间', anchor=CENTER)
+        self.snapshot_tree.heading('size', text='大小', anchor=CENTER)
+        self.snapshot_tree.column('created', width=300, anchor=CENTER)
+        self.snapshot_tree.column('size', width=150, anchor=CENTER)
+        v_scrollbar = ttk.Scrollbar(list_frame, orient=VERTICAL, command=self.snapshot_tree.yview)
+        self.snapshot_tree.configure(yscrollcommand=v_scrollbar.set)
+        self.snapshot_tree.grid(row=0, column=0, sticky="nsew")
+        v_scrollbar.grid(row=0, column=1, sticky="ns")
+        list_frame.grid_rowconfigure(0, weight=1)
+        list_frame.grid_columnconfigure(0, weight=1)
+        for index, snapshot in enumerate(self.snapshots):
+            self.snapshot_tree.insert("", tk.END, iid=str(index), values=(
+                snapshot['created'].strftime('%Y-%m-%d %H:%M:%S'), f"{snapshot['size'] / 1024 ** 2:.1f} MB"))
+        self.snapshot_tree.bind("<Double-Button-1>", lambda event: self.restore())
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=X, pady=(15, 0))
+        ttk.Button(button_frame, text="取消", command=self.destroy,
+                  bootstyle="secondary", width=10).pack(side=RIGHT, padx=(10, 0))
+        ttk.Button(button_frame, text="恢复所选快照", command=self.restore,
+                  bootstyle="warning", width=14).pack(side=RIGHT)
+    
+    def restore(self):
+        selection = self.snapshot_tree.selection()
+        if not selection:
+            messagebox.showwarning("警告", "请先选择要恢复的快照。", parent=self)
+            return
+        snapshot = self.snapshots[int(selection[0])]
+        created = snapshot['created'].strftime('%Y-%m-%d %H:%M:%S')
+        if not messagebox.askyesno("确认恢复", f"当前数据库的全部数据将被替换为 {created} 的快照，确定要恢复吗？",
+                                   parent=self):
+            return
+        self.destroy()
+        self.parent.restore_snapshot(snapshot['path'])
+
 # --- 优惠券编辑窗口 ---
 class CouponEditorWindow(ttk.Toplevel):
     def __init__(self, parent, coupon=None):
@@ -2497,11 +3506,20 @@ class CouponEditorWindow(ttk.Toplevel):
         self.parent = parent
         self.coupon = coupon
         self.title("编辑优惠券" if coupon else "新增优惠券")
-        self.geometry("500x600")
+        self.geometry("520x780")
         self.minsize(450, 550)
         self.transient(parent)
         self.grab_set()
         
+        # 影响预览：按店铺缓存现有到手价，输入变化时只重算优惠券覆盖的SKU
+        self.impact_simulator = None
+        self._impact_timer = None
+        
+        # 店铺货品的搜索索引和当前显示的货品
+        self.product_index = ProductSearchIndex([])
+        self.products_loaded = False
+        self.visible_products = []
+        
         self.center_window()
         self._build_ui()
     
@@ -2671,33 +3689,23 @@ class CouponEditorWindow(ttk.Toplevel):
                                               foreground="#4A90E2")
         self.selection_status_label.pack(side=tk.RIGHT)
         
-        # 商品列表框容器
-        listbox_container = ttk.Frame(self.product_listbox_frame)
-        listbox_container.pack(fill=BOTH, expand=True)
-        
-        try:
-            self.product_listbox = tk.Listbox(listbox_container, 
-                                            font=("Microsoft YaHei UI", 10),
-                                            height=6, selectmode=tk.MULTIPLE)
-            product_scrollbar = ttk.Scrollbar(listbox_container, orient=tk.VERTICAL, 
-                                            command=self.product_listbox.yview)
-            self.product_listbox.configure(yscrollcommand=product_scrollbar.set)
-            
-            self.product_listbox.pack(side=tk.LEFT, fill=BOTH, expand=True)
-            product_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-            
-            # 绑定选择变化事件
-            self.product_listbox.bind("<<ListboxSelect>>", self.on_product_selection_changed)
-        except Exception as e:
-            print(f"创建product_listbox时出错: {e}")
-            # 创建一个空的占位符
-            self.product_listbox = None
-        
-        # 存储所有商品数据用于搜索
-        self.all_products = []
+        # 货品列表：虚拟表格只为可见行创建行项目，两万个货品也能流畅滚动和筛选
+        # 选择按货品ID保存在 product_grid.selected 中，与搜索筛选后显示的行无关
+        self.product_grid = VirtualTreeview(self.product_listbox_frame, ('product_id', 'name'),
+                                            height=6, selectmode="none",
+                                            selection_key=lambda row: row[0])
+        self.product_grid.pack(fill=BOTH, expand=True)
+        self.product_grid.tree.heading('product_id', text='货品ID')
+        self.product_grid.tree.heading('name', text='货品名称')
+        self.product_grid.tree.column('product_id', width=120, stretch=False)
+        self.product_grid.tree.column('name', width=260)
+        # 单击切换选择（与多选列表框一致），滚轮滚动虚拟窗口
+        self.product_grid.tree.bind("<Button-1>", self.on_product_click)
+        self.product_grid.tree.bind("<MouseWheel>", self.on_product_wheel)
+        self.product_grid.tree.bind("<Button-4>", lambda e: self.product_grid.yview_scroll(-1, "units"))
+        self.product_grid.tree.bind("<Button-5>", lambda e: self.product_grid.yview_scroll(1, "units"))
         
         # 初始状态禁用货品选择
-        self.product_listbox.configure(state=tk.DISABLED)
         self.product_search_entry.configure(state=tk.DISABLED)
         self.product_count_label.config(text="请先选择店铺")
         row += 1
@@ -2717,6 +3725,25 @@ class CouponEditorWindow(ttk.Toplevel):
                                                      pady=(10, 20), sticky=tk.W)
         row += 1
         
+        # 影响预览
+        impact_frame = ttk.Labelframe(main_frame, text="📊 影响预览", padding=(12, 8))
+        impact_frame.grid(row=row, column=0, columnspan=2, sticky=tk.EW)
+        self.impact_summary_label = ttk.Label(impact_frame, text="请先选择店铺",
+                                              font=("Microsoft YaHei UI", 9))
+        self.impact_summary_label.pack(anchor=tk.W)
+        self.impact_tier_label = ttk.Label(impact_frame, text="", font=("Microsoft YaHei UI", 9),
+                                           foreground="#4A90E2", justify=tk.LEFT)
+        self.impact_tier_label.pack(anchor=tk.W, pady=(4, 0))
+        self.impact_floor_label = ttk.Label(impact_frame, text="", font=("Microsoft YaHei UI", 9),
+                                            foreground="#E74C3C", justify=tk.LEFT)
+        self.impact_floor_label.pack(anchor=tk.W, pady=(4, 0))
+        row += 1
+        
+        # 输入变化时刷新影响预览
+        for key in ('amount', 'min_price', 'start_date', 'end_date'):
+            self.entries[key].bind("<KeyRelease>", self.schedule_impact_preview, add="+")
+        self.is_active_var.trace_add('write', self.schedule_impact_preview)
+        
         main_frame.grid_columnconfigure(1, weight=1)
         
         # 填充现有数据
@@ -2749,8 +3776,8 @@ class CouponEditorWindow(ttk.Toplevel):
                     self.product_scope_var.set("specific")
                     self.on_scope_changed()
                     
-                    # 等待商品列表加载完成后选中对应的商品
-                    self.after(100, lambda: self.select_products_by_ids(product_ids))
+                    # 选择只记录货品ID，货品列表在后台加载完成后自动显示选中状态
+                    self.select_products_by_ids(product_ids)
                 except:
                     pass
         else:
@@ -2773,23 +3800,42 @@ class CouponEditorWindow(ttk.Toplevel):
                   bootstyle="success", width=12).pack(side=RIGHT)
     
     def on_shop_changed(self, event=None):
-        """店铺选择改变时加载货品列表"""
+        """店铺选择改变时在后台加载货品列表"""
         shop = self.shop_var.get()
+        self.product_index = ProductSearchIndex([])
+        self.products_loaded = False
+        self.product_grid.selected.clear()
+        self.update_product_list()
         if not shop:
-            self.all_products = []
-            if hasattr(self, 'product_listbox') and self.product_listbox is not None:
-                self.product_listbox.delete(0, tk.END)
             return
-            
-        # 加载该店铺的货品（按货品ID去重）
-        products = database.get_products_by_shop(shop)
-        self.all_products = [(product_id, name) for product_id, name in products]
         
-        # 更新货品列表显示
-        self.update_product_list()
+        self.product_count_label.config(text="⏳ 正在加载货品...")
+        
+        def db_task():
+            try:
+                # 加载该店铺的货品（按货品ID去重）并建立搜索索引
+                index = ProductSearchIndex(database.get_products_by_shop(shop))
+                self.after(0, self._on_products_loaded, shop, index)
+            except Exception as e:
+                print(f"加载货品列表时出错: {e}")
+        
+        threading.Thread(target=db_task, daemon=True).start()
         
         # 清空搜索框
         self.product_search_var.set("")
+        
+        self._load_impact_simulator(shop)
+    
+    def _on_products_loaded(self, shop, index):
+        # 加载期间店铺已切换，丢弃过期结果
+        if shop != self.shop_var.get() or not self.winfo_exists():
+            return
+        self.product_index = index
+        self.products_loaded = True
+        # 丢弃店铺中已不存在的货品
+        self.product_grid.selected &= {product_id for product_id, _ in index.products}
+        self.on_product_search()
+        self.on_product_selection_changed(None)
     
     def on_type_changed(self):
         """优惠券类型改变时更新界面"""
@@ -2815,74 +3861,58 @@ class CouponEditorWindow(ttk.Toplevel):
             self.amount_unit_label.config(text="%")
             self.min_price_label.grid_remove()
             self.entries['min_price'].grid_remove()
+        
+        self.schedule_impact_preview()
     
     def on_scope_changed(self):
         """适用范围改变时更新界面"""
-        if not hasattr(self, 'product_listbox') or self.product_listbox is None:
-            return
-            
         if self.product_scope_var.get() == "all":
-            self.product_listbox.configure(state=tk.DISABLED)
             self.product_search_entry.configure(state=tk.DISABLED)
-            self.product_listbox.selection_clear(0, tk.END)
+            self.product_grid.clear_selection()
             self.product_count_label.config(text="全店通用，无需选择货品")
             self.selection_status_label.config(text="")
         else:
-            self.product_listbox.configure(state=tk.NORMAL)
             self.product_search_entry.configure(state=tk.NORMAL)
             # 如果有货品数据，更新计数显示
-            if self.all_products:
-                self.update_product_list()
+            if len(self.product_index):
+                self.update_product_list(self._product_search_term())
                 self.on_product_selection_changed(None)  # 更新选择状态
             else:
                 self.product_count_label.config(text="请先选择店铺")
                 self.selection_status_label.config(text="")
+        self.schedule_impact_preview()
     
     def update_product_list(self, search_term=""):
-        """更新货品列表显示"""
-        # 检查product_listbox是否存在
-        if not hasattr(self, 'product_listbox') or self.product_listbox is None:
-            print("警告: product_listbox 不存在，跳过更新")
-            return
-            
-        # 清空当前列表
-        self.product_listbox.delete(0, tk.END)
-        
-        # 根据搜索条件筛选货品
-        filtered_products = []
-        search_term = search_term.lower().strip()
-        
-        for product_id, name in self.all_products:
-            if not search_term or (search_term in product_id.lower() or search_term in name.lower()):
-                filtered_products.append((product_id, name))
-        
-        # 添加筛选后的货品到列表
-        for product_id, name in filtered_products:
-            display_text = f"{product_id} - {name}"
-            self.product_listbox.insert(tk.END, display_text)
+        """按搜索条件更新货品列表：在索引中查找，只渲染可见行"""
+        self.visible_products = [self.product_index.products[i]
+                                 for i in self.product_index.search(search_term)]
+        self.product_grid.set_rows(self.visible_products)
         
         # 更新货品计数显示
-        total_count = len(self.all_products)
-        filtered_count = len(filtered_products)
+        total_count = len(self.product_index)
+        filtered_count = len(self.visible_products)
         
-        if search_term:
+        if search_term.strip():
             self.product_count_label.config(text=f"🔍 找到 {filtered_count} 个货品（共 {total_count} 个）")
             if filtered_count == 0:
                 self.product_count_label.config(text=f"🔍 未找到匹配的货品（共 {total_count} 个）")
         else:
             self.product_count_label.config(text=f"📦 共 {total_count} 个货品")
     
+    def _product_search_term(self):
+        search_term = self.product_search_var.get()
+        # 如果是占位符文本，则不进行搜索
+        if search_term == self.product_search_placeholder:
+            search_term = ""
+        return search_term
+    
     def on_product_search(self, *args):
         """商品搜索框内容改变时触发"""
         # 检查必要的属性是否存在
-        if not hasattr(self, 'product_search_var') or not hasattr(self, 'product_search_placeholder'):
+        if not hasattr(self, 'product_grid') or not hasattr(self, 'product_search_placeholder'):
             return
             
-        search_term = self.product_search_var.get()
-        # 如果是占位符文本，则不进行搜索
-        if search_term == self.product_search_placeholder:
-            search_term = ""
-        self.update_product_list(search_term)
+        self.update_product_list(self._product_search_term())
     
     def clear_product_search(self):
         """清除商品搜索"""
@@ -2893,21 +3923,9 @@ class CouponEditorWindow(ttk.Toplevel):
     
     def select_products_by_ids(self, product_ids):
         """根据货品ID列表选中对应的货品"""
-        if not product_ids or not hasattr(self, 'product_listbox') or self.product_listbox is None:
-            return
-            
-        try:
-            # 清除当前选择
-            self.product_listbox.selection_clear(0, tk.END)
-            
-            # 选中对应的货品
-            for i in range(self.product_listbox.size()):
-                product_text = self.product_listbox.get(i)
-                product_id = product_text.split(' - ')[0]
-                if product_id in product_ids:
-                    self.product_listbox.selection_set(i)
-        except Exception as e:
-            print(f"选择货品时出错: {e}")
+        self.product_grid.selected = set(product_ids or [])
+        self.product_grid._sync_selection()
+        self.on_product_selection_changed(None)
     
     def setup_product_search_placeholder(self):
         """设置货品搜索框占位符"""
@@ -2936,30 +3954,158 @@ class CouponEditorWindow(ttk.Toplevel):
             self.product_search_entry.configure(foreground=self.product_search_placeholder_color)
     
     def select_all_products(self):
-        """全选当前显示的货品"""
-        if hasattr(self, 'product_listbox') and self.product_listbox is not None:
-            if self.product_listbox.cget('state') == tk.NORMAL:
-                self.product_listbox.selection_set(0, tk.END)
+        """全选当前显示的货品（已选中的其它货品保持选中）"""
+        if self.product_scope_var.get() == "specific":
+            self.product_grid.selected.update(product_id for product_id, _ in self.visible_products)
+            self.product_grid._sync_selection()
+            self.on_product_selection_changed(None)
     
     def select_none_products(self):
         """取消选择所有货品"""
-        if hasattr(self, 'product_listbox') and self.product_listbox is not None:
-            if self.product_listbox.cget('state') == tk.NORMAL:
-                self.product_listbox.selection_clear(0, tk.END)
+        if self.product_scope_var.get() == "specific":
+            self.product_grid.clear_selection()
+            self.on_product_selection_changed(None)
+    
+    def on_product_click(self, event):
+        """单击切换货品的选中状态"""
+        if self.product_scope_var.get() != "specific":
+            return "break"
+        index = self.product_grid.index_of(self.product_grid.tree.identify_row(event.y))
+        if index is None or index >= len(self.visible_products):
+            return "break"
+        product_id = self.visible_products[index][0]
+        if product_id in self.product_grid.selected:
+            self.product_grid.selected.discard(product_id)
+        else:
+            self.product_grid.selected.add(product_id)
+        self.product_grid._sync_selection()
+        self.on_product_selection_changed(None)
+        return "break"
+    
+    def on_product_wheel(self, event):
+        self.product_grid.yview_scroll(int(-1 * (event.delta / 120)) * 2, "units")
+        return "break"
     
     def on_product_selection_changed(self, event):
         """货品选择变化时更新状态显示"""
-        if not hasattr(self, 'product_listbox') or self.product_listbox is None:
-            return
-            
         if self.product_scope_var.get() == "specific":
-            selected_count = len(self.product_listbox.curselection())
+            selected_count = len(self.product_grid.selected)
             if selected_count > 0:
                 self.selection_status_label.config(text=f"✓ 已选择 {selected_count} 个货品")
             else:
                 self.selection_status_label.config(text="请选择货品")
         else:
             self.selection_status_label.config(text="")
+        self.schedule_impact_preview()
+    
+    def _load_impact_simulator(self, shop):
+        """后台加载店铺的现有到手价，供影响预览使用"""
+        self.impact_simulator = None
+        self.impact_summary_label.config(text="⏳ 正在加载店铺商品...")
+        self.impact_tier_label.config(text="")
+        self.impact_floor_label.config(text="")
+        exclude_coupon_id = self.coupon.get('id') if self.coupon else None
+        
+        def db_task():
+            try:
+                simulator = CouponImpactSimulator(shop, exclude_coupon_id)
+                self.after(0, self._on_impact_simulator_loaded, simulator)
+            except Exception as e:
+                print(f"加载影响预览数据时出错: {e}")
+        
+        threading.Thread(target=db_task, daemon=True).start()
+    
+    def _on_impact_simulator_loaded(self, simulator):
+        # 加载期间店铺已切换，丢弃过期结果
+        if simulator.shop != self.shop_var.get() or not self.winfo_exists():
+            return
+        self.impact_simulator = simulator
+        self.update_impact_preview()
+    
+    def schedule_impact_preview(self, *args):
+        """输入停顿后再刷新影响预览"""
+        if self._impact_timer:
+            self.after_cancel(self._impact_timer)
+        self._impact_timer = self.after(IMPACT_PREVIEW_DELAY_MS, self.update_impact_preview)
+    
+    def _read_impact_draft(self):
+        """读取表单中的草稿优惠券，输入不完整时抛出 ValueError"""
+        coupon_type = self.coupon_type_var.get()
+        amount = float(self.entries['amount'].get().strip())
+        if coupon_type == 'discount':
+            if amount <= 0 or amount >= 100:
+                raise ValueError("折扣必须在0-100之间")
+            amount = amount / 100
+        elif amount <= 0:
+            raise ValueError("金额必须大于0")
+        min_price = float(self.entries['min_price'].get().strip() or 0) if coupon_type == 'threshold' else 0
+        return {'coupon_type': coupon_type, 'amount': amount, 'min_price': min_price}
+    
+    def _selected_product_ids(self):
+        """选中的货品ID，按货品列表顺序（包括被搜索条件隐藏的货品）"""
+        selected = self.product_grid.selected
+        # 货品列表还在后台加载时索引为空，直接使用已选的货品ID
+        if not self.products_loaded:
+            return sorted(selected)
+        return [product_id for product_id, _ in self.product_index.products if product_id in selected]
+    
+    def update_impact_preview(self):
+        """根据当前输入预览保存后到手价和利润档位的变化"""
+        self._impact_timer = None
+        if self.impact_simulator is None or not self.winfo_exists():
+            return
+        
+        try:
+            draft = self._read_impact_draft()
+        except ValueError:
+            self.impact_summary_label.config(text="请输入有效的面额/折扣后查看影响")
+            self.impact_tier_label.config(text="")
+            self.impact_floor_label.config(text="")
+            return
+        
+        product_ids = None
+        if self.product_scope_var.get() == "specific":
+            product_ids = self._selected_product_ids()
+        
+        # 不在有效期内或未启用的优惠券不影响当前到手价
+        from datetime import datetime
+        today = datetime.now().strftime('%Y-%m-%d')
+        start_date = self.entries['start_date'].get().strip()
+        end_date = self.entries['end_date'].get().strip()
+        effective = self.is_active_var.get() and start_date <= today <= end_date
+        
+        result = self.impact_simulator.simulate(draft if effective else None, product_ids,
+                                                limit=IMPACT_PREVIEW_ROWS)
+        summary = f"覆盖 {result['affected']} 个SKU，保存后 {result['repriced']} 个SKU到手价变化"
+        if not effective:
+            summary += "（未启用或不在有效期内）"
+        self.impact_summary_label.config(text=summary)
+        
+        tier_lines = []
+        for tier, label in MARGIN_TIER_LABELS.items():
+            before, after = result['tiers_before'][tier], result['tiers_after'][tier]
+            change = f"{after - before:+d}" if after != before else "不变"
+            tier_lines.append(f"{label}: {before} → {after}（{change}）")
+        self.impact_tier_label.config(text="\n".join(tier_lines))
+        
+        if result['below_min_price_count']:
+            floor_lines = [f"⚠️ {result['below_min_price_count']} 个SKU到手价低于最低价"]
+            for item in result['below_min_price']:
+                floor_lines.append(f"  {item['spec_id']} {item['name']}: "
+                                   f"¥{item['final_price']:.2f} < ¥{item['min_price']:.2f}")
+            self.impact_floor_label.config(text="\n".join(floor_lines))
+        else:
+            self.impact_floor_label.config(text="")
+    
+    def _format_conflicts(self, conflicts, limit=5):
+        """冲突提示文字"""
+        lines = [f"有 {len(conflicts)} 张同类型优惠券的有效期与当前优惠券重叠："]
+        for coupon_dict, products in conflicts[:limit]:
+            scope = "全店" if products is None else "货品 " + ", ".join(sorted(products)[:3])
+            lines.append(f"  #{coupon_dict['id']} {coupon_dict['start_date']} ~ {coupon_dict['end_date']}（{scope}）")
+        if len(conflicts) > limit:
+            lines.append(f"  ……另有 {len(conflicts) - limit} 张")
+        return "\n".join(lines)
     
     def save(self):
         """保存优惠券"""
@@ -2997,19 +4143,10 @@ class CouponEditorWindow(ttk.Toplevel):
             # 处理货品选择
             product_ids = []
             if self.product_scope_var.get() == "specific":
-                if not hasattr(self, 'product_listbox') or self.product_listbox is None:
-                    messagebox.showerror("错误", "货品列表未正确初始化", parent=self)
-                    return
-                    
-                selected_indices = self.product_listbox.curselection()
-                if not selected_indices:
+                product_ids = self._selected_product_ids()
+                if not product_ids:
                     messagebox.showerror("错误", "请选择适用的货品", parent=self)
                     return
-                
-                for index in selected_indices:
-                    product_text = self.product_listbox.get(index)
-                    product_id = product_text.split(' - ')[0]
-                    product_ids.append(product_id)
             
             # 构建优惠券数据
             coupon_data = {
@@ -3029,27 +4166,25 @@ class CouponEditorWindow(ttk.Toplevel):
                 messagebox.showerror("错误", "开始日期和结束日期不能为空", parent=self)
                 return
             
+            # 检查同店铺同类型优惠券的有效期重叠
+            conflicts = find_coupon_conflicts(dict(coupon_data, id=self.coupon['id'] if self.coupon else None))
+            if conflicts and not messagebox.askyesno(
+                    "优惠券冲突", self._format_conflicts(conflicts) + "\n\n是否仍然保存？", parent=self):
+                return
+            
             # 保存到数据库
             if self.coupon:
                 coupon_data['id'] = self.coupon['id']
                 database.update_coupon(coupon_data)
+                coupon_id = coupon_data['id']
                 messagebox.showinfo("成功", "优惠券更新成功", parent=self)
             else:
-                database.add_coupon(coupon_data)
+                coupon_id = database.add_coupon(coupon_data)
                 messagebox.showinfo("成功", "优惠券添加成功", parent=self)
             
-            # 刷新数据
-            if hasattr(self.parent, '_refresh_coupons'):
-                # 如果是主窗口调用
-                self.parent._refresh_coupons()
-                # 刷新SKU列表的到手价
-                if hasattr(self.parent, 'tree'):
-                    self.parent.start_new_load(force=True)
-            elif hasattr(self.parent, 'load_coupons'):
-                # 如果是优惠券管理窗口调用
-                self.parent.load_coupons()
-                if hasattr(self.parent, 'parent'):
-                    self.parent.parent.start_new_load(force=True)
+            # 刷新数据：主窗口和优惠券管理窗口都只更新列表中的这一行
+            if hasattr(self.parent, '_on_coupon_saved'):
+                self.parent._on_coupon_saved(coupon_id)
             
             self.destroy()
             
@@ -3059,6 +4194,17 @@ class CouponEditorWindow(ttk.Toplevel):
             messagebox.showerror("保存失败", f"发生错误: {e}", parent=self)
 
 if __name__ == "__main__":
-    database.init_db()
+    # 数据库已是最新版本时只读取一次版本号；需要升级时先显示升级进度
+    if database.get_pending_migrations():
+        migration_window = MigrationProgressWindow()
+        migration_window.mainloop()
+        if migration_window.error is not None:
+            raise SystemExit(1)
+    archived = database.archive_expired_coupons()
+    if archived:
+        print(f"已归档 {archived} 张过期优惠券")
     app = App()
-    app.mainloop()
+    try:
+        app.mainloop()
+    finally:
+        app.analysis_runner.shutdown()
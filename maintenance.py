@@ -0,0 +1,75 @@
+"""空闲时的数据库维护
+
+大批量导入或删除之后，重新收集查询优化器的统计信息（ANALYZE），空闲页超过阈值时增量回收空间
+（PRAGMA incremental_vacuum，每步一个短事务）。主窗口在用户一段时间没有操作时，
+在后台线程中调用 run_maintenance()，每次维护的耗时和回收的空间输出到日志。
+"""
+import time
+
+import database
+
+# 上次收集统计信息以来写入的行数，或商品数与上次收集时相差达到该值后重新收集
+ANALYZE_AFTER_ROWS = 10000
+# 空闲页达到该数量后回收（4KB 页约 16MB）
+VACUUM_FREELIST_PAGES = 4096
+VACUUM_STEP_PAGES = 1024
+# 每次维护回收空间最多占用的时间（秒），剩余的空闲页留到下一次空闲时
+VACUUM_TIME_BUDGET = 2.0
+# 用户无操作多久之后才开始维护（秒）
+IDLE_SECONDS = 120
+
+
+def needs_analyze(status):
+    if status['analyzed_rows'] is None:
+        return status['product_rows'] > 0
+    return (status['rows_written'] >= ANALYZE_AFTER_ROWS
+            or abs(status['product_rows'] - status['analyzed_rows']) >= ANALYZE_AFTER_ROWS)
+
+
+def needs_vacuum(status):
+    return status['auto_vacuum'] == 2 and status['freelist_pages'] >= VACUUM_FREELIST_PAGES
+
+
+def run_maintenance(time_budget=VACUUM_TIME_BUDGET):
+    """执行到期的维护，返回 {'analyze_seconds', 'reclaimed_bytes', 'vacuum_seconds', 'freelist_pages'}
+
+    没有执行的项目耗时为 None；freelist_pages 为维护后剩余的空闲页数。
+    """
+    status = database.get_maintenance_status()
+    report = {'analyze_seconds': None, 'reclaimed_bytes': 0, 'vacuum_seconds': None,
+              'freelist_pages': status['freelist_pages']}
+    if needs_vacuum(status):
+        # 先回收空间，统计信息按回收后的页数收集
+        started = time.perf_counter()
+        pages = database.reclaim_free_pages(VACUUM_STEP_PAGES, time_budget)
+        report['vacuum_seconds'] = time.perf_counter() - started
+        report['reclaimed_bytes'] = pages * status['page_size']
+        report['freelist_pages'] = max(status['freelist_pages'] - pages, 0)
+        print(f"数据库维护：回收空闲页 {pages} 页（{report['reclaimed_bytes'] / 1024 ** 2:.1f} MB），"
+              f"耗时 {report['vacuum_seconds']:.2f} 秒，剩余空闲页 {report['freelist_pages']} 页")
+    if needs_analyze(status):
+        report['analyze_seconds'] = database.analyze_database()
+        print(f"数据库维护：重新收集统计信息（{status['product_rows']} 件商品），"
+              f"耗时 {report['analyze_seconds']:.2f} 秒")
+    return report
+
+
+class MaintenanceScheduler:
+    """记录用户最后一次操作的时间，空闲超过 idle_seconds 且没有维护在执行时才允许开始维护"""
+    def __init__(self, idle_seconds=IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.last_activity = time.monotonic()
+        self.running = False
+
+    def note_activity(self, now=None):
+        self.last_activity = now if now is not None else time.monotonic()
+
+    def should_run(self, now=None):
+        now = now if now is not None else time.monotonic()
+        return not self.running and now - self.last_activity >= self.idle_seconds
+
+    def start(self):
+        self.running = True
+
+    def finish(self):
+        self.running = False
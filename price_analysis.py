@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import queue
+
+import database
+import pricing
+
+# 每个分块扫描的 rowid 数量，分块之间回传进度并检查任务是否已被取消
+ANALYSIS_CHUNK_ROWS = 20000
+
+# 任务结束的消息类型，收到后不再等待该任务
+_FINISHED_KINDS = ('done', 'error', 'cancelled')
+
+
+def _run_tier_analysis(job_id, db_path, result_queue, current_job):
+    """按到手价分块统计净利率档位，每块完成后回传累计结果和进度
+
+    结束时先回传 ('rowids', {档位: [rowid]})（按 店铺、名称 排序，界面按它分页读取明细），再回传 ('done', 档位数量)。
+    """
+    database.DB_PATH = db_path
+    # 每个任务开始时编译一次各店铺的有效优惠券，之后按块批量应用
+    coupon_sets = pricing.load_coupon_sets()
+    start, end = database.get_products_rowid_range()
+    total = max(end - start, 0)
+    counts = {tier: 0 for tier, _, _ in database.MARGIN_TIERS}
+    members = {tier: [] for tier in counts}  # 档位 -> [(店铺, 名称, rowid)]
+
+    for chunk_start in range(start, end, ANALYSIS_CHUNK_ROWS):
+        # 已有新任务开始，放弃当前的过期任务
+        if current_job.value != job_id:
+            result_queue.put(('cancelled', job_id, None))
+            return
+        chunk_end = min(chunk_start + ANALYSIS_CHUNK_ROWS, end)
+        rows = database.get_pricing_rows((chunk_start, chunk_end))
+        for tier, indices in pricing.classify_pricing_rows(rows, coupon_sets).items():
+            counts[tier] += len(indices)
+            members[tier].extend((rows[i]['shop'] or '', rows[i]['name'], rows[i]['rowid']) for i in indices)
+        result_queue.put(('progress', job_id, {
+            'processed': chunk_end - start,
+            'total': total,
+            'counts': dict(counts)
+        }))
+
+    result_queue.put(('rowids', job_id, {tier: [rowid for _, _, rowid in sorted(rows)]
+                                         for tier, rows in members.items()}))
+    result_queue.put(('done', job_id, counts))
+
+
+def _analysis_worker(task_queue, result_queue, current_job):
+    """后台进程主循环：依次执行分析任务，跳过已被取代的任务"""
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        job_id, db_path = task
+        if current_job.value != job_id:
+            continue
+        try:
+            _run_tier_analysis(job_id, db_path, result_queue, current_job)
+        except Exception as e:
+            result_queue.put(('error', job_id, str(e)))
+
+
+class AnalysisRunner:
+    """在独立进程中运行价格分析，避免与界面线程争用GIL"""
+    def __init__(self):
+        self._context = multiprocessing.get_context('spawn')
+        self._task_queue = None
+        self._result_queue = None
+        self._current_job = None
+        self._process = None
+        self.job_id = 0
+        self._pending = False  # 当前任务还没有收到结束消息
+
+    def _ensure_worker(self):
+        """按需启动常驻的分析进程，进程启动成本只付一次"""
+        if self._process is not None and self._process.is_alive():
+            return
+        self._task_queue = self._context.Queue()
+        self._result_queue = self._context.Queue()
+        self._current_job = self._context.Value('i', 0)
+        self._process = self._context.Process(
+            target=_analysis_worker,
+            args=(self._task_queue, self._result_queue, self._current_job),
+            daemon=True
+        )
+        self._process.start()
+
+    def submit(self):
+        """提交新的分析任务，正在运行的旧任务会在下一个分块边界停止"""
+        self._ensure_worker()
+        self.job_id += 1
+        self._current_job.value = self.job_id
+        self._pending = True
+        self._task_queue.put((self.job_id, os.path.abspath(database.DB_PATH)))
+        return self.job_id
+
+    def cancel(self):
+        """取消当前任务"""
+        if self._current_job is not None:
+            self._current_job.value = 0
+
+    def poll(self):
+        """取出当前任务的所有新消息（过期任务的消息被丢弃）
+
+        分析进程在当前任务结束前退出（崩溃或被结束）时返回一条 'error' 消息，调用方不会一直等待。
+        """
+        messages = []
+        if self._result_queue is None:
+            return messages
+        # 先检查进程再读取队列：进程退出前放入队列的消息此时都已可以读到
+        exited = self._process is None or not self._process.is_alive()
+        while True:
+            try:
+                kind, job_id, payload = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job_id == self.job_id:
+                messages.append((kind, payload))
+                if kind in _FINISHED_KINDS:
+                    self._pending = False
+        if self._pending and exited:
+            self._pending = False
+            exitcode = self._process.exitcode if self._process is not None else None
+            messages.append(('error', f"分析进程意外退出（退出码 {exitcode}）"))
+        return messages
+
+    def shutdown(self):
+        """停止后台进程"""
+        if self._process is not None and self._process.is_alive():
+            self.cancel()
+            self._task_queue.put(None)
+            self._process.join(timeout=1)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._process = None
+        self._pending = False
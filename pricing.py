@@ -0,0 +1,470 @@
+import bisect
+import json
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import database
+
+
+def parse_product_ids(product_ids_str):
+    """解析优惠券的指定货品列表，返回 None 表示全店生效（与 is_coupon_applicable 一致）"""
+    if not product_ids_str:
+        return None
+    try:
+        product_ids = json.loads(product_ids_str)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(product_ids, list):
+        return None
+    return product_ids
+
+
+class CouponEnvelope:
+    """一组优惠券的最优到手价函数
+
+    立减券相当于最低消费为0的满减券，所以全部满减/立减券可以合并成按价格排序的
+    阶梯：价格越过某个最低消费后，可用的最大减免金额只增不减。折扣券只保留最低折扣。
+    任意价格的最优价 = min(原价, 原价 - 阶梯减免, 原价 × 最低折扣)，查阶梯只需二分。
+    """
+    def __init__(self, coupon_dicts):
+        amounts_by_min_price = {}
+        self.discount_rate = None
+        for coupon_dict in coupon_dicts:
+            coupon_type = coupon_dict['coupon_type']
+            amount = coupon_dict['amount']
+            if coupon_type == 'discount':
+                self.discount_rate = amount if self.discount_rate is None else min(self.discount_rate, amount)
+            elif coupon_type in ('instant', 'threshold'):
+                min_price = (coupon_dict.get('min_price') or 0) if coupon_type == 'threshold' else 0
+                amounts_by_min_price[min_price] = max(amounts_by_min_price.get(min_price, amount), amount)
+
+        # 阶梯断点：breakpoints[i] 起可用的最大减免为 step_amounts[i + 1]，step_amounts[0] 为无券可用
+        self.breakpoints = sorted(amounts_by_min_price)
+        self.step_amounts = [0]
+        for min_price in self.breakpoints:
+            self.step_amounts.append(max(self.step_amounts[-1], amounts_by_min_price[min_price]))
+        self._breakpoint_array = np.array(self.breakpoints, dtype=float)
+        self._step_amount_array = np.array(self.step_amounts, dtype=float)
+
+    def best_price(self, price):
+        """未四舍五入的最优价"""
+        best = price
+        amount = self.step_amounts[bisect.bisect_right(self.breakpoints, price)]
+        if amount > 0:
+            best = min(best, max(0, price - amount))
+        if self.discount_rate is not None:
+            best = min(best, price * self.discount_rate)
+        return best
+
+    def best_prices(self, prices):
+        """批量版本的 best_price"""
+        amounts = self._step_amount_array[np.searchsorted(self._breakpoint_array, prices, side='right')]
+        best = np.where(amounts > 0, np.minimum(prices, np.maximum(0, prices - amounts)), prices)
+        if self.discount_rate is not None:
+            best = np.minimum(best, prices * self.discount_rate)
+        return best
+
+
+class CompiledCouponSet:
+    """单个店铺的有效优惠券：全店券合并为一个最优价函数，指定货品的券按货品ID各自合并"""
+    def __init__(self, coupons):
+        shop_wide = []
+        coupons_by_product = {}
+        for coupon in coupons:
+            coupon_dict = dict(coupon) if isinstance(coupon, dict) else dict(zip(database.COUPON_COLUMNS, coupon))
+            product_ids = parse_product_ids(coupon_dict.get('product_ids'))
+            if product_ids is None:
+                shop_wide.append(coupon_dict)
+            else:
+                for product_id in product_ids:
+                    coupons_by_product.setdefault(product_id, []).append(coupon_dict)
+
+        self.has_coupons = bool(shop_wide or coupons_by_product)
+        self.envelope = CouponEnvelope(shop_wide)
+        self.product_envelopes = {product_id: CouponEnvelope(product_coupons)
+                                  for product_id, product_coupons in coupons_by_product.items()}
+
+    def final_price(self, price, product_id=None):
+        """计算单个商品的到手价，结果与 database.calculate_final_price 一致"""
+        if not price or price <= 0 or not self.has_coupons:
+            return price
+        best = self.envelope.best_price(price)
+        product_envelope = self.product_envelopes.get(product_id) if product_id else None
+        if product_envelope is not None:
+            best = min(best, product_envelope.best_price(price))
+        return round(best, 2)
+
+    def best_prices(self, prices, product_ids):
+        """批量计算未四舍五入的最优价：全店券按数组整体计算，只对有指定货品券的行做修正"""
+        prices = np.asarray(prices, dtype=float)
+        if not self.has_coupons or len(prices) == 0:
+            return prices.copy()
+
+        best = self.envelope.best_prices(prices)
+        if self.product_envelopes:
+            for i, product_id in enumerate(product_ids):
+                product_envelope = self.product_envelopes.get(product_id) if product_id else None
+                if product_envelope is not None and prices[i] > 0:
+                    best[i] = min(best[i], product_envelope.best_price(prices[i]))
+        return best
+
+    def final_prices(self, prices, product_ids):
+        """批量计算到手价"""
+        prices = np.asarray(prices, dtype=float)
+        return round_final_prices(prices, self.best_prices(prices, product_ids))
+
+
+def round_final_prices(prices, best):
+    """把最优价四舍五入为到手价，原价无效的行保持原价"""
+    # 与单行计算一样使用内置 round，保证批量结果与SKU列表逐位一致
+    rounded = np.fromiter((round(value, 2) for value in best.tolist()), dtype=float, count=len(best))
+    return np.where(prices > 0, rounded, prices)
+
+
+_EMPTY_COUPON_SET = CompiledCouponSet([])
+
+
+def load_coupon_sets(as_of=None):
+    """一次查询所有店铺的有效优惠券，按店铺编译"""
+    coupons_by_shop = {}
+    for coupon in database.get_active_coupons(as_of):
+        coupon_dict = dict(zip(database.COUPON_COLUMNS, coupon))
+        coupons_by_shop.setdefault(coupon_dict['shop'], []).append(coupon_dict)
+    return {shop: CompiledCouponSet(coupons) for shop, coupons in coupons_by_shop.items()}
+
+
+class CouponPricer:
+    """按店铺缓存已编译的优惠券集合，某个店铺的优惠券被修改后只重新编译该店铺"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coupon_sets = {}  # 店铺 -> (编译时的店铺修改计数, 编译结果)
+
+    def coupon_set(self, shop):
+        if not shop:
+            return _EMPTY_COUPON_SET
+        revision = database.get_coupon_revision(shop)
+        with self._lock:
+            cached = self._coupon_sets.get(shop)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        coupon_set = CompiledCouponSet(database.get_active_coupons_by_shop(shop))
+        with self._lock:
+            self._coupon_sets[shop] = (revision, coupon_set)
+        return coupon_set
+
+    def final_price(self, price, shop, product_id=None):
+        """计算到手价，可直接注册为SQL函数 final_price(price, shop, product_id)"""
+        return self.coupon_set(shop).final_price(price, product_id)
+
+    def invalidate(self, shop=None):
+        """丢弃缓存的编译结果（不指定店铺时全部丢弃）"""
+        with self._lock:
+            if shop is None:
+                self._coupon_sets.clear()
+            else:
+                self._coupon_sets.pop(shop, None)
+
+
+class CouponBoundaryScheduler:
+    """跟踪下一个优惠券生效或失效的日期
+
+    优惠券是否有效按日期判断，缓存的到手价只会在某张优惠券开始或结束的那天零点变化。
+    调用方在 seconds_until_next() 之后调用 advance()，只有在这期间跨过边界的店铺会被重新编译。
+    """
+    def __init__(self, pricer):
+        self.pricer = pricer
+        self.checked_date = date.today().isoformat()
+        self.next_boundary = None
+        self.refresh()
+
+    def refresh(self):
+        """优惠券被修改后重新查询下一个边界"""
+        self.next_boundary = database.get_next_coupon_boundary(self.checked_date)
+
+    def seconds_until_next(self, now=None):
+        """距离下一个边界的秒数，没有待生效或失效的优惠券时返回 None"""
+        if self.next_boundary is None:
+            return None
+        try:
+            boundary = datetime.fromisoformat(self.next_boundary)
+        except ValueError:
+            return None
+        return max((boundary - (now or datetime.now())).total_seconds(), 0)
+
+    def advance(self, today=None):
+        """处理从上次检查到今天之间跨过的所有边界，返回到手价发生变化的店铺"""
+        today = today or date.today().isoformat()
+        if self.next_boundary is None or today < self.next_boundary:
+            return set()
+        shops = database.get_shops_with_coupon_boundaries(self.checked_date, today)
+        for shop in shops:
+            self.pricer.invalidate(shop)
+        self.checked_date = today
+        self.refresh()
+        return shops
+
+
+def calculate_net_margin_rates(final_prices, purchase_prices):
+    """批量计算净利率（%），计算顺序与 database.calculate_profit 一致"""
+    final_prices = np.asarray(final_prices, dtype=float)
+    purchase_prices = np.maximum(np.asarray(purchase_prices, dtype=float), 0)
+    shipping_fees = np.where(final_prices >= database.SHIPPING_FEE_THRESHOLD,
+                             database.SHIPPING_FEE_HIGH, database.SHIPPING_FEE_LOW)
+    net_profit = final_prices - purchase_prices - shipping_fees - final_prices * database.MISC_FEE_RATE
+    return net_profit / final_prices * 100
+
+
+def _margin_tier_masks(net_margin_rates):
+    """各净利率档位的布尔掩码 {档位: mask}"""
+    masks = {}
+    for tier, lower, upper in database.MARGIN_TIERS:
+        mask = np.ones(len(net_margin_rates), dtype=bool)
+        if lower is not None:
+            mask &= net_margin_rates >= lower
+        if upper is not None:
+            mask &= net_margin_rates < upper
+        masks[tier] = mask
+    return masks
+
+
+def count_margin_tiers(net_margin_rates):
+    """统计各净利率档位的数量"""
+    return {tier: int(mask.sum()) for tier, mask in _margin_tier_masks(net_margin_rates).items()}
+
+
+def analyze_pricing_rows(rows, coupon_sets):
+    """对一批 (shop, product_id, price, purchase_price) 按店铺批量计算到手价并统计档位"""
+    return {tier: len(indices) for tier, indices in classify_pricing_rows(rows, coupon_sets).items()}
+
+
+def classify_pricing_rows(rows, coupon_sets):
+    """同 analyze_pricing_rows，返回各档位的行在 rows 中的下标 {档位: 下标数组}"""
+    if not rows:
+        return {tier: np.array([], dtype=int) for tier, _, _ in database.MARGIN_TIERS}
+
+    shops = np.array([row[0] or '' for row in rows], dtype=object)
+    product_ids = np.array([row[1] for row in rows], dtype=object)
+    prices = np.array([_to_float(row[2]) for row in rows])
+    purchase_prices = np.array([_to_float(row[3]) for row in rows])
+
+    final_prices = prices.copy()
+    for shop in np.unique(shops):
+        coupon_set = coupon_sets.get(shop)
+        if coupon_set is None:
+            continue
+        mask = shops == shop
+        final_prices[mask] = coupon_set.final_prices(prices[mask], product_ids[mask])
+
+    valid = (prices > 0) & (final_prices > 0)
+    rates = calculate_net_margin_rates(final_prices[valid], purchase_prices[valid])
+    indices = np.flatnonzero(valid)
+    return {tier: indices[mask] for tier, mask in _margin_tier_masks(rates).items()}
+
+
+def coupon_periods(coupons, start_date, end_date):
+    """按优惠券有效期的起止边界扫描，把 [start_date, end_date] 切分为生效优惠券不变的时段
+
+    返回 [(时段开始, 时段结束, 生效的优惠券列表)]，日期为 date 且两端都包含。
+    """
+    events = {}  # 日期 -> [(优惠券序号, 是否开始)]
+    for index, coupon_dict in enumerate(coupons):
+        try:
+            begin = max(date.fromisoformat(coupon_dict['start_date']), start_date)
+            finish = min(date.fromisoformat(coupon_dict['end_date']), end_date)
+        except (TypeError, ValueError):
+            print(f"优惠券日期格式无效，已跳过: {coupon_dict.get('id')}")
+            continue
+        if begin > finish:
+            continue
+        events.setdefault(begin, []).append((index, True))
+        events.setdefault(finish + timedelta(days=1), []).append((index, False))
+
+    boundaries = sorted(day for day in set(events) | {start_date} if day <= end_date)
+    active = {}
+    periods = []
+    for i, boundary in enumerate(boundaries):
+        for index, starts in events.get(boundary, ()):
+            if starts:
+                active[index] = coupons[index]
+            else:
+                active.pop(index, None)
+        period_end = boundaries[i + 1] - timedelta(days=1) if i + 1 < len(boundaries) else end_date
+        periods.append((boundary, period_end, list(active.values())))
+    return periods
+
+
+def _timeline_window(start_date, days):
+    start = date.fromisoformat(start_date) if start_date else date.today()
+    return start, start + timedelta(days=max(days, 1) - 1)
+
+
+def _window_coupons(shop, start, end):
+    return [dict(zip(database.COUPON_COLUMNS, coupon))
+            for coupon in database.get_coupons_in_window(start.isoformat(), end.isoformat(), shop)]
+
+
+def sku_price_timeline(spec_id, days=30, start_date=None):
+    """计算单个SKU未来 days 天内每个价格时段的到手价和净利率，相邻且价格相同的时段合并"""
+    product = database.get_product_by_spec_id(spec_id)
+    if product is None:
+        return []
+    product = dict(zip(database.DB_COLUMNS, product))
+    price = _to_float(product['price'])
+    start, end = _timeline_window(start_date, days)
+
+    timeline = []
+    for period_start, period_end, active in coupon_periods(_window_coupons(product['shop'], start, end), start, end):
+        final_price = CompiledCouponSet(active).final_price(price, product['product_id'])
+        if timeline and timeline[-1]['final_price'] == final_price:
+            timeline[-1]['end_date'] = period_end.isoformat()
+            continue
+        net_margin_rate = None
+        if price > 0 and final_price > 0:
+            net_margin_rate = database.calculate_profit(final_price, product['purchase_price'])['net_margin_rate']
+        timeline.append({
+            'start_date': period_start.isoformat(),
+            'end_date': period_end.isoformat(),
+            'final_price': final_price,
+            'net_margin_rate': net_margin_rate
+        })
+    return timeline
+
+
+def shop_price_timeline(shop, days=30, start_date=None):
+    """计算店铺所有SKU未来 days 天内每个优惠券时段的到手价、净利率和档位统计
+
+    每个时段只编译一次优惠券并批量计算整店价格，时段数量取决于优惠券起止日期而不是天数。
+    """
+    start, end = _timeline_window(start_date, days)
+    rows = database.get_shop_pricing_rows(shop)
+    product_ids = [row[1] for row in rows]
+    prices = np.array([_to_float(row[3]) for row in rows])
+    purchase_prices = np.array([_to_float(row[4]) for row in rows])
+
+    periods = []
+    for period_start, period_end, active in coupon_periods(_window_coupons(shop, start, end), start, end):
+        final_prices = CompiledCouponSet(active).final_prices(prices, product_ids)
+        valid = (prices > 0) & (final_prices > 0)
+        net_margin_rates = np.full(len(prices), np.nan)
+        net_margin_rates[valid] = calculate_net_margin_rates(final_prices[valid], purchase_prices[valid])
+        periods.append({
+            'start_date': period_start.isoformat(),
+            'end_date': period_end.isoformat(),
+            'coupon_ids': [coupon_dict['id'] for coupon_dict in active],
+            'final_prices': final_prices,
+            'net_margin_rates': net_margin_rates,
+            'tier_counts': count_margin_tiers(net_margin_rates[valid])
+        })
+    return {'spec_ids': [row[0] for row in rows], 'periods': periods}
+
+
+class CouponImpactSimulator:
+    """优惠券保存前的影响预览
+
+    打开时缓存店铺内每个SKU的现有到手价，以及去掉正在编辑的优惠券后的最优价。
+    草稿优惠券只会影响全店或所选货品的SKU，每次预览只重新计算这些行，
+    其余行的差异和档位统计都在初始化时算好。
+    """
+    def __init__(self, shop, exclude_coupon_id=None):
+        self.shop = shop
+        rows = database.get_shop_pricing_rows(shop)
+        self.spec_ids = [row[0] for row in rows]
+        self.names = [row[2] for row in rows]
+        product_ids = [row[1] for row in rows]
+        self.prices = np.array([_to_float(row[3]) for row in rows])
+        self.purchase_prices = np.array([_to_float(row[4]) for row in rows])
+        self.floor_prices = np.array([_to_float(row[5]) for row in rows])
+
+        self.rows_by_product = {}
+        for i, product_id in enumerate(product_ids):
+            self.rows_by_product.setdefault(product_id, []).append(i)
+        self.rows_by_product = {product_id: np.array(indices) for product_id, indices in self.rows_by_product.items()}
+        self.all_rows = np.arange(len(rows))
+
+        coupons = [dict(zip(database.COUPON_COLUMNS, coupon)) for coupon in database.get_active_coupons_by_shop(shop)]
+        others = [coupon for coupon in coupons if coupon['id'] != exclude_coupon_id]
+        self.current_final = CompiledCouponSet(coupons).final_prices(self.prices, product_ids)
+        # 不含正在编辑的优惠券时的最优价，草稿优惠券在此基础上取最小值
+        self.others_best = CompiledCouponSet(others).best_prices(self.prices, product_ids)
+        self.others_final = round_final_prices(self.prices, self.others_best)
+
+        self.current_tiers = self._tier_indices(self.current_final, self.all_rows)
+        self.others_tiers = self._tier_indices(self.others_final, self.all_rows)
+        self.others_tier_counts = self._count_tiers(self.others_tiers)
+        self.tier_counts = self._count_tiers(self.current_tiers)
+        self.others_changed = int((self.others_final != self.current_final).sum())
+        self.others_below_floor = np.flatnonzero(self._below_floor(self.others_final, self.all_rows))
+
+    def _tier_indices(self, final_prices, rows):
+        rates = np.zeros(len(rows))
+        valid = (self.prices[rows] > 0) & (final_prices > 0)
+        rates[valid] = calculate_net_margin_rates(final_prices[valid], self.purchase_prices[rows][valid])
+        tiers = np.full(len(rows), -1)
+        for index, (_, lower, upper) in enumerate(database.MARGIN_TIERS):
+            mask = valid.copy()
+            if lower is not None:
+                mask &= rates >= lower
+            if upper is not None:
+                mask &= rates < upper
+            tiers[mask] = index
+        return tiers
+
+    @staticmethod
+    def _count_tiers(tiers):
+        counts = np.bincount(tiers[tiers >= 0], minlength=len(database.MARGIN_TIERS))
+        return counts.astype(int)
+
+    def _below_floor(self, final_prices, rows):
+        floors = self.floor_prices[rows]
+        return (floors > 0) & (self.prices[rows] > 0) & (final_prices < floors)
+
+    def affected_rows(self, product_ids=None):
+        """草稿优惠券覆盖的行：全店券为整个店铺，指定货品券为这些货品下的SKU"""
+        if product_ids is None:
+            return self.all_rows
+        indices = [self.rows_by_product[product_id] for product_id in set(product_ids)
+                   if product_id in self.rows_by_product]
+        return np.sort(np.concatenate(indices)) if indices else np.array([], dtype=int)
+
+    def simulate(self, coupon_dict=None, product_ids=None, limit=20):
+        """预览保存草稿优惠券后的变化，coupon_dict 为 None 表示该优惠券当前不生效"""
+        rows = self.affected_rows(product_ids) if coupon_dict else np.array([], dtype=int)
+        prices = self.prices[rows]
+        draft_best = CouponEnvelope([coupon_dict]).best_prices(prices) if coupon_dict else prices
+        after = round_final_prices(prices, np.minimum(self.others_best[rows], draft_best))
+
+        # 未覆盖的行取不含该券的价格（已预先统计），覆盖的行用新价格替换
+        repriced = (self.others_changed
+                    - int((self.others_final[rows] != self.current_final[rows]).sum())
+                    + int((after != self.current_final[rows]).sum()))
+        after_counts = (self.others_tier_counts
+                        - self._count_tiers(self.others_tiers[rows])
+                        + self._count_tiers(self._tier_indices(after, rows)))
+
+        below = np.setdiff1d(self.others_below_floor, rows, assume_unique=True)
+        below = np.union1d(below, rows[self._below_floor(after, rows)])
+        final_by_row = dict(zip(rows.tolist(), after.tolist()))
+        below_rows = [{
+            'spec_id': self.spec_ids[i],
+            'name': self.names[i],
+            'final_price': final_by_row.get(i, float(self.others_final[i])),
+            'min_price': float(self.floor_prices[i])
+        } for i in below[:limit].tolist()]
+
+        return {
+            'affected': len(rows),
+            'repriced': repriced,
+            'tiers_before': {tier: int(count) for (tier, _, _), count in zip(database.MARGIN_TIERS, self.tier_counts)},
+            'tiers_after': {tier: int(count) for (tier, _, _), count in zip(database.MARGIN_TIERS, after_counts)},
+            'below_min_price_count': len(below),
+            'below_min_price': below_rows
+        }
+
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,40 @@
+class ProductSearchIndex:
+    """货品选择器的内存搜索索引
+
+    products 为 [(货品ID, 名称)]，搜索匹配货品ID或名称中的子串（不区分大小写），
+    货品ID以查询开头的排在前面。查询在上一次的基础上追加字符时，只在上一次的结果中继续筛选。
+    """
+    def __init__(self, products):
+        self.products = list(products)
+        self._ids = [str(product_id).lower() for product_id, _ in self.products]
+        self._names = [str(name or '').lower() for _, name in self.products]
+        self._all = list(range(len(self.products)))
+        self._last_query = ''
+        self._last_matches = self._all  # 上一次的匹配，按 products 顺序
+
+    def __len__(self):
+        return len(self.products)
+
+    def search(self, query):
+        """返回匹配货品在 products 中的索引列表"""
+        query = (query or '').strip().lower()
+        if not query:
+            self._last_query, self._last_matches = '', self._all
+            return self._all
+        # 查询是上一次的延伸时，匹配结果一定是上一次结果的子集
+        if self._last_query and query.startswith(self._last_query):
+            candidates = self._last_matches
+        else:
+            candidates = self._all
+        ids, names = self._ids, self._names
+        matches, prefix, other = [], [], []
+        for i in candidates:
+            if ids[i].startswith(query):
+                prefix.append(i)
+            elif query in ids[i] or query in names[i]:
+                other.append(i)
+            else:
+                continue
+            matches.append(i)
+        self._last_query, self._last_matches = query, matches
+        return prefix + other
@@ -0,0 +1,104 @@
+"""比较 database.STORAGE_PROFILES 中各存储配置在导入、搜索和分析上的耗时
+
+用法: python storage_benchmark.py [数据库路径] [配置名 ...]
+
+每个配置使用数据库的一份副本（通过 SQLite 备份接口复制，WAL 模式下也是一致的快照），
+原数据库不会被修改。副本放在系统临时目录中，需要有一份数据库大小的剩余空间。
+"""
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import database
+from price_analysis import ANALYSIS_CHUNK_ROWS
+
+IMPORT_ROWS = 20000
+SEARCH_TERMS = ['1', '商品', 'SKU']
+REPEAT = 3
+
+
+def _copy_database(source, target):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _import_workload(round_index):
+    """导入：按 DB_COLUMNS 写入一批新商品（每轮使用新的规格ID）"""
+    shops = database.get_all_shops() or ['店铺']
+    database.add_product_batch([
+        (f'BENCH-SKU{i}', f'BENCH-P{i % 500}', f'BENCH-{round_index}-{i}', f'测试商品{i}', '', 99.0, 1,
+         shops[i % len(shops)], '', '', '', 0, 50.0)
+        for i in range(IMPORT_ROWS)
+    ])
+
+
+def _search_workload(round_index):
+    """搜索：关键字搜索第一页和总数，再翻到商品列表的中间页"""
+    for term in SEARCH_TERMS:
+        database.search_products(term, limit=50)
+        database.search_products_count(term)
+    database.get_all_products(limit=50, offset=database.get_all_products_count() // 2)
+
+
+def _analysis_workload(round_index):
+    """分析：与价格分析进程相同，按 rowid 分块读取全部计价字段，再做一次档位聚合"""
+    start, end = database.get_products_rowid_range()
+    for chunk_start in range(start, end, ANALYSIS_CHUNK_ROWS):
+        database.get_pricing_rows((chunk_start, min(chunk_start + ANALYSIS_CHUNK_ROWS, end)))
+    database.get_margin_tier_counts()
+
+
+WORKLOADS = [('导入', _import_workload), ('搜索', _search_workload), ('分析', _analysis_workload)]
+
+
+def run_benchmark(db_path, profiles=None, repeat=REPEAT):
+    """返回 {配置名: {负载名: 中位耗时(秒)}}"""
+    saved = database.DB_PATH, database.STORAGE_PROFILE
+    results = {}
+    tmp_dir = tempfile.mkdtemp(prefix='storage_benchmark_')
+    try:
+        for profile in profiles or list(database.STORAGE_PROFILES):
+            path = os.path.join(tmp_dir, f'{profile}.db')
+            _copy_database(db_path, path)
+            database.DB_PATH, database.STORAGE_PROFILE = path, profile
+            database.init_db()
+            results[profile] = {}
+            for name, workload in WORKLOADS:
+                timings = []
+                for round_index in range(repeat):
+                    started = time.perf_counter()
+                    workload(round_index)
+                    timings.append(time.perf_counter() - started)
+                results[profile][name] = statistics.median(timings)
+            database.close_read_connections()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        database.DB_PATH, database.STORAGE_PROFILE = saved
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def main(argv):
+    db_path = argv[1] if len(argv) > 1 else database.DB_PATH
+    profiles = argv[2:] or None
+    size_mb = os.path.getsize(db_path) / 1024 ** 2
+    print(f"数据库: {db_path} ({size_mb:.0f} MB)，每项取 {REPEAT} 次的中位数")
+    results = run_benchmark(db_path, profiles)
+    print('配置'.ljust(10) + ''.join(name.rjust(10) for name, _ in WORKLOADS))
+    for profile, timings in results.items():
+        print(profile.ljust(12) + ''.join(f"{timings[name] * 1000:>10.0f}ms" for name, _ in WORKLOADS))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
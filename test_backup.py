@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试数据库快照的在线备份、保留数量和恢复
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import backup
+import database
+
+
+@pytest.fixture
+def temp_db(temp_db, monkeypatch):
+    """临时数据库中预置 2000 个商品，备份每步只复制几页，分成多步完成"""
+    monkeypatch.setattr(backup, 'BACKUP_STEP_PAGES', 5)
+    database.add_product_batch([
+        (f'SKU{i}', f'P{i}', f'S{i}', f'商品{i}' * 20, '', 10, 1, '店铺A', '', '', '', 0, 0) for i in range(2000)
+    ])
+    return database
+
+
+def _product_count(path):
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_snapshot_is_consistent_while_writes_continue(temp_db, monkeypatch):
+    """分步备份期间其他连接照常写入，备份不会从头开始，快照是开始时的数据"""
+    writer = database.get_db_connection()
+    copied = []
+    def on_progress(done, total):
+        copied.append(done)
+        writer.execute("INSERT INTO products (spec_id, name, shop_id, category_id, warehouse_id) "
+                       "VALUES (?, '新商品', 1, 1, 1)", (f'NEW{len(copied)}',))
+        writer.commit()
+
+    path = backup.create_snapshot(progress=on_progress)
+    writer.close()
+
+    assert len(copied) > 10 and copied == sorted(copied)
+    assert _product_count(path) == 2000
+    assert database.get_all_products_count() == 2000 + len(copied)
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+    assert [snapshot['path'] for snapshot in backup.list_snapshots()] == [path]
+
+
+def test_rotation_keeps_newest_snapshots(temp_db, monkeypatch):
+    """只保留最新的 BACKUP_KEEP 个快照，中断留下的未完成文件被清理"""
+    monkeypatch.setattr(backup, 'BACKUP_KEEP', 2)
+    paths = [backup.create_snapshot() for _ in range(3)]
+    open(paths[-1] + '.partial', 'w').close()
+    backup.rotate_snapshots()
+
+    assert [snapshot['path'] for snapshot in backup.list_snapshots()] == paths[:0:-1]
+    assert sorted(os.listdir(backup.backup_dir())) == sorted(os.path.basename(p) for p in paths[1:])
+
+
+def test_restore_replaces_data_in_one_transaction(temp_db):
+    """恢复期间其他连接读到的仍是原来的数据，完成后与快照一致；无效文件不修改数据库"""
+    path = backup.create_snapshot()
+    database.add_product_batch([('SKU9', 'P9', 'X1', '快照之后的商品', '', 10, 1, '店铺B', '', '', '', 0, 0)])
+    for spec_id in ('S1', 'S2', 'S3'):
+        database.delete_product_by_spec_id(spec_id)
+
+    seen = []
+    backup.restore_snapshot(path, progress=lambda done, total: seen.append(database.get_all_products_count()))
+
+    # 最后一次进度在提交之后报告
+    assert len(seen) > 10 and set(seen[:-1]) == {1998} and seen[-1] == 2000
+    assert database.get_all_products_count() == 2000
+    assert database.get_product_by_spec_id('X1') is None
+    assert database.get_all_shops() == ['店铺A']
+
+    other = os.path.join(os.path.dirname(path), 'other.db')
+    sqlite3.connect(other).close()
+    with pytest.raises(ValueError):
+        backup.restore_snapshot(other)
+    assert database.get_all_products_count() == 2000
+
+
+
+def test_snapshot_lets_writers_commit_with_rollback_journal(temp_db, monkeypatch):
+    """回滚日志模式下备份每步之间让出锁，其他连接可以提交；有写入时重新复制，快照仍然一致"""
+    database.close_read_connections()
+    monkeypatch.setattr(database, 'STORAGE_PROFILE', 'default')
+    monkeypatch.setattr(backup, 'BACKUP_STEP_SLEEP', 0.01)
+    writer = database.get_db_connection()
+    assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    writer.execute('PRAGMA busy_timeout = 200')
+    written = []
+    def on_progress(done, total):
+        if len(written) < 3:
+            writer.execute("INSERT INTO products (spec_id, name, shop_id, category_id, warehouse_id) "
+                           "VALUES (?, '新商品', 1, 1, 1)", (f'NEW{len(written)}',))
+            writer.commit()
+            written.append(done)
+
+    path = backup.create_snapshot(progress=on_progress)
+    writer.close()
+
+    assert len(written) == 3
+    assert _product_count(path) == database.get_all_products_count() == 2003
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+
+
+def test_snapshot_gives_up_when_writes_never_stop(temp_db, monkeypatch):
+    """回滚日志模式下每一步之间都有写入时，重新复制 BACKUP_MAX_RESTARTS 次后放弃，不留下未完成的文件"""
+    database.close_read_connections()
+    monkeypatch.setattr(database, 'STORAGE_PROFILE', 'default')
+    monkeypatch.setattr(backup, 'BACKUP_STEP_SLEEP', 0)
+    monkeypatch.setattr(backup, 'BACKUP_MAX_RESTARTS', 2)
+    writer = database.get_db_connection()
+    written = []
+    def on_progress(done, total):
+        writer.execute("INSERT INTO products (spec_id, name, shop_id, category_id, warehouse_id) "
+                       "VALUES (?, '新商品', 1, 1, 1)", (f'NEW{len(written)}',))
+        writer.commit()
+        written.append(done)
+
+    with pytest.raises(RuntimeError):
+        backup.create_snapshot(progress=on_progress)
+    writer.close()
+    assert os.listdir(backup.backup_dir()) == []
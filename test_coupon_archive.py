@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试过期优惠券归档和有效优惠券索引
+"""
+
+from datetime import datetime, timedelta
+
+import database
+
+
+def _add_coupon(shop, start, end, description=''):
+    return database.add_coupon({'shop': shop, 'coupon_type': 'instant', 'amount': 5, 'min_price': 0,
+                                'start_date': start, 'end_date': end, 'description': description,
+                                'is_active': 1, 'product_ids': ''})
+
+
+def test_archive_moves_only_long_expired_coupons(temp_db):
+    """只归档结束超过保留天数的优惠券，归档后仍可搜索"""
+    today = datetime.now()
+    def day(offset):
+        return (today + timedelta(days=offset)).strftime('%Y-%m-%d')
+    old_id = _add_coupon('店铺A', day(-120), day(-90), '春节活动')
+    recent_id = _add_coupon('店铺A', day(-30), day(-10))
+    current_id = _add_coupon('店铺B', day(-30), day(30))
+
+    assert database.archive_expired_coupons(after_days=30) == 1
+    assert [c['id'] for c in database.get_all_coupons()] == [recent_id, current_id]
+    assert [c['id'] for c in database.search_coupons({'scope': 'current'})] == [current_id]
+    assert [c['id'] for c in database.search_coupons({'scope': 'expired'})] == [recent_id]
+    assert [c['id'] for c in database.search_coupons({'scope': 'archived', 'keyword': '春节'})] == [old_id]
+    assert database.search_coupons({'scope': 'archived', 'keyword': '店铺B'}) == []
+
+    stats = database.get_coupon_stats()
+    assert stats['total'] == 3
+    # 再次归档不会重复
+    assert database.archive_expired_coupons(after_days=30) == 0
+
+
+def test_active_coupon_lookup_uses_partial_index(temp_db):
+    """按店铺查询有效优惠券应使用只包含已启用优惠券的部分索引"""
+    conn = database.get_db_connection()
+    plan = conn.execute('''EXPLAIN QUERY PLAN SELECT * FROM coupons
+                           WHERE shop = ? AND is_active = 1 AND start_date <= ? AND end_date >= ?''',
+                        ('店铺A', '2024-06-01', '2024-06-01')).fetchall()
+    conn.close()
+    assert 'idx_coupon_active_shop_window' in ' '.join(row[3] for row in plan)
+
+
+def test_coupon_search_filters_and_pages(temp_db):
+    """优惠券列表按条件筛选，分页之间不重复不遗漏"""
+    ids = [_add_coupon(f'店铺{i % 3}', f'2024-0{1 + i % 6}-01', f'2024-0{1 + i % 6}-20') for i in range(30)]
+    pages = [database.search_coupons({}, limit=7, offset=offset) for offset in range(0, 30, 7)]
+    seen = [coupon['id'] for page in pages for coupon in page]
+    assert sorted(seen) == ids
+    assert database.count_coupons({}) == 30
+
+    filters = {'shop': '店铺1', 'date_from': '2024-02-10', 'date_to': '2024-02-15'}
+    expected = [c['id'] for c in database.get_all_coupons()
+                if c['shop'] == '店铺1' and c['end_date'] >= '2024-02-10' and c['start_date'] <= '2024-02-15']
+    assert sorted(c['id'] for c in database.search_coupons(filters, limit=100)) == sorted(expected)
+    assert database.count_coupons(filters) == len(expected) > 0
+    assert database.count_coupons({'coupon_type': 'discount'}) == 0
+
+
+def test_coupon_list_position_matches_search_order(temp_db):
+    """编辑后按筛选条件定位：位置与 search_coupons 的排序一致，不符合条件时返回 None"""
+    ids = [_add_coupon(f'店铺{i % 3}', f'2024-0{1 + i % 4}-01', f'2024-0{1 + i % 4}-20') for i in range(12)]
+    filters = {'shop': '店铺1'}
+    listed = [c['id'] for c in database.search_coupons(filters, limit=100)]
+    for coupon_id in ids:
+        found = database.get_coupon_list_position(coupon_id, filters)
+        if coupon_id in listed:
+            assert found[0] == listed.index(coupon_id) and found[1]['id'] == coupon_id
+        else:
+            assert found is None
+    assert [database.get_coupon_list_position(i)[0] for i in ids] == \
+        [[c['id'] for c in database.search_coupons({}, limit=100)].index(i) for i in ids]
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+测试优惠券有效期冲突检查
+"""
+
+import json
+import random
+from datetime import date, timedelta
+
+import database
+from coupon_conflicts import IntervalTree, CouponConflictIndex, find_coupon_conflicts
+
+
+def _coupon(coupon_id, start, end, coupon_type='instant', shop='店铺A', product_ids='', is_active=1):
+    return {'id': coupon_id, 'shop': shop, 'coupon_type': coupon_type, 'amount': 10, 'min_price': 0,
+            'start_date': start, 'end_date': end, 'description': '', 'is_active': is_active,
+            'product_ids': product_ids}
+
+
+def test_interval_tree_matches_linear_scan():
+    """区间树查询结果应与逐个比较一致"""
+    rng = random.Random(1)
+    base = date(2024, 1, 1)
+    intervals = []
+    for i in range(2000):
+        start = base + timedelta(days=rng.randint(0, 700))
+        end = start + timedelta(days=rng.randint(0, 60))
+        intervals.append((start.isoformat(), end.isoformat(), i))
+    tree = IntervalTree(intervals)
+    for _ in range(200):
+        start = base + timedelta(days=rng.randint(0, 760))
+        end = (start + timedelta(days=rng.randint(0, 30))).isoformat()
+        start = start.isoformat()
+        expected = {i for s, e, i in intervals if s <= end and e >= start}
+        assert set(tree.overlapping(start, end)) == expected
+
+
+def test_conflicts_require_same_type_and_shared_products():
+    """同店铺、同类型、有效期重叠且适用货品有交集才算冲突"""
+    coupons = [
+        _coupon(1, '2024-01-01', '2024-01-31'),
+        _coupon(2, '2024-01-31', '2024-02-10'),                                      # 与1在1月31日重叠
+        _coupon(3, '2024-01-10', '2024-01-20', coupon_type='discount'),             # 类型不同
+        _coupon(4, '2024-01-10', '2024-01-20', shop='店铺B'),                        # 店铺不同
+        _coupon(5, '2024-02-01', '2024-02-05', product_ids=json.dumps(['P1'])),     # 与全店券2重叠
+        _coupon(6, '2024-02-03', '2024-02-08', product_ids=json.dumps(['P2'])),     # 与5货品不同
+        _coupon(7, '2024-01-05', '2024-01-06', is_active=0),                        # 已停用
+    ]
+    index = CouponConflictIndex(coupons)
+    pairs = {(a['id'], b['id']): products for a, b, products in index.report()}
+    assert pairs == {(1, 2): None, (2, 5): {'P1'}, (2, 6): {'P2'}}
+
+    draft = _coupon(None, '2024-01-15', '2024-01-16', product_ids=json.dumps(['P9']))
+    assert [(c['id'], products) for c, products in index.conflicts_for(draft)] == [(1, {'P9'})]
+
+
+def test_save_check_ignores_edited_coupon(temp_db):
+    """编辑已有优惠券时不应与自己冲突"""
+    coupon = _coupon(None, '2024-03-01', '2024-03-31')
+    coupon['id'] = database.add_coupon(coupon)
+    assert find_coupon_conflicts(coupon) == []
+    database.add_coupon(_coupon(None, '2024-03-20', '2024-04-10'))
+    assert len(find_coupon_conflicts(coupon)) == 1
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试优惠券批量导入
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+import database
+from coupon_import import import_coupons, validate_coupon_frame
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    """临时数据库中预置两个店铺的 10 个商品"""
+    database.add_product_batch([
+        (f'SKU{i}', f'P{i}', f'S{i}', f'商品{i}', '', 100, 1, '店铺A' if i < 5 else '店铺B',
+         '', '', '', 0, 50)
+        for i in range(10)
+    ])
+    return database
+
+
+def _sheet(rows):
+    return pd.DataFrame(rows, columns=['店铺', '类型', '面额/折扣', '最低消费', '开始日期',
+                                       '结束日期', '描述', '状态', '适用货品'])
+
+
+def test_import_writes_all_rows_in_one_batch(temp_db, tmp_path):
+    """校验通过后全部写入，折扣按百分比换算，货品ID解析为 JSON 列表"""
+    path = tmp_path / 'coupons.xlsx'
+    _sheet([
+        ['店铺A', '立减券', 5, None, '2024-06-01', '2024-06-30', '大促', None, None],
+        ['店铺A', '满减券', 20, 199, pd.Timestamp('2024-06-01'), '2024-06-18', '', '停用', 'P1, P2，P1'],
+        ['店铺B', 'discount', 85, None, '2024-06-10', '2024-06-20', '', '', 'P7'],
+    ]).to_excel(path, index=False)
+    revision_a = database.get_coupon_revision('店铺A')
+
+    result = import_coupons(str(path))
+
+    assert result['errors'] == [] and result['imported'] == 3
+    coupons = sorted((dict(c) for c in database.get_all_coupons()), key=lambda c: c['id'])
+    assert [c['coupon_type'] for c in coupons] == ['instant', 'threshold', 'discount']
+    assert coupons[1]['min_price'] == 199 and coupons[1]['is_active'] == 0
+    assert json.loads(coupons[1]['product_ids']) == ['P1', 'P2']
+    assert coupons[1]['start_date'] == '2024-06-01'
+    assert coupons[2]['amount'] == pytest.approx(0.85)
+    assert coupons[0]['product_ids'] == ''
+    # 整批导入每个店铺的缓存只失效一次
+    assert database.get_coupon_revision('店铺A') == revision_a + 1
+
+
+def test_invalid_rows_reject_whole_sheet(temp_db):
+    """任意一行有错误时报告行号且不导入任何优惠券"""
+    coupons, errors = validate_coupon_frame(_sheet([
+        ['店铺A', '立减券', 5, None, '2024-06-01', '2024-06-30', '', None, None],
+        ['店铺A', '代金券', 5, None, '2024-06-01', '2024-06-30', '', None, None],
+        ['店铺B', '折扣券', 120, None, '2024-06-01', '2024-05-30', '', None, None],
+        ['店铺C', '立减券', 'abc', None, '不是日期', '2024-06-30', '', None, None],
+        ['店铺A', '立减券', 5, None, '2024-06-01', '2024-06-30', '', None, 'P1 P7 P99'],
+    ]))
+    assert coupons == []
+    assert errors == [
+        (3, "类型必须是立减券、满减券或折扣券"),
+        (4, "折扣必须在0-100之间"),
+        (4, "结束日期早于开始日期"),
+        (5, "店铺不存在"),
+        (5, "开始日期无效"),
+        (5, "面额/折扣不是有效的数字"),
+        (6, "店铺中找不到货品ID: P7, P99"),
+    ]
+
+
+def test_error_rows_count_blank_rows(temp_db):
+    """中间有空行时，错误仍报告 Excel 中的实际行号"""
+    coupons, errors = validate_coupon_frame(_sheet([
+        ['店铺A', '立减券', 5, None, '2024-06-01', '2024-06-30', '', None, None],
+        [None] * 9,
+        ['店铺A', '立减券', 'abc', None, '2024-06-01', '2024-06-30', '', None, 'P1 P99'],
+    ]))
+    assert coupons == []
+    assert errors == [(4, "店铺中找不到货品ID: P99"), (4, "面额/折扣不是有效的数字")]
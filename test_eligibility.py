@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+测试商品有效标记（is_eligible）与筛选列表的增量更新
+"""
+
+import random
+
+import database
+
+
+def _expected_eligibility(invalid_ids, enabled_skus):
+    conn = database.get_db_connection()
+    rows = conn.execute('SELECT spec_id, sku, is_eligible FROM products').fetchall()
+    conn.close()
+    invalid = {spec_id.lower() for spec_id in invalid_ids}
+    return [(row['is_eligible'], int(row['spec_id'].lower() not in invalid
+                                     and (not row['sku'] or row['sku'] == '*' or row['sku'] in enabled_skus)))
+            for row in rows]
+
+
+def test_eligibility_flag_follows_list_and_product_changes(temp_db):
+    """is_eligible 在列表更新、商品新增和修改后都与逐行判断一致"""
+    rng = random.Random(5)
+    database.add_product_batch([
+        (rng.choice([f'SKU{i}', '*', '']), f'P{i % 7}', f'Spec{i}', f'商品{i}', '', 10, 1,
+         '店铺A', '', '', '', 0, 0)
+        for i in range(200)
+    ])
+    invalid, enabled = set(), set()
+    for _ in range(4):
+        invalid = {f'SPEC{i}' for i in rng.sample(range(200), 30)}
+        enabled = {f'SKU{i}' for i in rng.sample(range(200), 120)}
+        database.update_invalid_spec_ids(invalid)
+        database.update_enabled_skus(enabled)
+        assert all(flag == expected for flag, expected in _expected_eligibility(invalid, enabled))
+
+    database.add_product_batch([('SKU9999', 'P1', 'Spec200', '新商品', '', 10, 1, '店铺A', '', '', '', 0, 0)])
+    product = dict(database.get_product_by_spec_id('Spec0'))
+    product['sku'] = sorted(enabled)[0]
+    database.update_product(product)
+    assert all(flag == expected for flag, expected in _expected_eligibility(invalid, enabled))
+
+    conn = database.get_db_connection()
+    plan = conn.execute('''EXPLAIN QUERY PLAN SELECT product_id FROM products
+                           WHERE shop_id = ? AND is_eligible = 1 GROUP BY product_id''', (1,)).fetchall()
+    conn.close()
+    assert 'idx_eligible_shop_product' in ' '.join(row[3] for row in plan)
+
+
+def test_filter_update_returns_only_the_delta(temp_db):
+    """更新筛选列表只写入变化部分，并返回新增、移除和有效状态变化的商品数"""
+    database.add_product_batch([
+        (f'SKU{i}', f'P{i}', f'Spec{i}', f'商品{i}', '', 10, 1, '店铺A', '', '', '', 0, 0)
+        for i in range(10)
+    ])
+    delta = database.update_product_filters({'SPEC1'}, {f'SKU{i}' for i in range(5)})
+    assert delta['invalid_spec_ids'] == {'added': {'spec1'}, 'removed': set(), 'eligibility_changed': 0}
+    assert delta['enabled_skus']['added'] == {f'SKU{i}' for i in range(5)}
+    # SKU1 的规格ID无效，启用后仍无效
+    assert delta['enabled_skus']['eligibility_changed'] == 4
+
+    delta = database.update_product_filters({'spec1', 'Spec2'}, {'SKU0', 'SKU1', 'SKU2', 'SKU3', 'SKU4', 'SKU7'})
+    assert delta['invalid_spec_ids'] == {'added': {'spec2'}, 'removed': set(), 'eligibility_changed': 1}
+    assert delta['enabled_skus'] == {'added': {'SKU7'}, 'removed': set(), 'eligibility_changed': 1}
+
+    delta = database.update_enabled_skus({'SKU0', 'SKU1', 'SKU2', 'SKU3', 'SKU4', 'SKU7'})
+    assert delta == {'added': set(), 'removed': set(), 'eligibility_changed': 0}
+    assert sorted(pid for pid, _ in database.get_products_by_shop('店铺A')) == ['P0', 'P3', 'P4', 'P7']
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试按查询形状建立的索引和索引对比脚本
+"""
+
+import random
+
+import database
+import index_benchmark
+
+
+def test_product_pages_follow_shop_name_spec_order(temp_db):
+    """商品列表分页按 店铺、名称、规格ID 排序，同名商品翻页不重复不遗漏，页内定位只走覆盖索引"""
+    rng = random.Random(7)
+    rows = [(f'SKU{i}', f'P{i}', f'S{i:03d}', rng.choice(['甲', '乙', '丙']), '', 10, 1,
+             rng.choice(['店铺B', '店铺A', '']), '', '', '', 0, 0) for i in range(120)]
+    database.add_product_batch(rows)
+
+    pages = [database.get_all_products(limit=25, offset=offset) for offset in range(0, 120, 25)]
+    listed = [(row['shop'], row['name'], row['spec_id']) for page in pages for row in page]
+    assert listed == sorted((row[7], row[3], row[2]) for row in rows)
+
+    conn = database.get_db_connection()
+    plan = ' '.join(row[3] for row in conn.execute('''EXPLAIN QUERY PLAN
+        SELECT p.rowid FROM shops s CROSS JOIN products p ON p.shop_id = s.id
+        ORDER BY s.name, p.name, p.spec_id LIMIT 25 OFFSET 50'''))
+    conn.close()
+    assert 'COVERING INDEX idx_shop_name_spec' in plan and 'TEMP B-TREE' not in plan
+
+
+def test_index_benchmark_compares_plans_with_and_without_indexes(monkeypatch):
+    """索引对比脚本生成可复现的测试数据：列表分页和总览平均价格走新索引，利润分析的筛选条件不走价格部分索引"""
+    monkeypatch.setattr(index_benchmark, 'PRODUCTS', 300)
+    monkeypatch.setattr(index_benchmark, 'COUPONS', 50)
+    results = index_benchmark.run_benchmark(repeat=1)
+
+    assert 'idx_shop_name_spec' in results['商品列表中间页']['有索引']['plan']
+    assert 'TEMP B-TREE' in results['商品列表中间页']['无索引']['plan']
+    assert 'idx_priced_products' in results['总览平均价格']['有索引']['plan']
+    assert 'idx_priced_products' not in results['利润分析筛选']['有索引']['plan']
+    for name, indexes, _, _ in index_benchmark.QUERIES:
+        assert not any(index in results[name]['无索引']['plan'] for index in indexes)
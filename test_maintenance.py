@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试空闲时的数据库维护：重新收集统计信息和增量回收空闲页
+"""
+
+import sqlite3
+from types import SimpleNamespace
+
+import database
+import maintenance
+from maintenance import MaintenanceScheduler, run_maintenance
+
+
+def test_maintenance_analyzes_after_large_writes_and_reclaims_free_pages(temp_db, monkeypatch):
+    """大批量写入后收集统计信息，删除数据留下的空闲页被分步回收，维护后不再需要维护"""
+    monkeypatch.setattr(maintenance, 'ANALYZE_AFTER_ROWS', 500)
+    monkeypatch.setattr(maintenance, 'VACUUM_FREELIST_PAGES', 50)
+    monkeypatch.setattr(maintenance, 'VACUUM_STEP_PAGES', 20)
+    database.add_product_batch([
+        (f'SKU{i}', f'P{i}', f'S{i}', f'商品{i}', '', 10, 1, '店铺A', '', '', '', 0, 0) for i in range(1000)
+    ])
+    database.replace_sku_extensions({f'SKU{i}': {'short_name': '简称' * 50} for i in range(5000)})
+    database.replace_sku_extensions({})
+
+    status = database.get_maintenance_status()
+    assert status['auto_vacuum'] == 2 and status['analyzed_rows'] is None
+    assert maintenance.needs_analyze(status) and maintenance.needs_vacuum(status)
+
+    report = run_maintenance()
+
+    after = database.get_maintenance_status()
+    # 回收空闲页时也会去掉不再需要的指针映射页；ANALYZE 新建 sqlite_stat1 占用一页
+    assert report['reclaimed_bytes'] >= status['freelist_pages'] * status['page_size'] > 0
+    assert after['page_count'] <= status['page_count'] - status['freelist_pages'] + 1
+    assert after['freelist_pages'] == report['freelist_pages'] == 0
+    assert report['analyze_seconds'] is not None
+    assert after['analyzed_rows'] == 1000 and after['rows_written'] == 0
+    assert not maintenance.needs_analyze(after) and not maintenance.needs_vacuum(after)
+    assert run_maintenance() == {'analyze_seconds': None, 'reclaimed_bytes': 0, 'vacuum_seconds': None,
+                                 'freelist_pages': 0}
+
+
+def test_existing_database_switches_to_incremental_auto_vacuum(empty_db, monkeypatch):
+    """升级前创建的数据库在迁移中重建为 auto_vacuum = INCREMENTAL，数据不变"""
+    path = database.DB_PATH
+    migrations = database._MIGRATIONS
+    monkeypatch.setattr(database, '_MIGRATIONS', migrations[:-1])
+    database.init_db()
+    database.add_product_batch([('SKU1', 'P1', 'S1', '商品', '', 10, 1, '店铺A', '', '', '', 0, 0)])
+    monkeypatch.setattr(database, '_MIGRATIONS', migrations)
+    assert sqlite3.connect(path).execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+
+    database.init_db()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+    conn.close()
+    assert database.get_product_by_spec_id('S1')['shop'] == '店铺A'
+
+
+def test_vacuum_migration_waits_for_free_disk_space(empty_db, monkeypatch):
+    """剩余空间不够重建数据库文件时推迟这一步：版本号和数据不变，有空间后再次启动时完成"""
+    path = database.DB_PATH
+    migrations = database._MIGRATIONS
+    monkeypatch.setattr(database, '_MIGRATIONS', migrations[:-1])
+    database.init_db()
+    database.add_product_batch([('SKU1', 'P1', 'S1', '商品', '', 10, 1, '店铺A', '', '', '', 0, 0)])
+    monkeypatch.setattr(database, '_MIGRATIONS', migrations)
+    disk_usage = database.shutil.disk_usage
+    monkeypatch.setattr(database.shutil, 'disk_usage',
+                        lambda directory: SimpleNamespace(total=10 ** 9, used=10 ** 9, free=1024))
+
+    message = database.init_db()
+
+    assert '磁盘空间不足' in message and '下次启动' in message
+    assert database.get_pending_migrations() == [migrations[-1][0]]
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    conn.close()
+    assert database.get_product_by_spec_id('S1')['shop'] == '店铺A'
+
+    monkeypatch.setattr(database.shutil, 'disk_usage', disk_usage)
+    assert database.init_db() is None
+    assert database.get_pending_migrations() == []
+    assert database.get_maintenance_status()['auto_vacuum'] == 2
+
+
+def test_scheduler_waits_for_idle_time():
+    """用户操作后要空闲满 idle_seconds 才开始维护，执行中不会重复开始"""
+    scheduler = MaintenanceScheduler(idle_seconds=60)
+    scheduler.note_activity(now=100)
+    assert not scheduler.should_run(now=159)
+    assert scheduler.should_run(now=160)
+    scheduler.start()
+    assert not scheduler.should_run(now=500)
+    scheduler.finish()
+    scheduler.note_activity(now=500)
+    assert not scheduler.should_run(now=520)
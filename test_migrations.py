@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+测试按 PRAGMA user_version 记录的数据库结构迁移
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+
+
+def _user_version():
+    conn = database.get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return version
+
+
+def test_current_database_opens_with_one_pragma_read(empty_db, monkeypatch):
+    """新数据库依次执行全部迁移并报告进度；已是最新版本时只读取一次版本号"""
+    steps = []
+    database.init_db(progress=lambda done, total, description: steps.append((done, total)))
+    total = database.SCHEMA_VERSION
+    assert steps == [(done, total) for done in range(total + 1)]
+    assert _user_version() == total
+    assert database.get_pending_migrations() == []
+
+    statements = []
+    connect = database.get_db_connection
+
+    def traced_connection():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(database, 'get_db_connection', traced_connection)
+    database.init_db(progress=lambda *args: steps.append(args))
+    assert statements == ['PRAGMA user_version']
+    assert len(steps) == total + 1
+
+
+def test_failed_migration_rolls_back_and_resumes(empty_db, monkeypatch):
+    """失败的迁移整步回滚且不更新版本号，修复后从该步继续"""
+    database.init_db()
+
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('迁移失败')
+
+    monkeypatch.setattr(database, '_MIGRATIONS', database._MIGRATIONS + [('测试迁移', broken)])
+    assert database.get_pending_migrations() == ['测试迁移']
+    with pytest.raises(RuntimeError):
+        database.init_db()
+    assert _user_version() == database.SCHEMA_VERSION
+    conn = database.get_db_connection()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute('SELECT * FROM half_done')
+    conn.close()
+
+    monkeypatch.setattr(database, '_MIGRATIONS', database._MIGRATIONS[:-1] + [
+        ('测试迁移', lambda cursor: cursor.execute('CREATE TABLE half_done (id INTEGER)'))])
+    database.init_db()
+    assert _user_version() == database.SCHEMA_VERSION + 1
+
+
+def test_legacy_text_columns_move_to_dimension_tables(empty_db):
+    """旧版数据库的店铺、分类、仓库文本迁移为维度表整数键，通过视图读取的结果不变"""
+    conn = database.get_db_connection()
+    conn.execute('''CREATE TABLE products (spec_id TEXT PRIMARY KEY, sku TEXT, product_id TEXT, name TEXT NOT NULL,
+                    spec_name TEXT, price REAL, quantity INTEGER, shop TEXT, category TEXT, warehouse TEXT)''')
+    conn.execute('CREATE TABLE sku_extensions (sku TEXT PRIMARY KEY, category TEXT, warehouse TEXT, '
+                 'short_name TEXT, min_price REAL)')
+    conn.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        ('S1', 'SKU1', 'P1', '乙商品', '', 10, 1, '店铺B', '分类A', '仓库1'),
+        ('S2', 'SKU2', 'P2', '甲商品', '', 20, 1, '店铺A', '分类A', None),
+        ('S3', '', 'P3', '丙商品', '', 30, 1, None, None, '仓库1'),
+    ])
+    conn.execute("INSERT INTO sku_extensions VALUES ('SKU2', '分类B', '仓库2', '简称', 5)")
+    conn.commit()
+    conn.close()
+
+    database.init_db()
+
+    products = [dict(row) for row in database.get_all_products()]
+    assert [(p['spec_id'], p['shop'], p['category'], p['warehouse']) for p in products] == [
+        ('S3', '', '', '仓库1'), ('S2', '店铺A', '分类B', '仓库2'), ('S1', '店铺B', '分类A', '仓库1')]
+    assert database.get_all_shops() == ['店铺A', '店铺B']
+
+    database.add_product_batch([('SKU4', 'P4', 'S4', '丁商品', '', 10, 1, '店铺C', '分类A', '', '', 0, 0)])
+    product = dict(database.get_product_by_spec_id('S1'))
+    product['shop'] = '店铺C'
+    database.update_product(product)
+    assert database.get_all_shops() == ['店铺A', '店铺C']
+    assert sorted(row[0] for row in database.get_shop_pricing_rows('店铺C')) == ['S1', 'S4']
+
+    conn = database.get_db_connection()
+    assert conn.execute('SELECT COUNT(*) FROM categories').fetchone()[0] == 3  # '', 分类A, 分类B
+    assert 'shop' not in [row[1] for row in conn.execute('PRAGMA table_info(products)')]
+    conn.close()
+
+
+def test_legacy_mixed_case_invalid_spec_ids_stay_invalid(empty_db):
+    """旧版数据库保存的无效规格ID含大写时，升级后统一为小写并去重，对应商品仍然无效"""
+    conn = database.get_db_connection()
+    conn.execute('''CREATE TABLE products (spec_id TEXT PRIMARY KEY, sku TEXT, product_id TEXT, name TEXT NOT NULL,
+                    spec_name TEXT, price REAL, quantity INTEGER, shop TEXT, category TEXT, warehouse TEXT,
+                    short_name TEXT, min_price REAL, purchase_price REAL)''')
+    conn.execute('CREATE TABLE invalid_spec_ids (invalid_spec_id TEXT PRIMARY KEY)')
+    conn.execute('CREATE TABLE enabled_skus (enabled_sku TEXT PRIMARY KEY)')
+    conn.executemany('INSERT INTO products (spec_id, sku, product_id, name, shop) VALUES (?, ?, ?, ?, ?)', [
+        ('n', '', 'P1', '甲商品', '店铺A'),
+        ('Sx2', '', 'P2', '乙商品', '店铺A'),
+        ('S3', '', 'P3', '丙商品', '店铺A'),
+    ])
+    conn.executemany('INSERT INTO invalid_spec_ids VALUES (?)', [('N',), ('SX2',), ('sx2',)])
+    conn.commit()
+    conn.close()
+
+    database.init_db()
+
+    assert database.get_products_by_shop('店铺A') == [('P3', '丙商品')]
+    conn = database.get_db_connection()
+    assert sorted(row[0] for row in conn.execute('SELECT invalid_spec_id FROM invalid_spec_ids')) == ['n', 'sx2']
+    conn.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试价格分析的档位统计与分档明细
+"""
+
+import time
+
+import database
+from price_analysis import AnalysisRunner
+
+
+def _product(index, price, purchase_price, shop='测试店铺'):
+    return (f'SKU{index}', f'PROD{index}', f'SPEC{index}', f'商品{index}', '规格', price, 1,
+            shop, '分类', '仓库', f'简称{index}', 0, purchase_price)
+
+
+def test_tier_counts_match_python_calculation(temp_db):
+    """聚合查询的档位统计应与逐行计算一致"""
+    products = [
+        _product(1, 200.0, 120.0),   # 净利率 15%
+        _product(2, 80.0, 60.0),     # 净利率 12.5%
+        _product(3, 150.0, 100.0),   # 净利率 3.3%
+        _product(4, 100.0, 95.0),    # 净利率 -7%
+        _product(5, 100.0, 10.0),    # 净利率 78%
+        _product(6, 100.0, ''),      # 无采购价按 0 计算
+        _product(7, 0, 10.0),        # 无价格，不参与分析
+        _product(8, '', 10.0),
+    ]
+    database.add_product_batch(products)
+
+    expected = {tier: 0 for tier, _, _ in database.MARGIN_TIERS}
+    for product in products:
+        price = float(product[5] or 0)
+        if price <= 0:
+            continue
+        profit = database.calculate_profit(price, product[12])
+        expected[database.get_margin_tier(profit['net_margin_rate'])] += 1
+
+    assert database.get_margin_tier_counts() == expected
+    assert expected == {'healthy': 2, 'normal': 2, 'warning': 1, 'loss': 1}
+
+
+def test_tier_detail_is_paged(temp_db):
+    """分档明细按页返回，且只包含对应档位的商品"""
+    database.add_product_batch([_product(i, 100.0, 95.0) for i in range(5)] +
+                               [_product(10 + i, 100.0, 10.0) for i in range(3)])
+
+    first_page = database.get_products_by_margin_tier('loss', limit=3, offset=0)
+    second_page = database.get_products_by_margin_tier('loss', limit=3, offset=3)
+    assert len(first_page) == 3
+    assert len(second_page) == 2
+    assert all(row['net_margin_rate'] < 0 for row in first_page + second_page)
+    assert len(database.get_products_by_margin_tier('healthy')) == 3
+
+
+def test_final_price_runs_once_per_product(temp_db):
+    """按到手价分页时 final_price() 每个商品只调用一次，不随利润各列和档位条件重复调用"""
+    database.add_product_batch([_product(i, 100.0 + i, 30.0) for i in range(40)] + [_product(99, 0, 10.0)])
+    calls = []
+    def final_price(price, shop, product_id):
+        calls.append(product_id)
+        return price * 0.9
+
+    rows = database.get_products_by_margin_tier('healthy', limit=5, price_function=final_price)
+    assert len(rows) == 5 and rows[0]['final_price'] == 90.0
+    assert sorted(calls) == sorted(f'PROD{i}' for i in range(40))
+
+
+def test_analysis_runner_streams_progress_and_result(temp_db):
+    """后台进程分块统计的结果应与聚合查询一致，且只回传最新任务的消息"""
+    database.add_product_batch([_product(i, 50.0 + i, 30.0) for i in range(50)])
+    runner = AnalysisRunner()
+    try:
+        runner.submit()
+        runner.submit()  # 新任务取代旧任务
+        messages = []
+        deadline = time.time() + 30
+        while not any(kind in ('done', 'error') for kind, _ in messages) and time.time() < deadline:
+            messages.extend(runner.poll())
+            time.sleep(0.05)
+    finally:
+        runner.shutdown()
+
+    kinds = [kind for kind, _ in messages]
+    assert 'progress' in kinds
+    assert kinds[-2:] == ['rowids', 'done']
+    counts = database.get_margin_tier_counts()
+    assert messages[-1][1] == counts
+
+    # 按分析进程回传的 rowid 分页与按SQL扫描分页的明细一致，每页只为这一页的商品计算到手价
+    calls = []
+    def final_price(price, shop, product_id):
+        calls.append(product_id)
+        return price
+    rowids = messages[-2][1]
+    for tier, count in counts.items():
+        assert len(rowids[tier]) == count
+        pages = []
+        for offset in range(0, count, 7):
+            calls.clear()
+            pages += database.get_products_by_margin_tier(tier, limit=7, offset=offset,
+                                                          price_function=final_price, rowids=rowids[tier])
+            assert len(calls) <= 7
+        assert [tuple(row) for row in pages] == [
+            tuple(row) for row in database.get_products_by_margin_tier(tier, limit=count)]
+
+
+def test_dead_worker_reports_an_error(temp_db):
+    """分析进程在任务完成前退出时返回错误消息，之后提交的任务重新启动进程"""
+    database.add_product_batch([_product(i, 50.0 + i, 30.0) for i in range(50)])
+    runner = AnalysisRunner()
+    try:
+        runner.submit()
+        runner._process.kill()
+        runner._process.join()
+        messages = runner.poll()
+        assert messages[-1][0] == 'error' and '意外退出' in messages[-1][1]
+        assert runner.poll() == []
+
+        runner.submit()
+        messages = []
+        deadline = time.time() + 30
+        while not any(kind in ('done', 'error') for kind, _ in messages) and time.time() < deadline:
+            messages.extend(runner.poll())
+            time.sleep(0.05)
+        assert messages[-1] == ('done', database.get_margin_tier_counts())
+    finally:
+        runner.shutdown()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+测试按店铺编译的优惠券集合与逐张计算的到手价一致
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import database
+import pricing
+
+
+def _add_random_coupons(rng, shop, product_ids, count):
+    today = datetime.now()
+    for _ in range(count):
+        coupon_type = rng.choice(['instant', 'threshold', 'discount'])
+        amount = round(rng.uniform(0.5, 0.95), 2) if coupon_type == 'discount' else rng.choice([5, 10, 20, 50])
+        specific = rng.random() < 0.3
+        database.add_coupon({
+            'shop': shop,
+            'coupon_type': coupon_type,
+            'amount': amount,
+            'min_price': rng.choice([0, 50, 100, 199]),
+            'start_date': (today - timedelta(days=1)).strftime('%Y-%m-%d'),
+            'end_date': (today + timedelta(days=1)).strftime('%Y-%m-%d'),
+            'description': '',
+            'is_active': 1,
+            'product_ids': json.dumps(rng.sample(product_ids, 2)) if specific else ''
+        })
+
+
+def _add_random_products(rng, shops, product_ids, count):
+    products = []
+    for i in range(count):
+        price = rng.choice([0, '', round(rng.uniform(1, 400), 2)])
+        products.append((f'SKU{i}', rng.choice(product_ids), f'SPEC{i}', f'商品{i}', '规格', price, 1,
+                         rng.choice(shops), '', '', '', rng.choice([0, round(rng.uniform(20, 300), 2)]),
+                         round(rng.uniform(0, 300), 2)))
+    database.add_product_batch(products)
+    return products
+
+
+def test_compiled_prices_match_calculate_final_price(temp_db):
+    """编译后的单行计算和批量计算都应与 calculate_final_price 一致"""
+    rng = random.Random(7)
+    product_ids = [f'PROD{i}' for i in range(10)]
+    _add_random_coupons(rng, '店铺A', product_ids, 12)
+    _add_random_coupons(rng, '店铺B', product_ids, 3)
+
+    coupon_sets = pricing.load_coupon_sets()
+    prices = [round(rng.uniform(1, 400), 2) for _ in range(300)] + [50, 100, 199, 0]
+    for shop in ['店铺A', '店铺B']:
+        items = [(price, rng.choice(product_ids + [None])) for price in prices]
+        expected = [database.calculate_final_price(price, shop, product_id) for price, product_id in items]
+        scalar = [coupon_sets[shop].final_price(price, product_id) for price, product_id in items]
+        bulk = coupon_sets[shop].final_prices([p for p, _ in items], [pid for _, pid in items])
+        assert scalar == expected
+        assert list(bulk) == expected
+
+
+def test_bulk_analysis_matches_sql_with_final_prices(temp_db):
+    """批量分析的档位统计应与按到手价逐行计算的SQL统计一致"""
+    rng = random.Random(11)
+    shops = ['店铺A', '店铺B', '店铺C']
+    product_ids = [f'PROD{i}' for i in range(20)]
+    _add_random_coupons(rng, '店铺A', product_ids, 8)
+    _add_random_coupons(rng, '店铺B', product_ids, 2)
+    _add_random_products(rng, shops, product_ids, 500)
+
+    start, end = database.get_products_rowid_range()
+    counts = pricing.analyze_pricing_rows(database.get_pricing_rows((start, end)), pricing.load_coupon_sets())
+    expected = database.get_margin_tier_counts(price_function=pricing.CouponPricer().final_price)
+    assert counts == expected
+    assert counts != database.get_margin_tier_counts()  # 优惠券确实改变了档位
+
+
+def test_pricer_recompiles_after_coupon_change(temp_db):
+    """优惠券修改后缓存的编译结果应失效"""
+    pricer = pricing.CouponPricer()
+    assert pricer.final_price(100.0, '店铺A') == 100.0
+    today = datetime.now().strftime('%Y-%m-%d')
+    database.add_coupon({'shop': '店铺A', 'coupon_type': 'instant', 'amount': 10, 'min_price': 0,
+                         'start_date': today, 'end_date': today, 'description': '',
+                         'is_active': 1, 'product_ids': ''})
+    assert pricer.final_price(100.0, '店铺A') == 90.0
+
+
+def test_envelope_matches_coupon_loop():
+    """分段最优价函数在断点附近与逐张计算一致"""
+    coupons = [
+        {'coupon_type': 'threshold', 'amount': 20, 'min_price': 100},
+        {'coupon_type': 'threshold', 'amount': 15, 'min_price': 150},  # 被更低门槛的大额券覆盖
+        {'coupon_type': 'threshold', 'amount': 50, 'min_price': 199},
+        {'coupon_type': 'instant', 'amount': 5, 'min_price': 300},     # 立减券不看门槛
+        {'coupon_type': 'discount', 'amount': 0.8, 'min_price': 0},
+    ]
+    envelope = pricing.CouponEnvelope(coupons)
+    assert envelope.breakpoints == [0, 100, 150, 199]
+    assert envelope.step_amounts == [0, 5, 20, 20, 50]
+    prices = [0.5, 4, 99.99, 100, 100.01, 149.99, 150, 198.99, 199, 250, 1000]
+    for price in prices:
+        expected = min([price] + [database.apply_coupon_discount(price, c) for c in coupons
+                                  if database.apply_coupon_discount(price, c) is not None])
+        assert envelope.best_price(price) == expected
+    assert list(envelope.best_prices(np.array(prices))) == [envelope.best_price(p) for p in prices]
+
+
+def test_pricer_rebuilds_only_changed_shop(temp_db):
+    """只有优惠券被修改的店铺会重新编译"""
+    pricer = pricing.CouponPricer()
+    shop_a = pricer.coupon_set('店铺A')
+    shop_b = pricer.coupon_set('店铺B')
+    today = datetime.now().strftime('%Y-%m-%d')
+    coupon_id = database.add_coupon({'shop': '店铺A', 'coupon_type': 'instant', 'amount': 10, 'min_price': 0,
+                                     'start_date': today, 'end_date': today, 'description': '',
+                                     'is_active': 1, 'product_ids': ''})
+    assert pricer.coupon_set('店铺B') is shop_b
+    assert pricer.coupon_set('店铺A') is not shop_a
+    assert pricer.final_price(100.0, '店铺A') == 90.0
+
+    # 把优惠券改到店铺B，两个店铺都要重新编译
+    coupon = dict(zip(database.COUPON_COLUMNS, database.get_coupon_by_id(coupon_id)))
+    coupon['shop'] = '店铺B'
+    database.update_coupon(coupon)
+    assert pricer.final_price(100.0, '店铺A') == 100.0
+    assert pricer.final_price(100.0, '店铺B') == 90.0
+
+
+def test_impact_simulator_matches_full_recompute(temp_db):
+    """影响预览只重算覆盖的行，结果应与保存后整店重新计算一致"""
+    rng = random.Random(3)
+    product_ids = [f'PROD{i}' for i in range(15)]
+    _add_random_coupons(rng, '店铺A', product_ids, 6)
+    products = _add_random_products(rng, ['店铺A'], product_ids, 300)
+    floors = {row[2]: row[11] for row in products}
+    edited = dict(zip(database.COUPON_COLUMNS, database.get_active_coupons_by_shop('店铺A')[0]))
+
+    simulator = pricing.CouponImpactSimulator('店铺A', exclude_coupon_id=edited['id'])
+    drafts = [
+        ({'coupon_type': 'threshold', 'amount': 30, 'min_price': 120}, None),
+        ({'coupon_type': 'discount', 'amount': 0.6, 'min_price': 0}, ['PROD1', 'PROD2']),
+        ({'coupon_type': 'instant', 'amount': 500, 'min_price': 0}, ['PROD3']),
+    ]
+    rows = database.get_shop_pricing_rows('店铺A')
+    prices = [pricing._to_float(row[3]) for row in rows]
+    before = [pricing.CouponPricer().final_price(price, '店铺A', row[1]) for price, row in zip(prices, rows)]
+    for draft, scope in drafts:
+        result = simulator.simulate(draft, scope)
+
+        coupon = dict(edited, **draft, product_ids=json.dumps(scope) if scope else '')
+        database.update_coupon(coupon)
+        pricer = pricing.CouponPricer()
+        after = [pricer.final_price(price, '店铺A', row[1]) for price, row in zip(prices, rows)]
+        assert result['repriced'] == sum(1 for a, b in zip(before, after) if a != b)
+        assert result['tiers_after'] == database.get_margin_tier_counts(price_function=pricer.final_price)
+        below = [row[0] for row, price, final in zip(rows, prices, after)
+                 if price > 0 and pricing._to_float(row[5]) > 0 and final < pricing._to_float(row[5])]
+        assert result['below_min_price_count'] == len(below) > 0
+        assert all(floors[item['spec_id']] > item['final_price'] for item in result['below_min_price'])
+
+
+def _add_dated_coupon(shop, coupon_type, amount, start, end, min_price=0, product_ids=''):
+    database.add_coupon({'shop': shop, 'coupon_type': coupon_type, 'amount': amount, 'min_price': min_price,
+                         'start_date': start.isoformat(), 'end_date': end.isoformat(), 'description': '',
+                         'is_active': 1, 'product_ids': product_ids})
+
+
+def test_price_timeline_matches_day_by_day(temp_db):
+    """按有效期边界切分的时段价格应与逐日计算一致"""
+    today = datetime.now().date()
+    day = timedelta(days=1)
+    _add_dated_coupon('店铺A', 'instant', 10, today - day, today + 2 * day)
+    _add_dated_coupon('店铺A', 'discount', 0.7, today + 5 * day, today + 9 * day)
+    _add_dated_coupon('店铺A', 'threshold', 40, today + 3 * day, today + 40 * day, min_price=100)
+    _add_dated_coupon('店铺A', 'instant', 60, today + 1 * day, today + 4 * day, product_ids=json.dumps(['PROD2']))
+    rng = random.Random(5)
+    _add_random_products(rng, ['店铺A'], ['PROD1', 'PROD2'], 40)
+
+    timeline = pricing.shop_price_timeline('店铺A', days=14)
+    periods = timeline['periods']
+    assert periods[0]['start_date'] == today.isoformat()
+    assert periods[-1]['end_date'] == (today + 13 * day).isoformat()
+    # 边界：今天、+1（货品券开始）、+3（立减结束/满减开始）、+5（货品券结束/折扣开始）、+10（折扣结束）
+    assert len(periods) == 5
+
+    for spec_id in timeline['spec_ids'][:10]:
+        product = dict(zip(database.DB_COLUMNS, database.get_product_by_spec_id(spec_id)))
+        sku_timeline = pricing.sku_price_timeline(spec_id, days=14)
+        column = timeline['spec_ids'].index(spec_id)
+        for offset in range(14):
+            current = (today + offset * day).isoformat()
+            expected = database.calculate_final_price(product['price'], '店铺A', product['product_id'], as_of=current)
+            period = next(p for p in periods if p['start_date'] <= current <= p['end_date'])
+            sku_period = next(p for p in sku_timeline if p['start_date'] <= current <= p['end_date'])
+            assert period['final_prices'][column] == (expected or 0)
+            assert sku_period['final_price'] == (expected or 0)
+
+
+def test_boundary_scheduler_invalidates_only_affected_shops(temp_db):
+    """跨过优惠券生效/失效日期后只让相关店铺的缓存失效"""
+    today = datetime.now().date()
+    day = timedelta(days=1)
+    _add_dated_coupon('店铺A', 'instant', 10, today - day, today)             # 明天失效
+    _add_dated_coupon('店铺B', 'instant', 10, today + 3 * day, today + 5 * day)  # 3天后生效
+    _add_dated_coupon('店铺C', 'instant', 10, today - day, today + 30 * day)
+
+    pricer = pricing.CouponPricer()
+    scheduler = pricing.CouponBoundaryScheduler(pricer)
+    assert scheduler.next_boundary == (today + day).isoformat()
+    assert 0 < scheduler.seconds_until_next() <= 24 * 3600
+
+    cached = {shop: pricer.coupon_set(shop) for shop in ['店铺A', '店铺B', '店铺C']}
+    assert scheduler.advance(today.isoformat()) == set()
+    # 休眠跨过多个边界时一次处理完
+    assert scheduler.advance((today + 4 * day).isoformat()) == {'店铺A', '店铺B'}
+    assert pricer.coupon_set('店铺A') is not cached['店铺A']
+    assert pricer.coupon_set('店铺B') is not cached['店铺B']
+    assert pricer.coupon_set('店铺C') is cached['店铺C']
+    assert scheduler.next_boundary == (today + 6 * day).isoformat()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试优惠券货品选择器的货品查询和搜索索引
+"""
+
+import random
+
+import database
+from product_search import ProductSearchIndex
+
+
+def test_shop_products_filter_invalid_and_disabled_specs(temp_db):
+    """无效规格ID（不区分大小写）和未启用的规格编码被排除，货品按ID去重"""
+    database.add_product_batch([
+        ('SKU1', 'P1', 'S1', '乙商品', '', 10, 1, '店铺A', '', '', '', 0, 0),
+        ('SKU2', 'P1', 'S2', '乙商品', '', 10, 1, '店铺A', '', '', '', 0, 0),
+        ('SKU3', 'P2', 'Sx3', '甲商品', '', 10, 1, '店铺A', '', '', '', 0, 0),
+        ('SKU4', 'P3', 'S4', '丙商品', '', 10, 1, '店铺A', '', '', '', 0, 0),
+        ('*', 'P4', 'S5', '丁商品', '', 10, 1, '店铺A', '', '', '', 0, 0),
+        ('SKU6', 'P5', 'S6', '戊商品', '', 10, 1, '店铺B', '', '', '', 0, 0),
+    ])
+    database.update_invalid_spec_ids({'SX3'})
+    database.update_enabled_skus({'SKU1', 'SKU3', 'SKU6'})
+
+    products = database.get_products_by_shop('店铺A')
+    assert sorted(products) == [('P1', '乙商品'), ('P4', '丁商品')]
+
+
+def test_incremental_search_matches_fresh_search():
+    """在上一次结果中继续筛选与从头搜索结果一致，货品ID前缀匹配排在前面"""
+    rng = random.Random(3)
+    products = [(str(rng.randrange(10 ** 6)), f'商品{rng.choice("ABC")}{i}') for i in range(3000)]
+    index = ProductSearchIndex(products)
+    for query in ['1', '12', '123', '2', 'a', 'a1', '商品b', '商品b2']:
+        narrowed = index.search(query)
+        assert narrowed == ProductSearchIndex(products).search(query)
+        expected = [i for i, (pid, name) in enumerate(products)
+                    if query in pid.lower() or query in name.lower()]
+        assert sorted(narrowed) == expected
+        ranks = [not products[i][0].startswith(query) for i in narrowed]
+        assert ranks == sorted(ranks)
+    assert index.search('') == list(range(len(products)))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试连接的存储配置、规范化后的商品数据读写和存储配置对比脚本
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import storage_benchmark
+
+
+def test_connection_applies_storage_profile(temp_db):
+    """打开连接时应用存储配置，WAL 模式下写事务进行中仍可读取"""
+    writer = database.get_db_connection()
+    assert writer.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert writer.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert writer.execute('PRAGMA temp_store').fetchone()[0] == 2  # MEMORY
+    assert writer.execute('PRAGMA mmap_size').fetchone()[0] == database.STORAGE_PROFILES['balanced']['mmap_size']
+
+    writer.execute("INSERT INTO shops (name) VALUES ('店铺A')")
+    reader = database.get_db_connection()
+    assert reader.execute('SELECT COUNT(*) FROM shops').fetchone()[0] == 0
+    writer.commit()
+    assert reader.execute('SELECT COUNT(*) FROM shops').fetchone()[0] == 1
+    reader.close()
+    writer.close()
+
+    conn = database.get_db_connection(profile='default')
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    conn.close()
+
+
+def test_reads_use_a_snapshot_while_an_import_is_in_flight(temp_db):
+    """导入事务未提交时，浏览和搜索从只读连接池读取提交前的快照，不被阻塞"""
+    database.add_product_batch([('SKU1', 'P1', 'S1', '商品1', '', 10, 1, '店铺A', '', '', '', 0, 5)])
+    writer = database.get_db_connection()
+    writer.execute('BEGIN IMMEDIATE')
+    writer.execute("INSERT INTO shops (name) VALUES ('店铺B')")
+    writer.executemany('INSERT INTO products (spec_id, name, shop_id, category_id, warehouse_id) VALUES (?, ?, 1, 1, 1)',
+                       [(f'NEW{i}', f'新商品{i}') for i in range(2000)])
+
+    assert database.get_all_products_count() == 1
+    assert [row['spec_id'] for row in database.search_products('商品')] == ['S1']
+    assert database.get_all_shops() == ['店铺A']
+    writer.commit()
+    writer.close()
+    assert database.get_all_products_count() == 2001
+
+    with database.read_connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO shops (name) VALUES ('店铺C')")
+
+
+def test_locked_reads_are_retried(temp_db, monkeypatch):
+    """只读查询在等待超时后仍被锁定时按退避重试，其他错误直接抛出"""
+    monkeypatch.setattr(database, 'READ_RETRY_DELAY', 0)
+    attempts = []
+
+    def flaky(conn):
+        attempts.append(conn)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+
+    assert database._read(flaky) == 0
+    assert len(attempts) == 3
+
+    def broken(conn):
+        raise sqlite3.OperationalError('no such table: missing')
+
+    with pytest.raises(sqlite3.OperationalError):
+        database._read(broken)
+
+
+def test_benchmark_runs_every_profile_on_a_copy(temp_db, monkeypatch):
+    """对比脚本在副本上运行每个配置，原数据库不变"""
+    database.add_product_batch([(f'SKU{i}', f'P{i}', f'S{i}', f'商品{i}', '', 10, 1, '店铺A', '', '', '', 0, 5)
+                                for i in range(20)])
+    monkeypatch.setattr(storage_benchmark, 'IMPORT_ROWS', 10)
+    results = storage_benchmark.run_benchmark(database.DB_PATH, repeat=1)
+    assert set(results) == set(database.STORAGE_PROFILES)
+    assert all(set(timings) == {'导入', '搜索', '分析'} for timings in results.values())
+    assert database.get_all_products_count() == 20
+
+
+def test_purchase_price_is_joined_by_short_name(temp_db):
+    """扩展信息按规格编码、采购价按简称关联；修改一个简称的采购价只写一行即影响所有该简称商品"""
+    database.add_product_batch([
+        ('SKU1', 'PROD1', 'SPEC1', '商品1', '', 200.0, 1, '测试店铺', '', '', '', '', ''),
+        ('SKU2', 'PROD2', 'SPEC2', '商品2', '', 200.0, 1, '测试店铺', '', '', '', '', ''),
+        ('SKU3', 'PROD3', 'SPEC3', '商品3', '', 200.0, 1, '测试店铺', '旧分类', '', '旧简称', 5, 120.0),
+    ])
+    database.replace_sku_extensions({
+        'SKU1': {'category': '分类A', 'warehouse': '仓库A', 'short_name': '简称A', 'min_price': 150},
+        'SKU2': {'category': '分类B', 'warehouse': '仓库B', 'short_name': '简称A', 'min_price': 160},
+    })
+    database.replace_purchase_prices({'简称A': 120.0})
+
+    product = dict(database.get_product_by_spec_id('SPEC2'))
+    assert (product['category'], product['short_name'], product['min_price'], product['purchase_price']) == \
+        ('分类B', '简称A', 160, 120.0)
+    # 没有关联数据的商品使用商品行自身的值
+    assert dict(database.get_product_by_spec_id('SPEC3'))['category'] == '旧分类'
+    assert database.get_margin_tier_counts()['normal'] == 3
+
+    database.update_purchase_price('简称A', 180.0)
+    assert database.get_purchase_price('简称A') == 180.0
+    assert database.get_margin_tier_counts() == {'healthy': 0, 'normal': 1, 'warning': 0, 'loss': 2}
+    rows = database.get_pricing_rows(database.get_products_rowid_range())
+    assert sorted(row['purchase_price'] for row in rows) == [120.0, 180.0, 180.0]
+
+    # 手动编辑写入优先级更高的关联行
+    product['category'] = '分类C'
+    database.update_product(product)
+    assert dict(database.get_product_by_spec_id('SPEC2'))['category'] == '分类C'
+
+
+def test_products_by_spec_ids_splits_long_lists(temp_db, monkeypatch):
+    """规格ID多于绑定参数上限时分批查询，结果与逐个读取一致"""
+    monkeypatch.setattr(database, 'MAX_SQL_VARIABLES', 7)
+    database.add_product_batch([
+        (f'SKU{i}', f'PROD{i}', f'SPEC{i}', f'商品{i}', '', 50.0, 1, '测试店铺', '', '', '', 0, 30.0)
+        for i in range(30)
+    ])
+    spec_ids = [f'SPEC{i}' for i in range(0, 30, 2)] + ['MISSING']
+
+    products = database.get_products_by_spec_ids(spec_ids)
+    assert sorted(row['spec_id'] for row in products) == sorted(spec_ids[:-1])
+    assert database.get_products_by_spec_ids([]) == []